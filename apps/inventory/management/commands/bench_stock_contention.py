@@ -0,0 +1,110 @@
+"""
+Concurrency benchmark for the stock mutation service
+Hammers a single SKU from many threads and checks that it is never oversold
+
+Usage: python manage.py bench_stock_contention --threads 16 --stock 200
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, transaction
+
+from apps.products.models import Product
+from apps.inventory.models import StockMovement
+from apps.inventory.services import InsufficientStock, record_movements, remove_stock
+
+
+class Command(BaseCommand):
+    help = 'Sell one SKU from many threads at once and verify there is no oversell'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Number of concurrent tills')
+        parser.add_argument('--stock', type=int, default=200, help='Starting stock of the benchmark SKU')
+        parser.add_argument('--attempts', type=int, default=25, help='Sales attempted per thread')
+        parser.add_argument('--quantity', type=int, default=1, help='Units per sale')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark product afterwards')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        attempts = options['attempts']
+        quantity = options['quantity']
+        initial_stock = options['stock']
+
+        product = Product.objects.create(
+            name='Contention Benchmark SKU',
+            sku=f'BENCH-{int(time.time() * 1000)}',
+            cost_price=1,
+            selling_price=1,
+            current_stock=initial_stock,
+            is_active=False,
+        )
+
+        results = {'sold': 0, 'rejected': 0, 'retries': 0}
+        results_lock = threading.Lock()
+        start_gate = threading.Barrier(threads)
+
+        def till():
+            close_old_connections()
+            start_gate.wait()
+            try:
+                for _ in range(attempts):
+                    outcome = self._sell(product.id, quantity)
+                    with results_lock:
+                        results[outcome[0]] += 1
+                        results['retries'] += outcome[1]
+            finally:
+                connection.close()
+
+        self.stdout.write(
+            f'{threads} threads x {attempts} sales of {quantity} unit(s) '
+            f'against stock {initial_stock} on {connection.vendor}'
+        )
+        workers = [threading.Thread(target=till) for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        product.refresh_from_db()
+        movements = StockMovement.objects.filter(product=product, movement_type='OUT')
+        movement_count = movements.count()
+        expected_stock = initial_stock - results['sold'] * quantity
+
+        self.stdout.write(
+            f"sold={results['sold']} rejected={results['rejected']} "
+            f"retries={results['retries']} final_stock={product.current_stock} "
+            f"elapsed={elapsed:.2f}s ({(results['sold'] + results['rejected']) / elapsed:.0f} ops/s)"
+        )
+
+        if not options['keep']:
+            product.delete()
+
+        if product.current_stock < 0:
+            raise CommandError(f'Oversold: stock went negative ({product.current_stock})')
+        if product.current_stock != expected_stock:
+            raise CommandError(
+                f'Lost update: expected stock {expected_stock}, found {product.current_stock}'
+            )
+        if movement_count != results['sold']:
+            raise CommandError(
+                f'Movement mismatch: {movement_count} movements for {results["sold"]} sales'
+            )
+        self.stdout.write(self.style.SUCCESS('No oversell and no lost updates'))
+
+    def _sell(self, product_id, quantity, max_retries=50):
+        """Attempt one sale, retrying on lock timeouts. Returns (outcome, retries)"""
+        for retry in range(max_retries):
+            try:
+                with transaction.atomic():
+                    changes = remove_stock({product_id: quantity})
+                    record_movements(changes, 'OUT', reference='BENCH')
+                return 'sold', retry
+            except InsufficientStock:
+                return 'rejected', retry
+            except OperationalError:
+                # SQLite reports "database is locked" instead of blocking
+                time.sleep(0.005 * (retry + 1))
+        return 'rejected', max_retries
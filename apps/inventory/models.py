@@ -29,8 +29,20 @@ class StockMovement(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['product', '-created_at']),
+            models.Index(fields=['-created_at']),
             models.Index(fields=['movement_type']),
         ]
     
     def __str__(self):
-        return f"{self.product.name} - {self.movement_type} ({self.quantity})"
\ No newline at end of file
+        return f"{self.product.name} - {self.movement_type} ({self.quantity})"
+
+class Counter(models.Model):
+    """
+    Named counter bumped with a single atomic UPDATE
+    Backs document numbering (SALE-YYYYMMDD, PO-YYYYMMDD) and change stamps
+    """
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name} = {self.value}"
@@ -0,0 +1,145 @@
+"""
+Stock mutation service
+Every change to Product.current_stock goes through here so concurrent tills
+and back-office adjustments can't lose each other's updates
+"""
+from collections import namedtuple
+
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from apps.products.catalog import on_stock_changed
+from config.caching import LOW_STOCK, STOCK, invalidate_on_commit
+from apps.products.models import Product
+from .models import StockMovement
+
+
+StockChange = namedtuple('StockChange', ['product', 'stock_before', 'stock_after'])
+
+LOCKED_FIELDS = (
+    'id', 'name', 'sku', 'selling_price', 'cost_price',
+    'current_stock', 'reorder_level', 'category', 'is_active',
+)
+
+
+class InsufficientStock(Exception):
+    """Raised when a decrement would take a product below zero"""
+
+    def __init__(self, product):
+        super().__init__(f'Insufficient stock for {product.name}')
+        self.product = product
+
+
+def lock_products(product_ids):
+    """
+    Lock product rows with SELECT ... FOR UPDATE
+    Rows are always locked in ascending id order so two transactions touching
+    overlapping baskets can't deadlock. Must be called inside transaction.atomic().
+    """
+    products = Product.objects.select_for_update().filter(
+        id__in=product_ids
+    ).order_by('id').only(*LOCKED_FIELDS)
+    return {product.id: product for product in products}
+
+
+def apply_stock_changes(deltas, products=None):
+    """
+    Apply signed stock deltas {product_id: change} in one conditional UPDATE
+
+    Decrements are guarded by current_stock >= quantity in the WHERE clause,
+    so stock can never go negative even on backends without row locks.
+    Returns {product_id: StockChange} with the before/after levels.
+    Raises Product.DoesNotExist or InsufficientStock; callers should let the
+    exception roll back the surrounding transaction.
+    """
+    if not deltas:
+        return {}
+    if products is None:
+        products = lock_products(list(deltas))
+    if len(products) != len(deltas):
+        raise Product.DoesNotExist('Product not found')
+
+    for product_id in sorted(deltas):
+        product = products[product_id]
+        if product.current_stock + deltas[product_id] < 0:
+            raise InsufficientStock(product)
+
+    guard = Q()
+    for product_id, delta in deltas.items():
+        if delta < 0:
+            guard |= Q(id=product_id, current_stock__gte=-delta)
+        else:
+            guard |= Q(id=product_id)
+
+    updated = Product.objects.filter(guard).update(
+        current_stock=Case(
+            *[When(id=product_id, then=F('current_stock') + delta)
+              for product_id, delta in deltas.items()],
+            default=F('current_stock'),
+        ),
+        updated_at=timezone.now()
+    )
+    if updated != len(deltas):
+        # Only reachable when rows weren't actually locked (e.g. SQLite) and
+        # another writer got in between the read and the update
+        short = Product.objects.filter(id__in=list(deltas)).only(*LOCKED_FIELDS)
+        for product in short:
+            if product.current_stock + deltas[product.id] < 0:
+                raise InsufficientStock(product)
+        raise InsufficientStock(next(iter(products.values())))
+
+    changes = {}
+    for product_id, delta in deltas.items():
+        product = products[product_id]
+        stock_before = product.current_stock
+        product.current_stock = stock_before + delta
+        changes[product_id] = StockChange(product, stock_before, product.current_stock)
+
+    on_stock_changed({pid: change.stock_after for pid, change in changes.items()})
+    invalidate_on_commit(STOCK)
+    if any(crosses_reorder_level(change) for change in changes.values()):
+        invalidate_on_commit(LOW_STOCK)
+    return changes
+
+
+def crosses_reorder_level(change):
+    """True if a stock change moved the product into or out of low stock"""
+    reorder_level = change.product.reorder_level
+    return (change.stock_before <= reorder_level) != (change.stock_after <= reorder_level)
+
+
+def remove_stock(quantities):
+    """Decrement stock for {product_id: quantity}"""
+    return apply_stock_changes({pid: -qty for pid, qty in quantities.items()})
+
+
+def add_stock(quantities):
+    """Increment stock for {product_id: quantity}"""
+    return apply_stock_changes(dict(quantities))
+
+
+def set_stock(product_id, level):
+    """Set a product's stock to an absolute level (stock take adjustments)"""
+    products = lock_products([product_id])
+    if product_id not in products:
+        raise Product.DoesNotExist('Product not found')
+    delta = level - products[product_id].current_stock
+    return apply_stock_changes({product_id: delta}, products=products)
+
+
+def record_movements(changes, movement_type, reference='', notes='', user=None):
+    """Bulk insert one StockMovement per StockChange"""
+    movements = [
+        StockMovement(
+            product=change.product,
+            movement_type=movement_type,
+            quantity=abs(change.stock_after - change.stock_before),
+            reference=reference,
+            notes=notes,
+            stock_before=change.stock_before,
+            stock_after=change.stock_after,
+            created_by=user
+        )
+        for change in changes.values()
+    ]
+    return StockMovement.objects.bulk_create(movements)
@@ -1,3 +1,189 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.products.models import Product
+from apps.sales.checkout import checkout
+from apps.sales.models import Sale
+from apps.suppliers.models import PurchaseOrder, PurchaseOrderItem, Supplier
+from config.context_processors import inventory_context
+from .counters import NumberAllocator, current
+from .models import Counter, StockMovement
+from .services import InsufficientStock, add_stock, apply_stock_changes, lock_products, remove_stock
+
+
+class LowStockCountTests(TestCase):
+    """The low-stock badge in base.html shouldn't cost a query per page"""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('clerk', password='pw')
+        self.product = Product.objects.create(
+            name='Bread', sku='BRD-1', cost_price=40, selling_price=55,
+            current_stock=20, reorder_level=10,
+        )
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+
+    def move_stock(self, change, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                change({self.product.id: quantity})
+
+    def test_page_render_adds_no_queries(self):
+        self.client.force_login(self.user)
+        url = reverse('inventory:adjust_stock', args=[self.product.id])
+        self.client.get(url)
+
+        # Session, user, the product and the user's profile; nothing for the badge
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.context['low_stock_count'], 0)
+
+    def test_count_refreshes_when_stock_crosses_reorder_level(self):
+        self.assertEqual(inventory_context(self.request)['low_stock_count'], 0)
+
+        self.move_stock(remove_stock, 15)
+        self.assertEqual(inventory_context(self.request)['low_stock_count'], 1)
+
+        self.move_stock(add_stock, 30)
+        self.assertEqual(inventory_context(self.request)['low_stock_count'], 0)
+
+    def test_movement_above_reorder_level_keeps_cached_count(self):
+        inventory_context(self.request)
+        self.move_stock(remove_stock, 5)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(inventory_context(self.request)['low_stock_count'], 0)
+
+    def test_product_edit_refreshes_count(self):
+        inventory_context(self.request)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.reorder_level = 25
+            self.product.save()
+
+        self.assertEqual(inventory_context(self.request)['low_stock_count'], 1)
+
+
+class StockServiceTests(TestCase):
+    """Stock only moves through the guarded, set-based update"""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('clerk', password='pw')
+        self.client.force_login(self.user)
+        self.bread, self.milk = Product.objects.bulk_create([
+            Product(name='Bread', sku='BRD-1', cost_price=40, selling_price=55, current_stock=5),
+            Product(name='Milk', sku='MLK-1', cost_price=50, selling_price=65, current_stock=8),
+        ])
+        # So updated_at stamps can be told apart
+        Product.objects.update(updated_at=timezone.now() - timedelta(days=1))
+
+    def stock(self):
+        return dict(Product.objects.values_list('sku', 'current_stock'))
+
+    def test_guard_refuses_negative_stock_and_rolls_back_the_batch(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            with transaction.atomic():
+                apply_stock_changes({self.milk.id: -2, self.bread.id: -6})
+        self.assertEqual(raised.exception.product.sku, 'BRD-1')
+        self.assertEqual(self.stock(), {'BRD-1': 5, 'MLK-1': 8})
+
+        # Another till sold bread between our read and the UPDATE: the WHERE
+        # guard refuses it and milk's decrement rolls back with it
+        with self.assertRaises(InsufficientStock):
+            with transaction.atomic():
+                products = lock_products([self.bread.id, self.milk.id])
+                Product.objects.filter(id=self.bread.id).update(current_stock=1)
+                apply_stock_changes({self.milk.id: -2, self.bread.id: -3}, products=products)
+        self.assertEqual(self.stock(), {'BRD-1': 5, 'MLK-1': 8})
+
+        # Down to exactly zero is allowed, and stamps updated_at
+        before = timezone.now()
+        with transaction.atomic():
+            changes = remove_stock({self.bread.id: 5, self.milk.id: 1})
+        self.assertEqual(self.stock(), {'BRD-1': 0, 'MLK-1': 7})
+        self.assertEqual((changes[self.bread.id].stock_before, changes[self.bread.id].stock_after), (5, 0))
+        self.assertTrue(all(stamp >= before for stamp in Product.objects.values_list('updated_at', flat=True)))
+
+    def test_receiving_a_purchase_order_records_in_movements(self):
+        supplier = Supplier.objects.create(name='Brookside', phone_number='0712345678')
+        po = PurchaseOrder.objects.create(supplier=supplier, status='SENT', created_by=self.user)
+        for product, quantity in [(self.bread, 10), (self.milk, 4), (self.bread, 2)]:
+            PurchaseOrderItem.objects.create(purchase_order=po, product=product, quantity=quantity, unit_cost=30)
+
+        url = reverse('suppliers:receive_po', args=[po.id])
+        self.client.post(url)
+        self.client.post(url)
+        self.assertEqual(self.stock(), {'BRD-1': 17, 'MLK-1': 12})
+        movements = StockMovement.objects.filter(reference=po.po_number).order_by('product__sku')
+        self.assertEqual(
+            [(m.product.sku, m.movement_type, m.quantity, m.stock_before, m.stock_after) for m in movements],
+            [('BRD-1', 'IN', 12, 5, 17), ('MLK-1', 'IN', 4, 8, 12)],
+        )
+
+    def test_stock_take_records_adjustment_delta(self):
+        url = reverse('inventory:adjust_stock', args=[self.milk.id])
+        for level in (3, 10):
+            self.client.post(url, {'movement_type': 'ADJUSTMENT', 'quantity': level, 'reference': 'COUNT'})
+        self.assertEqual(self.stock()['MLK-1'], 10)
+        movements = StockMovement.objects.filter(product=self.milk).order_by('id')
+        self.assertEqual(
+            [(m.movement_type, m.quantity, m.stock_before, m.stock_after) for m in movements],
+            [('ADJUSTMENT', 5, 8, 3), ('ADJUSTMENT', 7, 3, 10)],
+        )
+
+
+class NumberAllocatorTests(TestCase):
+    """Document numbers come from an atomic per-day counter"""
+
+    def test_numbers_are_unique_and_increasing(self):
+        sales = NumberAllocator('SALE', model=Sale, field='sale_number')
+        with mock.patch('apps.inventory.counters.timezone.localdate', return_value=date(2025, 3, 1)):
+            # A day that already had sales before the counter existed
+            Sale.objects.create(sale_number='SALE-20250301-0007')
+            numbers = [sales.next() for _ in range(3)]
+        self.assertEqual(numbers, ['SALE-20250301-0008', 'SALE-20250301-0009', 'SALE-20250301-0010'])
+
+    def test_numbers_restart_each_local_day(self):
+        allocator = NumberAllocator('PO')
+        with mock.patch('apps.inventory.counters.timezone.localdate') as localdate:
+            localdate.return_value = date(2025, 3, 1)
+            allocator.next()
+            self.assertEqual(allocator.next(), 'PO-20250301-0002')
+            localdate.return_value = date(2025, 3, 2)
+            self.assertEqual(allocator.next(), 'PO-20250302-0001')
+        self.assertEqual(current('PO-20250301'), 2)
+
+    def test_blocks_reserve_several_numbers_per_increment(self):
+        first, second = NumberAllocator('PO', block_size=3), NumberAllocator('PO', block_size=3)
+        with mock.patch('apps.inventory.counters.timezone.localdate', return_value=date(2025, 3, 1)):
+            with self.captureOnCommitCallbacks(execute=True):
+                a = first.next()
+            with self.captureOnCommitCallbacks(execute=True):
+                b = second.next()
+            with CaptureQueriesContext(connection) as queries:
+                rest = [first.next(), first.next()]
+            third = first.next()
+        self.assertEqual((a, b), ('PO-20250301-0001', 'PO-20250301-0004'))
+        self.assertEqual(rest, ['PO-20250301-0002', 'PO-20250301-0003'])
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(third, 'PO-20250301-0007')
+        self.assertEqual(Counter.objects.get(name='PO-20250301').value, 9)
+
+    def test_checkout_takes_its_number_before_locking_stock(self):
+        user = User.objects.create_user('till')
+        product = Product.objects.create(name='Bread', sku='BRD-1', cost_price=40, selling_price=55, current_stock=5)
+        checkout(user, [{'product_id': product.id, 'quantity': 1}])
+        with CaptureQueriesContext(connection) as queries:
+            checkout(user, [{'product_id': product.id, 'quantity': 1}])
+        statements = [query['sql'] for query in queries]
+        self.assertIn('inventory_counter', statements[0])
+        self.assertTrue(statements[1].startswith('SAVEPOINT'))
@@ -18,6 +18,7 @@ def index(request):
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Sum, F
 from django.utils import timezone
 from datetime import timedelta
@@ -25,9 +26,13 @@ from datetime import timedelta
 from apps.products.models import Product
 from .models import StockMovement
 from .forms import StockAdjustmentForm
+from .services import InsufficientStock, add_stock, remove_stock, set_stock, record_movements
+from config.dates import created_between, date_range
+from config.query_budget import query_budget
 
 
 @login_required
+@query_budget(8)
 def stock_list(request):
     """Display current stock levels"""
     products = Product.objects.select_related('category').filter(is_active=True)
@@ -47,6 +52,7 @@ def stock_list(request):
 
 
 @login_required
+@query_budget(5)
 def low_stock(request):
     """Display products with low stock"""
     products = Product.objects.filter(
@@ -59,6 +65,7 @@ def low_stock(request):
 
 
 @login_required
+@query_budget(6)
 def adjust_stock(request, product_id):
     """Adjust stock for a product"""
     product = get_object_or_404(Product, id=product_id)
@@ -71,32 +78,25 @@ def adjust_stock(request, product_id):
             reference = form.cleaned_data['reference']
             notes = form.cleaned_data['notes']
             
-            stock_before = product.current_stock
-            
-            # Update stock
-            if movement_type == 'IN':
-                product.current_stock += quantity
-            elif movement_type == 'OUT':
-                if product.current_stock < quantity:
-                    messages.error(request, 'Insufficient stock!')
-                    return redirect('inventory:adjust_stock', product_id=product_id)
-                product.current_stock -= quantity
-            elif movement_type == 'ADJUSTMENT':
-                product.current_stock = quantity
-            
-            product.save()
-            
-            # Record movement
-            StockMovement.objects.create(
-                product=product,
-                movement_type=movement_type,
-                quantity=quantity if movement_type != 'ADJUSTMENT' else abs(quantity - stock_before),
-                reference=reference,
-                notes=notes,
-                stock_before=stock_before,
-                stock_after=product.current_stock,
-                created_by=request.user
-            )
+            try:
+                with transaction.atomic():
+                    if movement_type == 'IN':
+                        changes = add_stock({product.id: quantity})
+                    elif movement_type == 'OUT':
+                        changes = remove_stock({product.id: quantity})
+                    else:
+                        changes = set_stock(product.id, quantity)
+                    
+                    # Record movement
+                    record_movements(
+                        changes, movement_type,
+                        reference=reference,
+                        notes=notes,
+                        user=request.user
+                    )
+            except InsufficientStock:
+                messages.error(request, 'Insufficient stock!')
+                return redirect('inventory:adjust_stock', product_id=product_id)
             
             messages.success(request, f'Stock adjusted for {product.name}')
             return redirect('products:product_detail', product_id=product.id)
@@ -118,13 +118,8 @@ def stock_movements(request):
     ).order_by('-created_at')
     
     # Filter by date range
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    
-    if start_date:
-        movements = movements.filter(created_at__date__gte=start_date)
-    if end_date:
-        movements = movements.filter(created_at__date__lte=end_date)
+    start_date, end_date = date_range(request)
+    movements = movements.filter(**created_between(start_date, end_date))
     
     # Filter by movement type
     movement_type = request.GET.get('type')
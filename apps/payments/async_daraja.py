@@ -0,0 +1,236 @@
+"""
+Asyncio client for the Daraja API
+
+AsyncDarajaAPI has the same methods as DarajaAPI, as coroutines, on an
+aiohttp session, so batch jobs and async views can keep hundreds of calls in
+flight. (aiohttp rather than httpx: httpx's connection pool spends CPU per
+request in proportion to the requests pending, which dominates at this
+concurrency.) A semaphore caps concurrent requests at MPESA_ASYNC_MAX_IN_FLIGHT
+and a token bucket keeps each client under MPESA_RATE_LIMIT requests per
+second, so bursts don't trip Safaricom's throttling.
+
+    async with AsyncDarajaAPI() as daraja:
+        results = await asyncio.gather(*(daraja.stk_push_query(id) for id in ids))
+
+Access tokens come from the same TokenCache as DarajaAPI; when one is due the
+blocking client fetches it in a worker thread.
+"""
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .daraja import RETRY_STATUSES, BaseDarajaAPI, DarajaAPI, logger, metrics, tokens
+
+
+class DarajaHTTPError(aiohttp.ClientError):
+    """Error status from the API, like requests' HTTPError for DarajaAPI"""
+
+
+class RateLimiter:
+    """Token bucket: on average `rate` acquisitions per second, bursts up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        # Waiters queue on the lock, so they are served in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= 1:
+                    self.available -= 1
+                    return
+                await asyncio.sleep((1 - self.available) / self.rate)
+
+
+class AsyncDarajaAPI(BaseDarajaAPI):
+    """
+    Async counterpart of DarajaAPI
+    Use it as an async context manager, or call aclose() when done.
+    """
+
+    def __init__(self, max_in_flight=None, rate_limit=None):
+        super().__init__()
+        self.max_in_flight = max_in_flight or settings.MPESA_ASYNC_MAX_IN_FLIGHT
+        if rate_limit is None:
+            rate_limit = settings.MPESA_RATE_LIMIT
+
+        self.session = None
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._limiter = RateLimiter(rate_limit)
+        self._token_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _session(self):
+        # Created on first use: aiohttp sessions belong to the running loop
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    sock_connect=settings.MPESA_CONNECT_TIMEOUT,
+                    sock_read=settings.MPESA_READ_TIMEOUT,
+                ),
+            )
+        return self.session
+
+    async def get_access_token(self, refresh=False):
+        """
+        OAuth access token, shared with DarajaAPI
+        refresh=True discards the current token first (e.g. after a 401)
+        Returns: access_token string
+        """
+        rejected = self.access_token if refresh else None
+        token = tokens.peek(self.token_key)
+        if token is None or token == rejected:
+            async with self._token_lock:
+                # Another coroutine may have fetched one while this one waited
+                token = tokens.peek(self.token_key)
+                if token is None or token == rejected:
+                    token = await sync_to_async(self._fetch_access_token, thread_sensitive=False)(rejected)
+        self.access_token = token
+        return token
+
+    def _fetch_access_token(self, rejected):
+        api = DarajaAPI()
+        api.access_token = rejected
+        return api.get_access_token(refresh=rejected is not None)
+
+    async def _post(self, url, payload, idempotent=False):
+        """
+        POST to the API with a bearer token
+        A rejected token (401) is replaced and the request retried once.
+        Returns: parsed JSON response
+        """
+        status, result = await self._request('POST', url, idempotent, json=payload, headers=await self._headers())
+        if status == 401:
+            await self.get_access_token(refresh=True)
+            status, result = await self._request('POST', url, idempotent, json=payload, headers=await self._headers())
+        if status >= 400:
+            raise DarajaHTTPError(f'{status} Error for url: {url}')
+        return result
+
+    async def _request(self, method, url, idempotent=False, **kwargs):
+        """
+        One rate-limited call, timed per endpoint, with DarajaAPI's retry rules
+        Returns: (status, parsed JSON body or None for errors)
+        """
+        endpoint = urlsplit(url).path
+        attempts = 1 + (settings.MPESA_MAX_RETRIES if idempotent else 0)
+        for attempt in range(attempts):
+            async with self._in_flight:
+                await self._limiter.acquire()
+                started = time.perf_counter()
+                try:
+                    async with self._session().request(method, url, **kwargs) as response:
+                        status = response.status
+                        result = await response.json(content_type=None) if status < 400 else None
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    metrics.record(endpoint, time.perf_counter() - started, error=True)
+                    if attempt == attempts - 1:
+                        raise
+                else:
+                    metrics.record(endpoint, time.perf_counter() - started, error=status >= 500)
+                    if status not in RETRY_STATUSES or attempt == attempts - 1:
+                        return status, result
+            metrics.retried(endpoint)
+            logger.warning(f"Retrying {endpoint} (attempt {attempt + 2} of {attempts})")
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def _headers(self):
+        return {
+            'Authorization': f'Bearer {await self.get_access_token()}',
+            'Content-Type': 'application/json'
+        }
+
+    async def stk_push(self, phone_number, amount, account_reference, transaction_desc, callback_url):
+        """Initiate STK Push; see DarajaAPI.stk_push"""
+        url, payload = self._stk_push_request(
+            phone_number, amount, account_reference, transaction_desc, callback_url
+        )
+
+        try:
+            result = await self._post(url, payload)
+
+            logger.info(f"STK Push initiated: {result}")
+            return self._stk_push_result(result)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"STK Push error: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    async def stk_push_query(self, checkout_request_id):
+        """Query STK Push transaction status; see DarajaAPI.stk_push_query"""
+        url, payload = self._stk_push_query_request(checkout_request_id)
+
+        try:
+            result = await self._post(url, payload, idempotent=True)
+
+            return self._stk_push_query_result(result)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"STK Push query error: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    async def b2c_payment(self, phone_number, amount, occasion, remarks, result_url, timeout_url):
+        """Initiate B2C payment; see DarajaAPI.b2c_payment"""
+        url, payload = self._b2c_payment_request(
+            phone_number, amount, occasion, remarks, result_url, timeout_url
+        )
+
+        try:
+            result = await self._post(url, payload)
+
+            logger.info(f"B2C payment initiated: {result}")
+            return self._b2c_payment_result(result)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"B2C payment error: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    async def register_urls(self, validation_url, confirmation_url):
+        """Register C2B validation and confirmation URLs; see DarajaAPI.register_urls"""
+        url, payload = self._register_urls_request(validation_url, confirmation_url)
+
+        try:
+            result = await self._post(url, payload, idempotent=True)
+
+            logger.info(f"URLs registered: {result}")
+            return {
+                'success': True,
+                'response': result
+            }
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"URL registration error: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
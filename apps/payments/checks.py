@@ -0,0 +1,22 @@
+"""
+System checks for the payments app
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Daraja tokens are only shared between workers through the 'shared' cache"""
+    if settings.DEBUG or 'shared' in settings.CACHES:
+        return []
+    return [
+        Warning(
+            'No shared cache is configured, so every worker fetches and caches '
+            'its own Daraja access token and cache invalidations stay in the '
+            'process that made them.',
+            hint='Set SHARED_CACHE_BACKEND and SHARED_CACHE_LOCATION to a cache '
+                 'all workers can reach (e.g. Redis).',
+            id='payments.W001',
+        )
+    ]
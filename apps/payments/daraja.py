@@ -1,16 +1,176 @@
 import requests
 import base64
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
 from datetime import datetime
+from urllib.parse import urlsplit
 from django.conf import settings
+from requests.adapters import HTTPAdapter
 import logging
 
+from config.caching import shared_cache
+
 logger = logging.getLogger(__name__)
 
+# Daraja tokens live an hour; fetch a new one this many seconds before expiry
+TOKEN_REFRESH_MARGIN = 300
+# Longest one worker may hold the refresh lock before others fetch themselves
+TOKEN_LOCK_TIMEOUT = 15
+
+# Responses worth retrying an idempotent call for
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Backoff before retry n is uniform in [0, min(cap, base * 2**n)] seconds
+RETRY_BACKOFF = 0.25
+RETRY_BACKOFF_CAP = 2.0
 
-class DarajaAPI:
+
+class TokenCache:
     """
-    Wrapper class for Safaricom Daraja API
-    Handles M-Pesa STK Push and B2C payments
+    Access tokens shared by every DarajaAPI instance
+    A process dict sits in front of the shared cache tier (config.caching), so
+    all workers reuse one token until shortly before it expires. Refreshes
+    are single-flight: a thread lock within the process and a cache.add lock
+    across workers; everyone else waits for the winner's token. Without
+    SHARED_CACHE_BACKEND each worker keeps its own token (check payments.W001).
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def peek(self, key):
+        """Token already cached in this process, without locking or I/O"""
+        return self._fresh(self._tokens.get(key))
+
+    def get(self, key, fetch):
+        """Cached token for key, calling fetch() -> (token, expires_in) when due"""
+        token = self.peek(key)
+        if token:
+            return token
+        with self._lock:
+            # Another thread may have refreshed while this one waited
+            token = self._fresh(self._tokens.get(key))
+            if not token:
+                entry = self._shared(key, fetch)
+                self._tokens[key] = entry
+                token = entry[0]
+            return token
+
+    def invalidate(self, key, token):
+        """Forget a token the API rejected, unless it was already replaced"""
+        with self._lock:
+            if self._tokens.get(key, (None,))[0] == token:
+                del self._tokens[key]
+        cache = shared_cache()
+        if cache.get(key, (None,))[0] == token:
+            cache.delete(key)
+
+    def _fresh(self, entry):
+        if entry and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def _shared(self, key, fetch):
+        cache = shared_cache()
+        lock_key = f'{key}:lock'
+        deadline = time.monotonic() + TOKEN_LOCK_TIMEOUT
+        while True:
+            entry = cache.get(key)
+            if self._fresh(entry):
+                return entry
+            if cache.add(lock_key, 1, timeout=TOKEN_LOCK_TIMEOUT):
+                try:
+                    entry, expires_in = self._entry(fetch)
+                    cache.set(key, entry, timeout=expires_in)
+                    return entry
+                finally:
+                    cache.delete(lock_key)
+            if time.monotonic() > deadline:
+                # The lock holder died or hung; don't wait on it any longer
+                return self._entry(fetch)[0]
+            time.sleep(0.1)
+
+    def _entry(self, fetch):
+        token, expires_in = fetch()
+        # (token, refresh at) - short-lived tokens refresh halfway through
+        refresh_in = expires_in - min(TOKEN_REFRESH_MARGIN, expires_in // 2)
+        return (token, time.time() + refresh_in), expires_in
+
+
+tokens = TokenCache()
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """Keep-alive connection pool shared by every DarajaAPI in this process"""
+    global _session, _session_pid
+    # A forked worker (Celery prefork, gunicorn) must not reuse its parent's sockets
+    if _session_pid != os.getpid():
+        with _session_lock:
+            if _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=settings.MPESA_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+class EndpointMetrics:
+    """Latency, error and retry counts per Daraja endpoint, for this process"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._counts = defaultdict(Counter)
+
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            self._latencies[endpoint].append(seconds * 1000)
+            self._counts[endpoint]['calls'] += 1
+            self._counts[endpoint]['errors'] += error
+
+    def retried(self, endpoint):
+        with self._lock:
+            self._counts[endpoint]['retries'] += 1
+
+    def snapshot(self):
+        """{endpoint: {calls, errors, retries, p50_ms, p95_ms, max_ms}} over the recent window"""
+        with self._lock:
+            summary = {}
+            for endpoint, latencies in self._latencies.items():
+                ordered = sorted(latencies)
+                summary[endpoint] = {
+                    'calls': self._counts[endpoint]['calls'],
+                    'errors': self._counts[endpoint]['errors'],
+                    'retries': self._counts[endpoint]['retries'],
+                    'p50_ms': ordered[int(0.50 * (len(ordered) - 1))],
+                    'p95_ms': ordered[int(0.95 * (len(ordered) - 1))],
+                    'max_ms': ordered[-1],
+                }
+            return summary
+
+    def reset(self):
+        with self._lock:
+            self._latencies.clear()
+            self._counts.clear()
+
+
+metrics = EndpointMetrics()
+
+
+class BaseDarajaAPI:
+    """
+    Credentials, URLs and request/response shapes shared by DarajaAPI and
+    AsyncDarajaAPI (apps.payments.async_daraja)
     """
     
     def __init__(self):
@@ -21,34 +181,18 @@ class DarajaAPI:
         self.initiator_name = settings.MPESA_INITIATOR_NAME
         self.security_credential = settings.MPESA_SECURITY_CREDENTIAL
         
-        # API URLs - Sandbox or Production
-        if settings.MPESA_ENVIRONMENT == 'sandbox':
+        # API URLs - Sandbox or Production, or MPESA_BASE_URL (e.g. the local stub)
+        if settings.MPESA_BASE_URL:
+            self.base_url = settings.MPESA_BASE_URL.rstrip('/')
+        elif settings.MPESA_ENVIRONMENT == 'sandbox':
             self.base_url = 'https://sandbox.safaricom.co.ke'
         else:
             self.base_url = 'https://api.safaricom.co.ke'
         
         self.access_token = None
-    
-    def get_access_token(self):
-        """
-        Generate OAuth access token
-        Returns: access_token string
-        """
-        url = f'{self.base_url}/oauth/v1/generate?grant_type=client_credentials'
-        
-        try:
-            response = requests.get(
-                url,
-                auth=(self.consumer_key, self.consumer_secret)
-            )
-            response.raise_for_status()
-            result = response.json()
-            self.access_token = result.get('access_token')
-            logger.info("Access token generated successfully")
-            return self.access_token
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error getting access token: {str(e)}")
-            raise Exception(f"Failed to get access token: {str(e)}")
+        # Tokens are per app and environment; don't put the key itself in cache keys
+        credentials = f'{self.base_url}:{self.consumer_key}'.encode()
+        self.token_key = f'daraja:token:{hashlib.sha256(credentials).hexdigest()[:16]}'
     
     def generate_password(self):
         """
@@ -60,23 +204,7 @@ class DarajaAPI:
         password = base64.b64encode(data_to_encode.encode()).decode('utf-8')
         return password, timestamp
     
-    def stk_push(self, phone_number, amount, account_reference, transaction_desc, callback_url):
-        """
-        Initiate STK Push (Lipa Na M-Pesa Online)
-        
-        Args:
-            phone_number: Customer phone number (format: 254XXXXXXXXX)
-            amount: Amount to charge
-            account_reference: Reference for the transaction (e.g., sale number)
-            transaction_desc: Description of the transaction
-            callback_url: URL to receive payment confirmation
-        
-        Returns:
-            dict with response data
-        """
-        if not self.access_token:
-            self.get_access_token()
-        
+    def _stk_push_request(self, phone_number, amount, account_reference, transaction_desc, callback_url):
         url = f'{self.base_url}/mpesa/stkpush/v1/processrequest'
         password, timestamp = self.generate_password()
         
@@ -88,11 +216,6 @@ class DarajaAPI:
         elif phone_number.startswith('7') or phone_number.startswith('1'):
             phone_number = '254' + phone_number
         
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
         payload = {
             'BusinessShortCode': self.shortcode,
             'Password': password,
@@ -106,21 +229,197 @@ class DarajaAPI:
             'AccountReference': account_reference,
             'TransactionDesc': transaction_desc
         }
+        return url, payload
+    
+    def _stk_push_query_request(self, checkout_request_id):
+        url = f'{self.base_url}/mpesa/stkpushquery/v1/query'
+        password, timestamp = self.generate_password()
+        
+        payload = {
+            'BusinessShortCode': self.shortcode,
+            'Password': password,
+            'Timestamp': timestamp,
+            'CheckoutRequestID': checkout_request_id
+        }
+        return url, payload
+    
+    def _b2c_payment_request(self, phone_number, amount, occasion, remarks, result_url, timeout_url):
+        url = f'{self.base_url}/mpesa/b2c/v1/paymentrequest'
+        
+        # Format phone number
+        if phone_number.startswith('0'):
+            phone_number = '254' + phone_number[1:]
+        elif phone_number.startswith('+'):
+            phone_number = phone_number[1:]
+        elif phone_number.startswith('7') or phone_number.startswith('1'):
+            phone_number = '254' + phone_number
+        
+        payload = {
+            'InitiatorName': self.initiator_name,
+            'SecurityCredential': self.security_credential,
+            'CommandID': 'BusinessPayment',  # or 'SalaryPayment', 'PromotionPayment'
+            'Amount': int(amount),
+            'PartyA': self.shortcode,
+            'PartyB': phone_number,
+            'Remarks': remarks,
+            'QueueTimeOutURL': timeout_url,
+            'ResultURL': result_url,
+            'Occasion': occasion
+        }
+        return url, payload
+    
+    def _register_urls_request(self, validation_url, confirmation_url):
+        url = f'{self.base_url}/mpesa/c2b/v1/registerurl'
+        
+        payload = {
+            'ShortCode': self.shortcode,
+            'ResponseType': 'Completed',  # or 'Cancelled'
+            'ConfirmationURL': confirmation_url,
+            'ValidationURL': validation_url
+        }
+        return url, payload
+    
+    @staticmethod
+    def _stk_push_result(result):
+        return {
+            'success': True,
+            'merchant_request_id': result.get('MerchantRequestID'),
+            'checkout_request_id': result.get('CheckoutRequestID'),
+            'response_code': result.get('ResponseCode'),
+            'response_description': result.get('ResponseDescription'),
+            'customer_message': result.get('CustomerMessage')
+        }
+    
+    @staticmethod
+    def _stk_push_query_result(result):
+        return {
+            'success': True,
+            'result_code': result.get('ResultCode'),
+            'result_desc': result.get('ResultDesc')
+        }
+    
+    @staticmethod
+    def _b2c_payment_result(result):
+        return {
+            'success': True,
+            'conversation_id': result.get('ConversationID'),
+            'originator_conversation_id': result.get('OriginatorConversationID'),
+            'response_code': result.get('ResponseCode'),
+            'response_description': result.get('ResponseDescription')
+        }
+    
+    @staticmethod
+    def _backoff(attempt):
+        """Seconds to wait before retry number attempt + 1 (full jitter)"""
+        return random.uniform(0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF * 2 ** attempt))
+
+
+class DarajaAPI(BaseDarajaAPI):
+    """
+    Wrapper class for Safaricom Daraja API
+    Handles M-Pesa STK Push and B2C payments
+    """
+    
+    def __init__(self, session=None):
+        super().__init__()
+        self.session = session or http_session()
+        self.timeout = (settings.MPESA_CONNECT_TIMEOUT, settings.MPESA_READ_TIMEOUT)
+    
+    def get_access_token(self, refresh=False):
+        """
+        OAuth access token, shared across instances and workers until it nears expiry
+        refresh=True discards the current token first (e.g. after a 401)
+        Returns: access_token string
+        """
+        if refresh and self.access_token:
+            tokens.invalidate(self.token_key, self.access_token)
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            result = response.json()
+            self.access_token = tokens.get(self.token_key, self._fetch_access_token)
+            return self.access_token
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error getting access token: {str(e)}")
+            raise Exception(f"Failed to get access token: {str(e)}")
+    
+    def _fetch_access_token(self):
+        url = f'{self.base_url}/oauth/v1/generate?grant_type=client_credentials'
+        response = self._request(
+            'GET', url, idempotent=True,
+            auth=(self.consumer_key, self.consumer_secret)
+        )
+        response.raise_for_status()
+        result = response.json()
+        logger.info("Access token generated successfully")
+        # Daraja sends expires_in as a string of seconds
+        return result.get('access_token'), int(result.get('expires_in', 3599))
+    
+    def _post(self, url, payload, idempotent=False):
+        """
+        POST to the API with a bearer token
+        A rejected token (401) is replaced and the request retried once.
+        Returns: parsed JSON response
+        """
+        response = self._request('POST', url, idempotent, json=payload, headers=self._headers())
+        if response.status_code == 401:
+            self.get_access_token(refresh=True)
+            response = self._request('POST', url, idempotent, json=payload, headers=self._headers())
+        response.raise_for_status()
+        return response.json()
+    
+    def _request(self, method, url, idempotent=False, **kwargs):
+        """
+        One call over the pooled session, timed per endpoint
+        Idempotent calls are retried on connection errors, timeouts and
+        429/5xx with jittered exponential backoff. Payments are never retried:
+        a request that timed out may still have gone through.
+        """
+        endpoint = urlsplit(url).path
+        attempts = 1 + (settings.MPESA_MAX_RETRIES if idempotent else 0)
+        for attempt in range(attempts):
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                metrics.record(endpoint, time.perf_counter() - started, error=True)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                metrics.record(endpoint, time.perf_counter() - started, error=response.status_code >= 500)
+                if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                    return response
+            metrics.retried(endpoint)
+            logger.warning(f"Retrying {endpoint} (attempt {attempt + 2} of {attempts})")
+            time.sleep(self._backoff(attempt))
+    
+    def _headers(self):
+        return {
+            'Authorization': f'Bearer {self.get_access_token()}',
+            'Content-Type': 'application/json'
+        }
+    
+    def stk_push(self, phone_number, amount, account_reference, transaction_desc, callback_url):
+        """
+        Initiate STK Push (Lipa Na M-Pesa Online)
+        
+        Args:
+            phone_number: Customer phone number (format: 254XXXXXXXXX)
+            amount: Amount to charge
+            account_reference: Reference for the transaction (e.g., sale number)
+            transaction_desc: Description of the transaction
+            callback_url: URL to receive payment confirmation
+        
+        Returns:
+            dict with response data
+        """
+        url, payload = self._stk_push_request(
+            phone_number, amount, account_reference, transaction_desc, callback_url
+        )
+        
+        try:
+            result = self._post(url, payload)
             
             logger.info(f"STK Push initiated: {result}")
-            return {
-                'success': True,
-                'merchant_request_id': result.get('MerchantRequestID'),
-                'checkout_request_id': result.get('CheckoutRequestID'),
-                'response_code': result.get('ResponseCode'),
-                'response_description': result.get('ResponseDescription'),
-                'customer_message': result.get('CustomerMessage')
-            }
+            return self._stk_push_result(result)
         except requests.exceptions.RequestException as e:
             logger.error(f"STK Push error: {str(e)}")
             return {
@@ -138,34 +437,12 @@ class DarajaAPI:
         Returns:
             dict with transaction status
         """
-        if not self.access_token:
-            self.get_access_token()
-        
-        url = f'{self.base_url}/mpesa/stkpushquery/v1/query'
-        password, timestamp = self.generate_password()
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'BusinessShortCode': self.shortcode,
-            'Password': password,
-            'Timestamp': timestamp,
-            'CheckoutRequestID': checkout_request_id
-        }
+        url, payload = self._stk_push_query_request(checkout_request_id)
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            result = response.json()
+            result = self._post(url, payload, idempotent=True)
             
-            return {
-                'success': True,
-                'result_code': result.get('ResultCode'),
-                'result_desc': result.get('ResultDesc')
-            }
+            return self._stk_push_query_result(result)
         except requests.exceptions.RequestException as e:
             logger.error(f"STK Push query error: {str(e)}")
             return {
@@ -189,50 +466,15 @@ class DarajaAPI:
         Returns:
             dict with response data
         """
-        if not self.access_token:
-            self.get_access_token()
-        
-        url = f'{self.base_url}/mpesa/b2c/v1/paymentrequest'
-        
-        # Format phone number
-        if phone_number.startswith('0'):
-            phone_number = '254' + phone_number[1:]
-        elif phone_number.startswith('+'):
-            phone_number = phone_number[1:]
-        elif phone_number.startswith('7') or phone_number.startswith('1'):
-            phone_number = '254' + phone_number
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'InitiatorName': self.initiator_name,
-            'SecurityCredential': self.security_credential,
-            'CommandID': 'BusinessPayment',  # or 'SalaryPayment', 'PromotionPayment'
-            'Amount': int(amount),
-            'PartyA': self.shortcode,
-            'PartyB': phone_number,
-            'Remarks': remarks,
-            'QueueTimeOutURL': timeout_url,
-            'ResultURL': result_url,
-            'Occasion': occasion
-        }
+        url, payload = self._b2c_payment_request(
+            phone_number, amount, occasion, remarks, result_url, timeout_url
+        )
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            result = response.json()
+            result = self._post(url, payload)
             
             logger.info(f"B2C payment initiated: {result}")
-            return {
-                'success': True,
-                'conversation_id': result.get('ConversationID'),
-                'originator_conversation_id': result.get('OriginatorConversationID'),
-                'response_code': result.get('ResponseCode'),
-                'response_description': result.get('ResponseDescription')
-            }
+            return self._b2c_payment_result(result)
         except requests.exceptions.RequestException as e:
             logger.error(f"B2C payment error: {str(e)}")
             return {
@@ -245,27 +487,10 @@ class DarajaAPI:
         Register C2B validation and confirmation URLs
         Only needed for C2B (if implementing)
         """
-        if not self.access_token:
-            self.get_access_token()
-        
-        url = f'{self.base_url}/mpesa/c2b/v1/registerurl'
-        
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'ShortCode': self.shortcode,
-            'ResponseType': 'Completed',  # or 'Cancelled'
-            'ConfirmationURL': confirmation_url,
-            'ValidationURL': validation_url
-        }
+        url, payload = self._register_urls_request(validation_url, confirmation_url)
         
         try:
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            result = response.json()
+            result = self._post(url, payload, idempotent=True)
             
             logger.info(f"URLs registered: {result}")
             return {
@@ -0,0 +1,117 @@
+"""
+Benchmark the Daraja client against the local stub
+Runs the same STK push status queries with a new connection per call (the
+old requests.post behaviour), over the pooled session from a thread pool,
+and as coroutines on AsyncDarajaAPI, and reports latency, throughput and how
+many connections the stub had to accept.
+
+The stub speaks plain HTTP, so this understates the gain: against Safaricom
+every new connection also pays a TLS handshake.
+
+Usage: python manage.py bench_daraja --calls 500 --threads 8 --latency 20
+"""
+import asyncio
+import threading
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from apps.payments import daraja
+from apps.payments.async_daraja import AsyncDarajaAPI
+from apps.payments.stub import StubServer
+
+
+class Unpooled:
+    """A fresh session, and so a fresh connection, for every call"""
+
+    def request(self, *args, **kwargs):
+        with requests.Session() as session:
+            return session.request(*args, **kwargs)
+
+
+class Command(BaseCommand):
+    help = 'Compare per-call connections with the pooled Daraja session against a local stub'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=300, help='Status queries per mode')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent callers')
+        parser.add_argument('--latency', type=float, default=5, help='Stub delay per response in ms')
+        parser.add_argument('--in-flight', type=int, default=100, help='Concurrent calls in async mode')
+
+    def handle(self, *args, **options):
+        server = StubServer(latency_ms=options['latency']).start()
+        try:
+            with override_settings(MPESA_BASE_URL=server.url, MPESA_CONSUMER_KEY='bench'):
+                self.stdout.write(
+                    f"{options['calls']} status queries from {options['threads']} threads, "
+                    f"{options['latency']:g} ms stub latency"
+                )
+                self.stdout.write(
+                    f'{"mode":>9} {"p50 ms":>8} {"p95 ms":>8} {"calls/s":>8} {"connections":>11}'
+                )
+                for mode, session in [('unpooled', Unpooled()), ('pooled', daraja.http_session())]:
+                    self._run(mode, session, server, options)
+                asyncio.run(self._run_async(server, options))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def _run(self, mode, session, server, options):
+        api = daraja.DarajaAPI(session=session)
+        api.get_access_token()
+        # Warm the pool so both modes are measured in steady state
+        api.stk_push_query('ws_CO_warmup')
+
+        timings = []
+        lock = threading.Lock()
+        per_thread = options['calls'] // options['threads']
+        connections = server.connections
+
+        def caller():
+            for i in range(per_thread):
+                started = time.perf_counter()
+                result = api.stk_push_query(f'ws_CO_{i}')
+                elapsed = (time.perf_counter() - started) * 1000
+                if result['success']:
+                    with lock:
+                        timings.append(elapsed)
+
+        threads = [threading.Thread(target=caller) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        self._report(mode, timings, wall, server.connections - connections)
+
+    async def _run_async(self, server, options):
+        # No rate limit: the stub has no quota to respect
+        async with AsyncDarajaAPI(max_in_flight=options['in_flight'], rate_limit=0) as api:
+            await api.stk_push_query('ws_CO_warmup')
+            connections = server.connections
+            timings = []
+
+            async def call(i):
+                started = time.perf_counter()
+                result = await api.stk_push_query(f'ws_CO_{i}')
+                if result['success']:
+                    timings.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(call(i) for i in range(options['calls'])))
+            wall = time.perf_counter() - started
+        self._report('async', timings, wall, server.connections - connections)
+
+    def _report(self, mode, timings, wall, connections):
+        timings.sort()
+        if not timings:
+            self.stderr.write(f'{mode}: every call failed')
+            return
+        self.stdout.write(
+            f'{mode:>9} {timings[len(timings) // 2]:>8.2f} {timings[int(len(timings) * 0.95)]:>8.2f} '
+            f'{len(timings) / wall:>8.0f} {connections:>11}'
+        )
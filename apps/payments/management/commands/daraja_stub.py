@@ -0,0 +1,28 @@
+"""
+Run the local Daraja stub (see apps.payments.stub)
+
+Usage: python manage.py daraja_stub --port 8765 --latency 40
+       MPESA_BASE_URL=http://127.0.0.1:8765 python manage.py runserver
+"""
+from django.core.management.base import BaseCommand
+
+from apps.payments.stub import StubServer
+
+
+class Command(BaseCommand):
+    help = 'Serve canned Daraja responses locally for offline testing and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0, help='Delay per response in ms')
+
+    def handle(self, *args, **options):
+        server = StubServer((options['host'], options['port']), options['latency'])
+        self.stdout.write(f'Daraja stub listening on {server.url} (Ctrl+C to stop)')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-17 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_transaction_next_check_at'),
+        ('sales', '0002_sale_item_unit_cost'),
+        ('suppliers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['checkout_request_id'], name='payments_tr_checkou_34e8a5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['conversation_id'], name='payments_tr_convers_813fd8_idx'),
+        ),
+    ]
@@ -31,6 +31,8 @@ class Transaction(models.Model):
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     result_desc = models.TextField(blank=True)
+    # When the reconciler may next query a PENDING transaction (null: now)
+    next_check_at = models.DateTimeField(null=True, blank=True)
     
     # Link to sale or purchase order
     sale = models.ForeignKey('sales.Sale', on_delete=models.SET_NULL, null=True, blank=True)
@@ -44,6 +46,10 @@ class Transaction(models.Model):
         indexes = [
             models.Index(fields=['status']),
             models.Index(fields=['mpesa_receipt_number']),
+            models.Index(fields=['status', 'next_check_at']),
+            # Callback lookups
+            models.Index(fields=['checkout_request_id']),
+            models.Index(fields=['conversation_id']),
         ]
     
     def __str__(self):
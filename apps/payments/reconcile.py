@@ -0,0 +1,148 @@
+"""
+Reconciliation of PENDING STK pushes whose callback never arrived
+
+Due transactions are read in keyset chunks (by id), each chunk's status
+queries run concurrently on AsyncDarajaAPI, and the outcomes are written
+back with one bulk_update per chunk. A transaction that is still pending is
+queried again later the older it gets (next_check_at), so a backlog left by
+an outage drains instead of being re-queried in full every run.
+
+A lease on a database row keeps runs from overlapping, on every worker and
+whatever cache is configured, and a run stops taking new chunks after
+MPESA_RECONCILE_MAX_SECONDS; the next run picks up the rest.
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.inventory.models import Counter
+from .async_daraja import AsyncDarajaAPI
+from .models import Transaction
+
+logger = logging.getLogger(__name__)
+
+# Counter row holding the current run's lease expiry (time.time_ns(); 0 when free)
+LOCK_NAME = 'payments:reconcile:lock'
+
+# Give the callback this long before querying
+GRACE = timedelta(minutes=2)
+
+# (transaction age under, wait before querying it again)
+BACKOFF = [
+    (timedelta(minutes=10), timedelta(minutes=2)),
+    (timedelta(hours=1), timedelta(minutes=10)),
+    (timedelta(hours=6), timedelta(minutes=30)),
+]
+MAX_BACKOFF = timedelta(hours=2)
+
+UPDATE_FIELDS = ['status', 'result_desc', 'next_check_at', 'updated_at']
+
+
+def next_check(created_at, now):
+    age = now - created_at
+    for limit, wait in BACKOFF:
+        if age < limit:
+            return now + wait
+    return now + MAX_BACKOFF
+
+
+def due(now):
+    """PENDING STK pushes past the grace period whose next check is due"""
+    return Transaction.objects.filter(
+        Q(next_check_at__isnull=True) | Q(next_check_at__lte=now),
+        status='PENDING',
+        created_at__lt=now - GRACE,
+    ).exclude(checkout_request_id='')
+
+
+def apply(transaction, result, now):
+    """Update transaction from a status query; False if it is still pending"""
+    code = result.get('result_code') if result['success'] else None
+    if code in (None, ''):
+        # Still processing, or the query itself failed: ask again later
+        transaction.next_check_at = next_check(transaction.created_at, now)
+        return False
+    if str(code) == '0':
+        transaction.status = 'SUCCESS'
+        transaction.result_desc = result.get('result_desc') or 'Success'
+    else:
+        transaction.status = 'FAILED'
+        transaction.result_desc = result.get('result_desc') or 'Failed'
+    transaction.next_check_at = None
+    return True
+
+
+def acquire_lock(seconds):
+    """
+    Take the run lease for `seconds` with one conditional UPDATE
+    Returns the lease token to hand to release_lock(), or None while another
+    run's lease is live. An expired lease (a worker died holding it) is taken over.
+    """
+    Counter.objects.get_or_create(name=LOCK_NAME)
+    now = time.time_ns()
+    expires = now + int(seconds * 1e9)
+    if Counter.objects.filter(name=LOCK_NAME, value__lt=now).update(value=expires):
+        return expires
+    return None
+
+
+def release_lock(token):
+    """Give the lease back, unless it expired and another run has it now"""
+    Counter.objects.filter(name=LOCK_NAME, value=token).update(value=0)
+
+
+async def _query(api, chunk):
+    return await asyncio.gather(*(api.stk_push_query(t.checkout_request_id) for t in chunk))
+
+
+def reconcile(chunk_size=None, concurrency=None, max_seconds=None):
+    """
+    Query and settle due pending transactions
+    Returns: dict of counts (checked, settled), or None if another run holds the lock
+    """
+    chunk_size = chunk_size or settings.MPESA_RECONCILE_CHUNK_SIZE
+    max_seconds = max_seconds or settings.MPESA_RECONCILE_MAX_SECONDS
+
+    # Outlives a run that hits max_seconds, in case a worker dies holding it
+    token = acquire_lock(max_seconds * 2 + 60)
+    if token is None:
+        return None
+
+    counts = {'checked': 0, 'settled': 0}
+    started = time.monotonic()
+    now = timezone.now()
+    # One loop for the whole run, so the client keeps its connections between chunks
+    loop = asyncio.new_event_loop()
+    api = AsyncDarajaAPI(max_in_flight=concurrency or settings.MPESA_RECONCILE_CONCURRENCY)
+    try:
+        last_id = 0
+        while time.monotonic() - started < max_seconds:
+            chunk = list(
+                due(now).filter(id__gt=last_id)
+                .only('id', 'created_at', 'checkout_request_id', 'status', 'result_desc')
+                .order_by('id')[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            results = loop.run_until_complete(_query(api, chunk))
+            checked_at = timezone.now()
+            for transaction, result in zip(chunk, results):
+                counts['settled'] += apply(transaction, result, checked_at)
+                transaction.updated_at = checked_at
+            # Rows a callback settled while the queries ran are left as they are
+            Transaction.objects.filter(status='PENDING').bulk_update(chunk, UPDATE_FIELDS)
+            counts['checked'] += len(chunk)
+    finally:
+        loop.run_until_complete(api.aclose())
+        loop.close()
+        release_lock(token)
+
+    logger.info(f"Reconciled {counts['checked']} pending transactions, {counts['settled']} settled")
+    return counts
@@ -0,0 +1,119 @@
+"""
+Local stand-in for the Daraja API
+
+Answers the endpoints DarajaAPI calls with canned sandbox-style responses
+after an optional delay, over HTTP/1.1 keep-alive. Used by bench_daraja and
+handy for trying payment flows offline (set MPESA_BASE_URL to its address).
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _stk_push(body):
+    return {
+        'MerchantRequestID': f'{uuid.uuid4().int % 10**5}-{uuid.uuid4().int % 10**8}-1',
+        'CheckoutRequestID': f'ws_CO_{uuid.uuid4().hex[:20]}',
+        'ResponseCode': '0',
+        'ResponseDescription': 'Success. Request accepted for processing',
+        'CustomerMessage': 'Success. Request accepted for processing',
+    }
+
+
+def _stk_query(body):
+    return {
+        'ResponseCode': '0',
+        'ResponseDescription': 'The service request has been accepted successfully',
+        'MerchantRequestID': '22205-34066-1',
+        'CheckoutRequestID': body.get('CheckoutRequestID'),
+        'ResultCode': '0',
+        'ResultDesc': 'The service request is processed successfully.',
+    }
+
+
+def _b2c(body):
+    return {
+        'ConversationID': f'AG_{time.strftime("%Y%m%d")}_{uuid.uuid4().hex[:20]}',
+        'OriginatorConversationID': str(uuid.uuid4()),
+        'ResponseCode': '0',
+        'ResponseDescription': 'Accept the service request successfully.',
+    }
+
+
+def _register(body):
+    return {'OriginatorConversationID': str(uuid.uuid4()), 'ResponseCode': '0', 'ResponseDescription': 'Success'}
+
+
+ROUTES = {
+    '/mpesa/stkpush/v1/processrequest': _stk_push,
+    '/mpesa/stkpushquery/v1/query': _stk_query,
+    '/mpesa/b2c/v1/paymentrequest': _b2c,
+    '/mpesa/c2b/v1/registerurl': _register,
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle on, keep-alive
+    # responses would stall on the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        if self.path.startswith('/oauth/v1/generate'):
+            self._reply(200, {'access_token': uuid.uuid4().hex, 'expires_in': '3599'})
+        else:
+            self._reply(404, {'errorMessage': 'Not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        route = ROUTES.get(self.path)
+        if route is None:
+            self._reply(404, {'errorMessage': 'Not found'})
+        elif not self.headers.get('Authorization', '').startswith('Bearer '):
+            self._reply(401, {'errorMessage': 'Invalid Access Token'})
+        else:
+            self._reply(200, route(body))
+
+    def _reply(self, status, payload):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded stub; counts accepted connections to show pooling at work"""
+    daemon_threads = True
+    # The default listen backlog of 5 drops connects from async bursts
+    request_queue_size = 256
+
+    def __init__(self, address=('127.0.0.1', 0), latency_ms=0):
+        super().__init__(address, StubHandler)
+        self.latency = latency_ms / 1000
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve from a background thread"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -1,3 +1,262 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import daraja
+from . import reconcile
+from .checks import check_shared_cache
+from .async_daraja import AsyncDarajaAPI, RateLimiter
+from .models import Transaction
+from .tasks import check_pending_transactions
+from .stub import StubServer
+
+
+def reply(status=200, **body):
+    response = mock.Mock(status_code=status)
+    response.json.return_value = body
+    response.raise_for_status.side_effect = (
+        daraja.requests.exceptions.HTTPError(str(status)) if status >= 400 else None
+    )
+    return response
+
+
+class DarajaTestCase(SimpleTestCase):
+    """Fresh token cache and metrics; HTTP goes to a mock session"""
+
+    def setUp(self):
+        caches['default'].clear()
+        for name, value in [('tokens', daraja.TokenCache()), ('metrics', daraja.EndpointMetrics())]:
+            patcher = mock.patch.object(daraja, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.issued = 0
+        self.replies = []
+        self.session = mock.Mock()
+        self.session.request.side_effect = self.route
+        patcher = mock.patch.object(daraja, 'http_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def route(self, method, url, **kwargs):
+        if method == 'GET':
+            self.issued += 1
+            return reply(access_token=f'token-{self.issued}', expires_in='3599')
+        if self.replies:
+            outcome = self.replies.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return reply(ResultCode='0', ResultDesc='ok')
+
+    def posts(self):
+        return [call for call in self.session.request.call_args_list if call.args[0] == 'POST']
+
+
+class TokenCacheTests(DarajaTestCase):
+    """One OAuth call serves every DarajaAPI instance until the token nears expiry"""
+
+    def test_instances_share_one_token(self):
+        for _ in range(3):
+            self.assertTrue(daraja.DarajaAPI().stk_push_query('ws_CO_1')['success'])
+        # Another worker: empty process tier, same shared cache
+        with mock.patch.object(daraja, 'tokens', daraja.TokenCache()):
+            daraja.DarajaAPI().stk_push_query('ws_CO_1')
+
+        self.assertEqual(self.issued, 1)
+        self.assertEqual(self.posts()[-1].kwargs['headers']['Authorization'], 'Bearer token-1')
+
+    def test_check_warns_without_shared_cache(self):
+        local = {'default': settings.CACHES['default']}
+        with override_settings(DEBUG=False, CACHES=local):
+            self.assertEqual([w.id for w in check_shared_cache(None)], ['payments.W001'])
+        shared = {**local, 'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(DEBUG=False, CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_refreshes_before_expiry(self):
+        api = daraja.DarajaAPI()
+        self.assertEqual(api.get_access_token(), 'token-1')
+        later = time.time() + 3599 - daraja.TOKEN_REFRESH_MARGIN + 1
+        with mock.patch.object(daraja.time, 'time', return_value=later):
+            self.assertEqual(api.get_access_token(), 'token-2')
+
+    def test_burst_fetches_once(self):
+        route = self.route
+
+        def slow_route(*args, **kwargs):
+            time.sleep(0.05)
+            return route(*args, **kwargs)
+
+        self.session.request.side_effect = slow_route
+        threads = [threading.Thread(target=daraja.DarajaAPI().get_access_token) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.issued, 1)
+
+    def test_retries_once_on_401(self):
+        self.replies = [reply(401)]
+        result = daraja.DarajaAPI().stk_push_query('ws_CO_1')
+        self.assertTrue(result['success'])
+        self.assertEqual(self.issued, 2)
+        self.assertEqual(self.posts()[-1].kwargs['headers']['Authorization'], 'Bearer token-2')
+
+        self.replies = [reply(401), reply(401)]
+        self.assertFalse(daraja.DarajaAPI().stk_push_query('ws_CO_1')['success'])
+        self.assertEqual(len(self.posts()), 4)
+
+
+@override_settings(MPESA_MAX_RETRIES=2)
+@mock.patch.object(daraja, 'RETRY_BACKOFF', 0)
+class HttpClientTests(DarajaTestCase):
+    """Timeouts, retries and per-endpoint metrics"""
+
+    def test_idempotent_calls_retry(self):
+        self.replies = [daraja.requests.exceptions.ConnectTimeout(), reply(503)]
+        self.assertTrue(daraja.DarajaAPI().stk_push_query('ws_CO_1')['success'])
+        self.assertEqual(
+            self.posts()[0].kwargs['timeout'], (settings.MPESA_CONNECT_TIMEOUT, settings.MPESA_READ_TIMEOUT)
+        )
+
+        stats = daraja.metrics.snapshot()['/mpesa/stkpushquery/v1/query']
+        self.assertEqual((stats['calls'], stats['errors'], stats['retries']), (3, 2, 2))
+
+        # Never more than MPESA_MAX_RETRIES
+        self.replies = [reply(503)] * 5
+        self.assertFalse(daraja.DarajaAPI().stk_push_query('ws_CO_1')['success'])
+        self.assertEqual(len(self.posts()), 6)
+
+    def test_payments_are_not_retried(self):
+        self.replies = [daraja.requests.exceptions.ReadTimeout()]
+        result = daraja.DarajaAPI().stk_push('0712345678', 10, 'SALE-1', 'Sale', 'https://example.com/cb')
+        self.assertFalse(result['success'])
+        self.assertEqual(len(self.posts()), 1)
+
+
+class StubServerTests(SimpleTestCase):
+
+    def test_pooled_session_reuses_connections(self):
+        caches['default'].clear()
+        server = StubServer().start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with override_settings(MPESA_BASE_URL=server.url):
+            api = daraja.DarajaAPI(session=daraja.requests.Session())
+            results = [api.stk_push_query(f'ws_CO_{i}') for i in range(5)]
+            pushed = api.stk_push('254712345678', 10, 'SALE-1', 'Sale', 'https://example.com/cb')
+
+        self.assertTrue(all(result['result_code'] == '0' for result in results))
+        self.assertTrue(pushed['checkout_request_id'].startswith('ws_CO_'))
+        self.assertEqual(server.connections, 1)
+
+
+@override_settings(MPESA_MAX_RETRIES=1)
+@mock.patch.object(daraja, 'RETRY_BACKOFF', 0)
+class AsyncDarajaTests(SimpleTestCase):
+    """AsyncDarajaAPI keeps many calls in flight within its limits"""
+
+    def setUp(self):
+        self.server = StubServer(latency_ms=20).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    async def test_concurrent_queries_share_connections(self):
+        with self.settings(MPESA_BASE_URL=self.server.url):
+            async with AsyncDarajaAPI(max_in_flight=10, rate_limit=0) as api:
+                daraja.tokens.get(api.token_key, lambda: ('stub-token', 3599))
+                results = await asyncio.gather(*(api.stk_push_query(f'ws_CO_{i}') for i in range(50)))
+                pushed = await api.stk_push('0712345678', 10, 'SALE-1', 'Sale', 'https://example.com/cb')
+
+        self.assertEqual([result['result_code'] for result in results], ['0'] * 50)
+        self.assertTrue(pushed['checkout_request_id'].startswith('ws_CO_'))
+        self.assertLessEqual(self.server.connections, 10)
+
+    async def test_connection_errors_are_reported(self):
+        port = self.server.server_address[1]
+        self.server.server_close()
+        with self.settings(MPESA_BASE_URL=f'http://127.0.0.1:{port}'):
+            async with AsyncDarajaAPI(rate_limit=0) as api:
+                daraja.tokens.get(api.token_key, lambda: ('stub-token', 3599))
+                result = await api.stk_push_query('ws_CO_1')
+        self.assertFalse(result['success'])
+
+    async def test_rate_limit(self):
+        limiter = RateLimiter(rate=200, burst=1)
+        started = time.monotonic()
+        for _ in range(21):
+            await limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.095)
+
+
+class ReconcileTests(TestCase):
+    """check_pending_transactions settles due STK pushes in chunks and backs off the rest"""
+
+    def setUp(self):
+        caches['default'].clear()
+        now = timezone.now()
+        for checkout_id, minutes_ago in [
+            ('ok-1', 5), ('fail-2', 5), ('wait-3', 5), ('wait-4', 90), ('new-5', 1), ('', 30),
+        ]:
+            transaction = Transaction.objects.create(
+                transaction_type='STK_PUSH' if checkout_id else 'B2C',
+                amount=100, phone_number='254712345678', checkout_request_id=checkout_id,
+            )
+            Transaction.objects.filter(pk=transaction.pk).update(created_at=now - timedelta(minutes=minutes_ago))
+
+    async def query(self, checkout_request_id):
+        if checkout_request_id.startswith('ok'):
+            return {'success': True, 'result_code': '0', 'result_desc': 'Processed'}
+        if checkout_request_id.startswith('fail'):
+            return {'success': True, 'result_code': '1032', 'result_desc': 'Cancelled by user'}
+        return {'success': False, 'error': 'The transaction is being processed'}
+
+    def test_settles_and_backs_off(self):
+        with mock.patch.object(AsyncDarajaAPI, 'stk_push_query', side_effect=self.query):
+            self.assertEqual(check_pending_transactions.run(), 'Updated 2 of 4 transactions')
+            # Nothing is due again straight away
+            self.assertEqual(check_pending_transactions.run(), 'No pending transactions')
+
+        states = {t.checkout_request_id: t for t in Transaction.objects.all()}
+        self.assertEqual(states['ok-1'].status, 'SUCCESS')
+        self.assertEqual(states['fail-2'].status, 'FAILED')
+        self.assertEqual(states['fail-2'].result_desc, 'Cancelled by user')
+        self.assertEqual(states['new-5'].next_check_at, None)
+
+        now = timezone.now()
+        self.assertEqual(states['wait-3'].status, 'PENDING')
+        self.assertAlmostEqual(states['wait-3'].next_check_at, now + timedelta(minutes=2), delta=timedelta(seconds=30))
+        self.assertAlmostEqual(states['wait-4'].next_check_at, now + timedelta(minutes=30), delta=timedelta(seconds=30))
+
+    def test_chunks_and_lock(self):
+        with mock.patch.object(AsyncDarajaAPI, 'stk_push_query', side_effect=self.query):
+            # The first run also creates the lease row
+            reconcile.release_lock(reconcile.acquire_lock(60))
+            with self.assertNumQueries(8):
+                # Taking and releasing the lease (3), two chunks (select +
+                # bulk update each), then the empty read
+                counts = reconcile.reconcile(chunk_size=2)
+        self.assertEqual(counts, {'checked': 4, 'settled': 2})
+
+        # The lease lives in the database, so no cache can let two runs in
+        token = reconcile.acquire_lock(60)
+        self.assertEqual(check_pending_transactions.run(), 'Reconciliation already running')
+        self.assertIsNone(reconcile.acquire_lock(60))
+        reconcile.release_lock(token)
+        self.assertIsNotNone(reconcile.acquire_lock(60))
+
+    def test_expired_lease_is_taken_over(self):
+        with mock.patch('apps.payments.reconcile.time.time_ns', return_value=10**18):
+            stale = reconcile.acquire_lock(60)
+        self.assertIsNotNone(reconcile.acquire_lock(60))
+        # The dead run's release doesn't free the new run's lease
+        reconcile.release_lock(stale)
+        self.assertIsNone(reconcile.acquire_lock(60))
@@ -1,5 +1,6 @@
 from django.urls import path
 from . import views, daraja
+from apps.sales.views import mpesa_callback
 
 app_name = 'payments'
 
@@ -11,7 +12,7 @@ urlpatterns = [
     path('b2c/', views.initiate_b2c, name='b2c_payment'),
     
     # Callbacks (no authentication required)
-    path('callback/', views.mpesa_callback, name='mpesa_callback'),
+    path('callback/', mpesa_callback, name='mpesa_callback'),
     path('result/', views.mpesa_result, name='mpesa_result'),
     path('timeout/', views.mpesa_timeout, name='mpesa_timeout'),
 ]
\ No newline at end of file
@@ -21,10 +21,6 @@ def initiate_b2c(request):
     # Placeholder logic
     return HttpResponse("B2C Payment initiated (placeholder)")
 
-def mpesa_callback(request):
-    # Placeholder logic for M-Pesa callback
-    return HttpResponse("M-Pesa callback received (placeholder)")
-
 def mpesa_result(request):
     # Placeholder logic for M-Pesa result callback
     return HttpResponse("M-Pesa result received (placeholder)")
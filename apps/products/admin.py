@@ -1,5 +1,10 @@
 from django.contrib import admin
+from django.db.models import Count
 from .models import Category, Product
+from .catalog import on_catalog_invalidated
+from config.caching import PRODUCTS, invalidate_on_commit
+from .search import filter_products
+from django.utils import timezone
 from django.utils.html import format_html
 
 # Register your models here.
@@ -7,14 +12,18 @@ from django.utils.html import format_html
 # admin.site.register(Category)
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'description', 'created_at']
+    list_display = ['name', 'description', 'product_count', 'created_at']
     search_fields = ['name']
     ordering = ['name']
 
+    def get_queryset(self, request):
+        # Count in the changelist query instead of once per row
+        return super().get_queryset(request).annotate(num_products=Count('products'))
+
     def product_count(self, obj):
-        count = obj.products.count()
-        return format_html('<span style="font-weight: bold;">{}</span>', count)
+        return format_html('<span style="font-weight: bold;">{}</span>', obj.num_products)
     product_count.short_description = 'Products'
+    product_count.admin_order_field = 'num_products'
 
 # admin.site.register(Product)
 @admin.register(Product)
@@ -49,6 +58,11 @@ class ProductAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        return filter_products(queryset, search_term), False
+    
     def display_image(self, obj):
         if obj.image:
             return format_html(
@@ -92,11 +106,15 @@ class ProductAdmin(admin.ModelAdmin):
     actions = ['mark_as_active', 'mark_as_inactive', 'apply_discount']
     
     def mark_as_active(self, request, queryset):
-        updated = queryset.update(is_active=True)
+        updated = queryset.update(is_active=True, updated_at=timezone.now())
+        on_catalog_invalidated()
+        invalidate_on_commit(PRODUCTS)
         self.message_user(request, f'{updated} products marked as active.')
     mark_as_active.short_description = 'Mark selected as active'
     
     def mark_as_inactive(self, request, queryset):
-        updated = queryset.update(is_active=False)
+        updated = queryset.update(is_active=False, updated_at=timezone.now())
+        on_catalog_invalidated()
+        invalidate_on_commit(PRODUCTS)
         self.message_user(request, f'{updated} products marked as inactive.')
     mark_as_inactive.short_description = 'Mark selected as inactive'    
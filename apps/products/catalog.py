@@ -0,0 +1,362 @@
+"""
+In-process POS catalog snapshot
+
+Every worker keeps a compact copy of the sellable catalog in memory so the POS
+screen and product search don't hit the database on every request.
+
+Freshness is tracked with two counters (see apps.inventory.counters):
+  catalog:changes   bumped after products are saved or stock moves; other
+                    workers pull just the rows whose updated_at moved
+  catalog:rebuilds  bumped on deletes and category changes; other workers
+                    rebuild their snapshot from scratch
+The pair of counters is the catalog version tills use to detect staleness.
+"""
+import heapq
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.inventory.counters import increment
+from apps.inventory.models import Counter
+from .models import Product
+
+
+CHANGES = 'catalog:changes'
+REBUILDS = 'catalog:rebuilds'
+
+# Rows committed shortly after a sync can carry an updated_at from before it,
+# so incremental syncs look back this far
+SYNC_OVERLAP = timedelta(seconds=60)
+
+SNAPSHOT_FIELDS = (
+    'id', 'name', 'sku', 'barcode', 'selling_price', 'current_stock',
+    'reorder_level', 'category__name', 'image', 'is_active',
+)
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CatalogEntry(namedtuple('CatalogEntry', [
+    'id', 'name', 'sku', 'barcode', 'selling_price', 'current_stock',
+    'reorder_level', 'category', 'image_url',
+])):
+    """Immutable product row as seen by the POS"""
+    __slots__ = ()
+
+    @property
+    def is_low_stock(self):
+        return self.current_stock <= self.reorder_level
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'sku': self.sku,
+            'barcode': self.barcode,
+            'selling_price': str(self.selling_price),
+            'current_stock': self.current_stock,
+            'image': self.image_url,
+        }
+
+    def as_scan(self):
+        """Compact payload for barcode scans"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'price': str(self.selling_price),
+            'stock': self.current_stock,
+        }
+
+
+class CatalogIndex:
+    """
+    The lookup tables of one snapshot
+    A rebuild fills a fresh index and swaps it in whole, so readers never see
+    one half-built.
+    """
+    __slots__ = ('entries', 'codes', 'haystacks', 'grams')
+
+    def __init__(self, grams=False):
+        self.entries = {}
+        self.codes = {}
+        self.haystacks = {}
+        self.grams = defaultdict(set) if grams else None
+
+
+class Catalog:
+    """Versioned snapshot of active products, keyed by id, barcode and SKU"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = CatalogIndex()
+        self.changes = None
+        self.rebuilds = None
+        self.synced_at = None
+        self.built_at = 0.0
+        self.checked_at = 0.0
+
+    @property
+    def version(self):
+        return f'{self.rebuilds or 0}.{self.changes or 0}'
+
+    # ------------------------------------------------------------------
+    # Reads (memory only)
+    # ------------------------------------------------------------------
+
+    def get(self, product_id):
+        return self._index.entries.get(product_id)
+
+    def lookup(self, code):
+        """Exact barcode or SKU match"""
+        index = self._index
+        product_id = index.codes.get(code.strip().lower())
+        return index.entries.get(product_id) if product_id is not None else None
+
+    def lookup_many(self, codes):
+        """
+        Resolve many barcodes/SKUs at once: {code: entry or None}
+        Codes this worker hasn't seen yet (e.g. products created elsewhere
+        since the last version check) are resolved with one indexed query.
+        """
+        found = {code: self.lookup(code) for code in codes}
+        missing = [code.strip() for code, entry in found.items() if entry is None]
+        if missing:
+            rows = Product.objects.filter(
+                Q(barcode__in=missing) | Q(sku__in=missing), is_active=True
+            ).values_list(*SNAPSHOT_FIELDS)
+            with self._lock:
+                for row in rows:
+                    self._store(self._index, row)
+            for code in found:
+                if found[code] is None:
+                    found[code] = self.lookup(code)
+        return found
+
+    def products(self):
+        """All active products, newest first"""
+        with self._lock:
+            entries = list(self._index.entries.values())
+        entries.sort(key=lambda entry: entry.id, reverse=True)
+        return entries
+
+    def in_stock(self):
+        return [entry for entry in self.products() if entry.current_stock > 0]
+
+    def categories(self, entries=None):
+        entries = self.products() if entries is None else entries
+        return sorted({entry.category for entry in entries if entry.category})
+
+    def search(self, query, limit=10):
+        """
+        Case-insensitive substring match on name, SKU and barcode
+        An exact barcode/SKU hit comes first, then names starting with the
+        query, then shorter names.
+        """
+        needle = query.strip().lower()
+        if not needle:
+            return []
+
+        exact = self.lookup(needle)
+        with self._lock:
+            index = self._index
+            candidates = self._candidates(index, needle)
+
+        matches = []
+        for product_id in candidates:
+            haystack = index.haystacks.get(product_id)
+            if haystack is None or needle not in haystack:
+                continue
+            entry = index.entries.get(product_id)
+            if entry is not None and (exact is None or entry.id != exact.id):
+                matches.append(entry)
+
+        def rank(entry):
+            name = entry.name.lower()
+            return (not name.startswith(needle), len(name), -entry.id)
+
+        results = [exact] if exact else []
+        if limit is None:
+            return results + sorted(matches, key=rank)
+        return results + heapq.nsmallest(max(limit - len(results), 0), matches, key=rank)
+
+    def enable_ngrams(self):
+        """
+        Maintain a trigram -> product ids index so search doesn't scan every
+        product. Costs memory, so it is only built when the in-memory search
+        backend is in use.
+        """
+        with self._lock:
+            index = self._index
+            if index.grams is None:
+                grams = defaultdict(set)
+                for product_id, haystack in index.haystacks.items():
+                    for gram in trigrams(haystack):
+                        grams[gram].add(product_id)
+                index.grams = grams
+
+    def _candidates(self, index, needle):
+        if index.grams is None or len(needle) < 3:
+            return list(index.haystacks)
+        postings = sorted(
+            (index.grams.get(gram, ()) for gram in trigrams(needle)), key=len
+        )
+        if not postings or not postings[0]:
+            return []
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result &= posting
+            if not result:
+                break
+        return list(result)
+
+    # ------------------------------------------------------------------
+    # Freshness
+    # ------------------------------------------------------------------
+
+    def refresh(self, force=False):
+        """
+        Bring the snapshot up to date if another worker changed the catalog
+        The version check is one small query and runs at most once every
+        CATALOG_CHECK_INTERVAL seconds per worker.
+        """
+        now = time.monotonic()
+        if (not force and self.synced_at is not None
+                and now - self.checked_at < settings.CATALOG_CHECK_INTERVAL):
+            return self
+
+        # Read the stamps before the rows so anything newer bumps them again
+        stamps = dict(Counter.objects.filter(
+            name__in=[CHANGES, REBUILDS]
+        ).values_list('name', 'value'))
+        changes = stamps.get(CHANGES, 0)
+        rebuilds = stamps.get(REBUILDS, 0)
+
+        with self._lock:
+            self.checked_at = now
+            too_old = now - self.built_at > settings.CATALOG_MAX_AGE
+            if self.synced_at is None or rebuilds != self.rebuilds or too_old:
+                self._rebuild()
+            elif changes != self.changes:
+                self._sync(Product.objects.filter(
+                    updated_at__gte=self.synced_at - SYNC_OVERLAP
+                ))
+            self.changes = changes
+            self.rebuilds = rebuilds
+        return self
+
+    def _rebuild(self):
+        started = timezone.now()
+        rows = Product.objects.filter(is_active=True).values_list(*SNAPSHOT_FIELDS)
+        # Readers keep using the old index until the new one is complete
+        index = CatalogIndex(grams=self._index.grams is not None)
+        for row in rows.iterator(chunk_size=2000):
+            self._store(index, row)
+        self._index = index
+        self.synced_at = started
+        self.built_at = time.monotonic()
+
+    def _sync(self, queryset, advance=True):
+        started = timezone.now()
+        for row in queryset.values_list(*SNAPSHOT_FIELDS):
+            self._store(self._index, row)
+        if advance:
+            self.synced_at = started
+
+    def _store(self, index, row):
+        product_id, name, sku, barcode, price, stock, reorder, category, image, is_active = row
+        self._discard(index, product_id)
+        if not is_active:
+            return
+        entry = CatalogEntry(
+            product_id, name, sku, barcode, price, stock, reorder, category,
+            default_storage.url(image) if image else None,
+        )
+        haystack = f'{name}\x00{sku}\x00{barcode or ""}'.lower()
+        index.entries[product_id] = entry
+        index.haystacks[product_id] = haystack
+        if index.grams is not None:
+            for gram in trigrams(haystack):
+                index.grams[gram].add(product_id)
+        index.codes[sku.lower()] = product_id
+        if barcode:
+            index.codes[barcode.lower()] = product_id
+
+    def _discard(self, index, product_id):
+        old = index.entries.pop(product_id, None)
+        haystack = index.haystacks.pop(product_id, None)
+        if haystack is not None and index.grams is not None:
+            for gram in trigrams(haystack):
+                posting = index.grams.get(gram)
+                if posting is not None:
+                    posting.discard(product_id)
+                    if not posting:
+                        del index.grams[gram]
+        if old is not None:
+            for code in (old.sku, old.barcode):
+                if code and index.codes.get(code.lower()) == product_id:
+                    del index.codes[code.lower()]
+
+    # ------------------------------------------------------------------
+    # Local write-through (called after commit)
+    # ------------------------------------------------------------------
+
+    def products_changed(self, product_ids):
+        """Reload specific products after this worker saved them"""
+        with self._lock:
+            if self.synced_at is not None:
+                self._sync(Product.objects.filter(id__in=product_ids), advance=False)
+        self._bump(CHANGES)
+
+    def stock_changed(self, levels):
+        """Apply {product_id: new_stock} after this worker moved stock"""
+        with self._lock:
+            entries = self._index.entries
+            for product_id, stock in levels.items():
+                entry = entries.get(product_id)
+                if entry is not None:
+                    entries[product_id] = entry._replace(current_stock=stock)
+        self._bump(CHANGES)
+
+    def invalidate(self):
+        """Force every worker, including this one, to rebuild"""
+        with self._lock:
+            self.synced_at = None
+        self._bump(REBUILDS)
+
+    def _bump(self, name):
+        value = increment(name)
+        with self._lock:
+            # Skip our own resync if nobody else changed anything meanwhile
+            if name == CHANGES and self.changes == value - 1:
+                self.changes = value
+            elif name == REBUILDS and self.rebuilds == value - 1:
+                self.rebuilds = value
+
+
+catalog = Catalog()
+
+
+def get_catalog():
+    """Return the worker's catalog snapshot, refreshed if it is stale"""
+    return catalog.refresh()
+
+
+def on_products_changed(product_ids):
+    transaction.on_commit(lambda: catalog.products_changed(list(product_ids)))
+
+
+def on_stock_changed(levels):
+    transaction.on_commit(lambda: catalog.stock_changed(dict(levels)))
+
+
+def on_catalog_invalidated():
+    transaction.on_commit(catalog.invalidate)
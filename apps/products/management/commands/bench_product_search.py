@@ -0,0 +1,119 @@
+"""
+Benchmark product search backends against catalogs of different sizes
+
+Synthetic products are inserted inside a transaction that is rolled back at
+the end of each size, so the database is left untouched.
+
+Usage: python manage.py bench_product_search --sizes 10000 100000 1000000
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from apps.products.catalog import catalog
+from apps.products.models import Product
+from apps.products.search import (
+    NgramSearchBackend, backend_for_vendor, contains_filter,
+)
+
+
+WORDS = [
+    'bread', 'milk', 'sugar', 'rice', 'maize', 'flour', 'soap', 'tea', 'coffee',
+    'juice', 'water', 'phone', 'charger', 'cable', 'mouse', 'keyboard', 'shirt',
+    'jeans', 'dress', 'shoes', 'novel', 'pen', 'notebook', 'lamp', 'bulb',
+    'lotion', 'shampoo', 'tissue', 'butter', 'cheese', 'yoghurt', 'biscuits',
+]
+SIZES = ['small', 'medium', 'large', '500g', '1kg', '2L', 'pack of 6', 'family']
+
+
+class LegacyBackend:
+    """The original three-way icontains query"""
+    name = 'icontains'
+
+    def search(self, query, limit=10, active_only=True):
+        products = Product.objects.filter(contains_filter(query))
+        if active_only:
+            products = products.filter(is_active=True)
+        return list(products.values_list('id', flat=True)[:limit])
+
+
+class Command(BaseCommand):
+    help = 'Compare product search latency across backends at several catalog sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+        parser.add_argument('--queries', type=int, default=200, help='Queries per backend per size')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        backends = [LegacyBackend(), backend_for_vendor(connection.vendor)(), NgramSearchBackend()]
+
+        self.stdout.write(f'{"products":>10} {"backend":>10} {"p50 ms":>8} {"p95 ms":>8} {"max ms":>8}')
+        for size in options['sizes']:
+            with transaction.atomic():
+                codes = self._populate(size, options['batch_size'], rng)
+                catalog.synced_at = None
+                catalog.refresh(force=True)
+                queries = self._queries(codes, options['queries'], rng)
+
+                for backend in backends:
+                    timings = []
+                    for query in queries:
+                        started = time.perf_counter()
+                        backend.search(query, limit=10)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    timings.sort()
+                    self.stdout.write(
+                        f'{size:>10} {backend.name:>10} '
+                        f'{statistics.median(timings):>8.2f} '
+                        f'{timings[int(len(timings) * 0.95) - 1]:>8.2f} '
+                        f'{timings[-1]:>8.2f}'
+                    )
+                transaction.set_rollback(True)
+
+            # Don't leave rolled back rows in this process's snapshot
+            catalog.synced_at = None
+
+    def _populate(self, size, batch_size, rng):
+        started = time.perf_counter()
+        codes = []
+        batch = []
+        for i in range(size):
+            sku = f'BENCH-{i:08d}'
+            barcode = f'{rng.randrange(10 ** 12, 10 ** 13)}{i % 10}'
+            codes.append((sku, barcode))
+            batch.append(Product(
+                name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(SIZES)}',
+                sku=sku,
+                barcode=barcode,
+                cost_price=10,
+                selling_price=15,
+                current_stock=rng.randint(0, 100),
+            ))
+            if len(batch) >= batch_size:
+                Product.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_create(batch)
+        self.stderr.write(f'Inserted {size} products in {time.perf_counter() - started:.1f}s')
+        return codes
+
+    def _queries(self, codes, count, rng):
+        """A POS-like mix: name fragments, exact SKUs and barcode scans"""
+        queries = []
+        for _ in range(count):
+            kind = rng.random()
+            sku, barcode = rng.choice(codes)
+            if kind < 0.4:
+                word = rng.choice(WORDS)
+                queries.append(word[:rng.randint(3, len(word))])
+            elif kind < 0.7:
+                queries.append(sku)
+            else:
+                queries.append(barcode)
+        return queries
@@ -1,18 +1,31 @@
 """
 Management command to populate sample data
 Create this file: apps/products/management/commands/populate_sample_data.py
+
+Without --scale a few dozen hand-written records are created. With --scale
+the synthetic generator (apps.products.sample_data) writes production-sized
+data: --scale 1 is 1,000 products and 20,000 sales over --days of history.
+
+Usage: python manage.py populate_sample_data --scale 100 --seed 7 --workers 4
 """
 
-from django.core.management.base import BaseCommand
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
+from django.db import connection
 from django.utils import timezone
 from decimal import Decimal
 import random
+import time
 
 from apps.products.models import Product, Category
+from apps.products.catalog import catalog
+from apps.products.sample_data import Plan, generate
 from apps.suppliers.models import Supplier, PurchaseOrder, PurchaseOrderItem
 from apps.sales.models import Sale, SaleItem
 from apps.inventory.models import StockMovement
+from apps.payments.models import Transaction
+from config.caching import LOW_STOCK, PRODUCTS, SALES, STOCK, invalidate
 
 
 class Command(BaseCommand):
@@ -24,14 +37,24 @@ class Command(BaseCommand):
             action='store_true',
             help='Clear existing data before populating',
         )
+        parser.add_argument('--scale', type=float,
+                            help='Generate synthetic data; 1 = 1,000 products and 20,000 sales')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Seed for the generator; the same seed gives the same data')
+        parser.add_argument('--days', type=int, default=365, help='Days of sales history to generate')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per INSERT')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes writing in parallel (PostgreSQL only)')
     
     def handle(self, *args, **options):
         if options['clear']:
             self.stdout.write('Clearing existing data...')
+            # Sales first: their items protect the products they sold
+            Transaction.objects.all().delete()
+            Sale.objects.all().delete()
             Product.objects.all().delete()
             Category.objects.all().delete()
             Supplier.objects.all().delete()
-            Sale.objects.all().delete()
             self.stdout.write(self.style.SUCCESS('Data cleared!'))
         
         self.stdout.write('Creating sample data...')
@@ -50,6 +73,9 @@ class Command(BaseCommand):
             admin.save()
             self.stdout.write(self.style.SUCCESS(f'Created admin user'))
         
+        if options['scale'] is not None:
+            return self.generate(admin, options)
+        
         # Create Categories
         categories_data = [
             ('Electronics', 'Electronic devices and accessories'),
@@ -259,6 +285,39 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS('\nAdmin Login:'))
         self.stdout.write('Username: admin')
         self.stdout.write('Password: admin123')
+    
+    def generate(self, admin, options):
+        """Write a synthetic data set with the bulk generator"""
+        if options['scale'] <= 0 or options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--scale, --days and --batch-size must be positive')
+        plan = Plan(options['scale'], options['seed'], options['days'], options['batch_size'], admin.id)
+        if Product.objects.filter(sku__startswith=plan.prefix).exists():
+            raise CommandError(
+                f'Data for seed {plan.seed} already exists; use --clear or another --seed'
+            )
+        
+        workers = max(1, options['workers'])
+        if workers > 1 and connection.vendor == 'sqlite':
+            # SQLite has a single writer, so extra processes only wait on its lock
+            self.stdout.write(self.style.WARNING('SQLite allows one writer at a time; using 1 worker'))
+            workers = 1
+        
+        self.stdout.write(
+            f'Generating {plan.product_count} products and {plan.sale_count} sales '
+            f'from {plan.start} to {plan.end} (seed {plan.seed}, {workers} worker(s))...'
+        )
+        started = time.perf_counter()
+        counts = generate(plan, workers=workers, progress=self.stdout.write)
+        elapsed = time.perf_counter() - started
+        
+        # Bulk inserts skip checkout and the model signals
+        call_command('rebuild_sales_rollups', start=str(plan.start), end=str(plan.end), stdout=self.stdout)
+        catalog.invalidate()
+        invalidate(PRODUCTS, SALES, STOCK, LOW_STOCK)
+        
+        self.stdout.write(self.style.SUCCESS(f'\n=== Generated in {elapsed:.1f}s ==='))
+        for name, count in counts.items():
+            self.stdout.write(f"{name.replace('_', ' ').capitalize()}: {count} ({count / elapsed:.0f}/s)")
 
 
 # # Alternative: JSON Fixture
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from apps.products.search import backend_for_vendor
+    backend_for_vendor(schema_editor.connection.vendor).install(schema_editor)
+
+
+def remove_search_index(apps, schema_editor):
+    from apps.products.search import backend_for_vendor
+    backend_for_vendor(schema_editor.connection.vendor).uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, remove_search_index),
+    ]
@@ -46,6 +46,7 @@ class Product(models.Model):
             models.Index(fields=['sku']),
             models.Index(fields=['barcode']),
             models.Index(fields=['name']),
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
@@ -0,0 +1,354 @@
+"""
+Synthetic data at production scale
+
+Generates products, sales, sale items, stock movements and M-Pesa
+transactions through bulk_create. Every row is derived from the seed and its
+own position (product chunk or sales week), never from the order work happens
+in, so a seed produces the same data with one worker or eight.
+
+Sales are written a week at a time. Each week opens with one delivery per
+product the week will sell, sized to exactly what it sells, so every
+product's stock ledger closes the week back at its par level (the product's
+current_stock). That keeps weeks independent of each other, which is what
+lets workers write them in parallel.
+"""
+import math
+import multiprocessing
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from apps.inventory.models import StockMovement
+from apps.payments.models import Transaction
+from apps.sales.models import Sale, SaleItem
+from .models import Category, Product
+
+PRODUCTS_PER_SCALE = 1000
+SALES_PER_SCALE = 20000
+PRODUCT_CHUNK = 10000
+
+CATEGORIES = {
+    'Electronics': ['Phone', 'Charger', 'Earphones', 'Flash Drive', 'Power Bank', 'Cable'],
+    'Groceries': ['Rice', 'Cooking Oil', 'Sugar', 'Wheat Flour', 'Tea Leaves', 'Maize Flour', 'Milk'],
+    'Clothing': ['T-Shirt', 'Dress', 'Jeans', 'Sports Shoes', 'Socks', 'Jacket'],
+    'Books': ['Notebook', 'Pen Set', 'Exercise Book', 'Textbook', 'Novel'],
+    'Home & Garden': ['LED Bulb', 'Garden Hose', 'Bucket', 'Extension Cable', 'Padlock'],
+    'Health & Beauty': ['Hand Sanitizer', 'Lotion', 'Shampoo', 'Toothpaste', 'Bar Soap'],
+}
+# Groceries dominate a Kenyan general store's range
+CATEGORY_WEIGHTS = [10, 40, 15, 10, 10, 15]
+BRANDS = ['Acme', 'Jambo', 'Savanna', 'Kilima', 'Safari', 'Pwani', 'Baraka', 'Simba', 'Tusker', 'Zuri']
+SIZES = ['Small', 'Medium', 'Large', '250g', '500g', '1kg', '2kg', '500ml', '1L', '2L', 'Pack of 6']
+
+FIRST_NAMES = ['Wanjiku', 'Otieno', 'Kamau', 'Achieng', 'Mwangi', 'Njeri', 'Kiptoo', 'Auma',
+               'Mutua', 'Wairimu', 'Omondi', 'Chebet', 'Kariuki', 'Nyambura', 'Wekesa', 'Akinyi']
+LAST_NAMES = ['Kimani', 'Odhiambo', 'Njoroge', 'Ochieng', 'Mutiso', 'Kiprono', 'Wambui',
+              'Onyango', 'Macharia', 'Barasa', 'Cheruiyot', 'Gitau']
+
+PAYMENT_METHODS = ['CASH', 'MPESA', 'CARD']
+PAYMENT_WEIGHTS = [35, 55, 10]
+# Trading hours 08:00-21:00 with lunchtime and after-work peaks; Monday first
+HOURS = list(range(8, 21))
+HOUR_WEIGHTS = [3, 4, 5, 6, 9, 8, 5, 5, 6, 9, 10, 7, 3]
+WEEKDAY_WEIGHTS = [0.85, 0.85, 0.9, 0.95, 1.15, 1.3, 1.0]
+STK_FAILURES = [
+    ('CANCELLED', 'Request cancelled by user'),
+    ('FAILED', 'The balance is insufficient for the request'),
+    ('FAILED', 'DS timeout user cannot be reached'),
+]
+
+
+@contextmanager
+def historical_timestamps(*models):
+    """Let bulk_create keep generated created_at/updated_at values"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def ean13(digits):
+    """Append the EAN-13 check digit to 12 digits"""
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return f'{digits}{(10 - total % 10) % 10}'
+
+
+class Plan:
+    """Sizes and date range of a generated data set"""
+
+    def __init__(self, scale, seed, days, batch_size, user_id=None):
+        self.seed = seed
+        self.product_count = max(1, round(PRODUCTS_PER_SCALE * scale))
+        self.sale_count = max(1, round(SALES_PER_SCALE * scale))
+        self.customer_count = max(1, self.sale_count // 8)
+        self.batch_size = batch_size
+        self.user_id = user_id
+        self.end = timezone.localdate()
+        self.start = self.end - timedelta(days=days - 1)
+        self.prefix = f'GEN-{seed}-'
+
+    def rng(self, *parts):
+        return random.Random(':'.join(str(part) for part in (self.seed, *parts)))
+
+    def product_chunks(self):
+        return [
+            (start, min(start + PRODUCT_CHUNK, self.product_count))
+            for start in range(0, self.product_count, PRODUCT_CHUNK)
+        ]
+
+    def weeks(self):
+        """[(week, [(day, sale count), ...])] with sales spread over the days"""
+        rng = self.rng('days')
+        days = [self.start + timedelta(days=n) for n in range((self.end - self.start).days + 1)]
+        # Weekly seasonality, noise and a business that grows over the period
+        weights = [
+            WEEKDAY_WEIGHTS[day.weekday()] * rng.uniform(0.8, 1.2) * (1 + n / len(days))
+            for n, day in enumerate(days)
+        ]
+        scale = self.sale_count / sum(weights)
+        counts = [int(weight * scale) for weight in weights]
+        # Hand out the remainder to the days that were rounded down most
+        by_remainder = sorted(range(len(days)), key=lambda n: counts[n] - weights[n] * scale)
+        for n in by_remainder[:self.sale_count - sum(counts)]:
+            counts[n] += 1
+
+        return [
+            (week, list(zip(days[week * 7:week * 7 + 7], counts[week * 7:week * 7 + 7])))
+            for week in range(math.ceil(len(days) / 7))
+        ]
+
+
+# Product rows, loaded once by the parent before forking and shared with workers
+_catalog = None
+
+
+def write_products(plan, start, end, category_ids):
+    """Insert products start..end-1 and their opening stock movements"""
+    rng = plan.rng('products', start)
+    names = list(CATEGORIES)
+    products = []
+    for i in range(start, end):
+        category = rng.choices(range(len(names)), weights=CATEGORY_WEIGHTS)[0]
+        cost = max(10, round(math.exp(rng.gauss(math.log(250), 1.0))))
+        reorder = rng.choice([5, 10, 10, 20, 50])
+        created = timezone.make_aware(datetime.combine(
+            plan.start - timedelta(days=rng.randint(1, 180)), time(7)
+        ))
+        products.append(Product(
+            name=f'{rng.choice(BRANDS)} {rng.choice(CATEGORIES[names[category]])} {rng.choice(SIZES)}',
+            sku=f'{plan.prefix}{i:07d}',
+            barcode=ean13(f'2{plan.seed % 1000:03d}{i:08d}'),
+            category_id=category_ids[names[category]],
+            cost_price=Decimal(cost),
+            selling_price=Decimal(round(cost * rng.uniform(1.15, 1.6))),
+            current_stock=0 if rng.random() < 0.02 else int(reorder * rng.uniform(0.5, 6)),
+            reorder_level=reorder,
+            is_active=rng.random() < 0.97,
+            created_by_id=plan.user_id,
+            created_at=created,
+            updated_at=created,
+        ))
+
+    with transaction.atomic():
+        Product.objects.bulk_create(products, batch_size=plan.batch_size)
+        movements = StockMovement.objects.bulk_create([
+            StockMovement(
+                product_id=product.id, movement_type='IN', quantity=product.current_stock,
+                reference='Initial Stock', stock_before=0, stock_after=product.current_stock,
+                created_by_id=plan.user_id, created_at=product.created_at,
+            )
+            for product in products if product.current_stock
+        ], batch_size=plan.batch_size)
+    return len(products), len(movements)
+
+
+def load_catalog(plan):
+    """Ids, prices and par stock of the generated products, plus sale weights"""
+    global _catalog
+    rows = list(Product.objects.filter(sku__startswith=plan.prefix).order_by('sku').values_list(
+        'id', 'selling_price', 'cost_price', 'current_stock', 'is_active',
+    ))
+    # A few best sellers and a long tail; inactive products don't sell
+    ranks = list(range(1, len(rows) + 1))
+    plan.rng('popularity').shuffle(ranks)
+    weights = [rank ** -1.07 if row[4] else 0 for rank, row in zip(ranks, rows)]
+    _catalog = {
+        'rows': rows,
+        'indexes': range(len(rows)),
+        'cum_weights': list(accumulate(weights)),
+    }
+    return _catalog
+
+
+def write_week(plan, week, days):
+    """Insert one week of sales and everything that goes with them"""
+    rng = plan.rng('week', week)
+    rows = _catalog['rows']
+    sales, lines, payments = [], [], []
+
+    for day, count in days:
+        times = sorted(
+            (rng.choices(HOURS, weights=HOUR_WEIGHTS)[0], rng.randrange(60), rng.randrange(60))
+            for _ in range(count)
+        )
+        for n, (hour, minute, second) in enumerate(times):
+            at = timezone.make_aware(datetime.combine(day, time(hour, minute, second)))
+            sale = Sale(
+                sale_number=f'{plan.prefix}{day:%Y%m%d}-{n:06d}',
+                payment_method=rng.choices(PAYMENT_METHODS, weights=PAYMENT_WEIGHTS)[0],
+                created_by_id=plan.user_id,
+                created_at=at,
+            )
+            if rng.random() < 0.4:
+                # Log-uniform customer ids give many one-off and a few regular customers
+                customer = int(plan.customer_count ** rng.random()) - 1
+                sale.customer_name = (
+                    f'{FIRST_NAMES[customer % len(FIRST_NAMES)]} '
+                    f'{LAST_NAMES[customer // len(FIRST_NAMES) % len(LAST_NAMES)]}'
+                )
+                sale.customer_phone = f'2547{(customer * 7919 + plan.seed) % 10 ** 8:08d}'
+
+            line_count = min(1 + int(rng.expovariate(1 / 1.5)), 12)
+            picks = set(rng.choices(_catalog['indexes'], cum_weights=_catalog['cum_weights'], k=line_count))
+            total = Decimal('0')
+            for product in sorted(picks):
+                quantity = 1 if rng.random() < 0.7 else rng.randint(2, 6)
+                total += rows[product][1] * quantity
+                lines.append((len(sales), product, quantity))
+            sale.total_amount = total
+            sales.append(sale)
+
+            if sale.payment_method == 'MPESA':
+                sale.mpesa_transaction_id = _receipt(rng)
+                payments.append((len(sales) - 1, rng.random() < 0.08))
+
+    with transaction.atomic():
+        Sale.objects.bulk_create(sales, batch_size=plan.batch_size)
+        SaleItem.objects.bulk_create([
+            SaleItem(
+                sale_id=sales[sale].id, product_id=rows[product][0], quantity=quantity,
+                unit_price=rows[product][1], unit_cost=rows[product][2],
+                subtotal=rows[product][1] * quantity,
+            )
+            for sale, product, quantity in lines
+        ], batch_size=plan.batch_size)
+        movements = _movements(plan, week, days[0][0], sales, lines)
+        StockMovement.objects.bulk_create(movements, batch_size=plan.batch_size)
+        transactions = _transactions(plan, rng, sales, payments)
+        Transaction.objects.bulk_create(transactions, batch_size=plan.batch_size)
+    return len(sales), len(lines), len(movements), len(transactions)
+
+
+def _movements(plan, week, first_day, sales, lines):
+    """The week's deliveries followed by one OUT movement per line"""
+    rows = _catalog['rows']
+    sold = {}
+    for _, product, quantity in lines:
+        sold[product] = sold.get(product, 0) + quantity
+
+    delivered_at = timezone.make_aware(datetime.combine(first_day, time(7)))
+    movements = []
+    stock = {}
+    for product, quantity in sold.items():
+        par = rows[product][3]
+        stock[product] = par + quantity
+        movements.append(StockMovement(
+            product_id=rows[product][0], movement_type='IN', quantity=quantity,
+            reference=f'GRN-{plan.seed}-{week:04d}', notes='Weekly delivery',
+            stock_before=par, stock_after=par + quantity,
+            created_by_id=plan.user_id, created_at=delivered_at,
+        ))
+    for sale, product, quantity in lines:
+        sale = sales[sale]
+        movements.append(StockMovement(
+            product_id=rows[product][0], movement_type='OUT', quantity=quantity,
+            reference=sale.sale_number, notes=f'Sale {sale.sale_number}',
+            stock_before=stock[product], stock_after=stock[product] - quantity,
+            created_by_id=plan.user_id, created_at=sale.created_at,
+        ))
+        stock[product] -= quantity
+    return movements
+
+
+def _transactions(plan, rng, sales, payments):
+    """STK pushes for M-Pesa sales, some after a failed first attempt"""
+    transactions = []
+    for sale, failed_first in payments:
+        sale = sales[sale]
+        phone = sale.customer_phone or f'2547{rng.randrange(10 ** 8):08d}'
+        attempts = [rng.choice(STK_FAILURES)] if failed_first else []
+        attempts.append(('SUCCESS', 'The service request is processed successfully.'))
+        for n, (status, description) in enumerate(attempts):
+            started = sale.created_at - timedelta(seconds=rng.randint(20, 90) * (len(attempts) - n))
+            transactions.append(Transaction(
+                transaction_type='STK_PUSH', amount=sale.total_amount, phone_number=phone,
+                merchant_request_id=f'{rng.randrange(10 ** 5)}-{rng.randrange(10 ** 8)}-1',
+                checkout_request_id=f'ws_CO_{started:%d%m%Y%H%M%S}{rng.randrange(10 ** 9):09d}',
+                mpesa_receipt_number=sale.mpesa_transaction_id if status == 'SUCCESS' else '',
+                status=status, result_desc=description, sale_id=sale.id,
+                created_at=started, updated_at=started + timedelta(seconds=rng.randint(5, 15)),
+            ))
+    return transactions
+
+
+def _receipt(rng):
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    return rng.choice('QRST') + ''.join(rng.choices(alphabet, k=9))
+
+
+def _call(args):
+    function, task = args
+    return function(*task)
+
+
+def run_tasks(function, tasks, workers):
+    """Yield function(*task) for each task, in a pool of forked workers if workers > 1"""
+    if workers <= 1:
+        for task in tasks:
+            yield function(*task)
+        return
+
+    # Children must open their own connections
+    connections.close_all()
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        yield from pool.imap_unordered(_call, [(function, task) for task in tasks])
+
+
+def generate(plan, workers=1, progress=None):
+    """
+    Write the whole data set. Returns row counts by model name.
+    progress(message) is called as products and weeks are written.
+    """
+    progress = progress or (lambda message: None)
+    category_ids = {}
+    for name in CATEGORIES:
+        category_ids[name] = Category.objects.get_or_create(name=name)[0].id
+
+    counts = dict.fromkeys(['products', 'sales', 'sale_items', 'stock_movements', 'transactions'], 0)
+    with historical_timestamps(Product, Sale, StockMovement, Transaction):
+        tasks = [(plan, start, end, category_ids) for start, end in plan.product_chunks()]
+        for products, movements in run_tasks(write_products, tasks, workers):
+            counts['products'] += products
+            counts['stock_movements'] += movements
+            progress(f"{counts['products']}/{plan.product_count} products")
+
+        load_catalog(plan)
+        tasks = [(plan, week, days) for week, days in plan.weeks()]
+        for done, written in enumerate(run_tasks(write_week, tasks, workers), 1):
+            for key, value in zip(['sales', 'sale_items', 'stock_movements', 'transactions'], written):
+                counts[key] += value
+            progress(f"week {done}/{len(tasks)}: {counts['sales']}/{plan.sale_count} sales")
+    return counts
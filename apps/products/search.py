@@ -0,0 +1,293 @@
+"""
+Pluggable product search
+
+Backends return ranked product ids for a free-text query:
+  sqlite    FTS5 trigram index kept in sync by triggers
+  postgres  pg_trgm GIN indexes, ranked by trigram similarity
+  ngram     pure-Python trigram index on the in-process catalog snapshot
+
+An exact barcode or SKU match always short-circuits to the top of the results.
+Select a backend with PRODUCT_SEARCH_BACKEND ('auto' picks one for the
+database vendor).
+"""
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+
+def contains_filter(query):
+    """The legacy three-way icontains filter"""
+    return (
+        Q(name__icontains=query) |
+        Q(sku__icontains=query) |
+        Q(barcode__icontains=query)
+    )
+
+
+def executor(schema_editor=None):
+    """Run DDL through the migration's schema editor, or a plain cursor"""
+    if schema_editor is not None:
+        return schema_editor.execute
+
+    def execute(sql):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+    return execute
+
+
+class SearchBackend:
+    """Base class; subclasses implement ranked()"""
+    name = None
+
+    def search(self, query, limit=10, active_only=True):
+        """Return up to `limit` product ids (all matches if limit is None), best first"""
+        query = query.strip()
+        if not query:
+            return []
+
+        exact = self.exact_match(query, active_only)
+        ids = [exact] if exact is not None else []
+        for product_id in self.ranked(query, limit, active_only):
+            if product_id != exact:
+                ids.append(product_id)
+        return ids if limit is None else ids[:limit]
+
+    def exact_match(self, query, active_only):
+        """Barcode/SKU lookup through the unique indexes"""
+        products = Product.objects.filter(Q(barcode=query) | Q(sku=query))
+        if active_only:
+            products = products.filter(is_active=True)
+        return products.values_list('id', flat=True).first()
+
+    def ranked(self, query, limit, active_only):
+        raise NotImplementedError
+
+    def filter(self, queryset, query):
+        """Narrow a product queryset to every match, unranked and uncapped"""
+        query = query.strip()
+        return queryset.filter(contains_filter(query)) if query else queryset
+
+    def fallback(self, query, limit, active_only):
+        """Plain icontains scan, for queries the index can't serve"""
+        products = Product.objects.filter(contains_filter(query))
+        if active_only:
+            products = products.filter(is_active=True)
+        products = products.order_by('name').values_list('id', flat=True)
+        return list(products if limit is None else products[:limit])
+
+    @classmethod
+    def install(cls, schema_editor=None):
+        """Create whatever database objects the backend needs"""
+
+    @classmethod
+    def uninstall(cls, schema_editor=None):
+        """Drop the backend's database objects"""
+
+
+class SQLiteFTSSearchBackend(SearchBackend):
+    """
+    SQLite FTS5 backend
+    An external-content FTS5 table with the trigram tokenizer gives indexed
+    substring matching; triggers keep it in step with products_product, so
+    bulk updates are indexed too.
+    """
+    name = 'sqlite'
+    table = 'products_product_fts'
+
+    STATEMENTS = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts USING fts5("
+        "name, sku, barcode, content='products_product', content_rowid='id', "
+        "tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS products_product_fts_ai AFTER INSERT ON products_product BEGIN "
+        "INSERT INTO products_product_fts(rowid, name, sku, barcode) "
+        "VALUES (new.id, new.name, new.sku, new.barcode); END",
+        "CREATE TRIGGER IF NOT EXISTS products_product_fts_ad AFTER DELETE ON products_product BEGIN "
+        "INSERT INTO products_product_fts(products_product_fts, rowid, name, sku, barcode) "
+        "VALUES ('delete', old.id, old.name, old.sku, old.barcode); END",
+        "CREATE TRIGGER IF NOT EXISTS products_product_fts_au AFTER UPDATE OF name, sku, barcode "
+        "ON products_product BEGIN "
+        "INSERT INTO products_product_fts(products_product_fts, rowid, name, sku, barcode) "
+        "VALUES ('delete', old.id, old.name, old.sku, old.barcode); "
+        "INSERT INTO products_product_fts(rowid, name, sku, barcode) "
+        "VALUES (new.id, new.name, new.sku, new.barcode); END",
+    ]
+
+    def __init__(self):
+        self._checked = False
+
+    def ranked(self, query, limit, active_only):
+        if len(query) < 3:
+            # The trigram tokenizer can't match fewer than three characters
+            return self.fallback(query, limit, active_only)
+        self.ensure_installed()
+
+        phrase = '"%s"' % query.replace('"', '""')
+        sql = (
+            'SELECT f.rowid FROM products_product_fts f '
+            'JOIN products_product p ON p.id = f.rowid '
+            'WHERE products_product_fts MATCH %s'
+        )
+        if active_only:
+            sql += ' AND p.is_active'
+        sql += ' ORDER BY f.rank LIMIT %s'
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [phrase, -1 if limit is None else limit + 1])
+            return [row[0] for row in cursor.fetchall()]
+
+    def filter(self, queryset, query):
+        query = query.strip()
+        if len(query) < 3:
+            return super().filter(queryset, query)
+        self.ensure_installed()
+        # A subquery, so broad queries don't turn into an id list of every match
+        matches = RawSQL(
+            'SELECT rowid FROM products_product_fts WHERE products_product_fts MATCH %s',
+            ['"%s"' % query.replace('"', '""')]
+        )
+        return queryset.filter(id__in=matches)
+
+    def ensure_installed(self):
+        """
+        Recreate the index if it's missing. SQLite migrations rebuild tables
+        on ALTER, which silently drops triggers on products_product.
+        """
+        if self._checked:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                ['products_product_fts_%']
+            )
+            triggers = cursor.fetchone()[0]
+        if triggers < 3:
+            logger.warning('Product search index missing or incomplete, rebuilding')
+            self.install()
+        self._checked = True
+
+    @classmethod
+    def install(cls, schema_editor=None):
+        execute = executor(schema_editor)
+        for statement in cls.STATEMENTS:
+            execute(statement)
+        execute("INSERT INTO products_product_fts(products_product_fts) VALUES ('rebuild')")
+
+    @classmethod
+    def uninstall(cls, schema_editor=None):
+        execute = executor(schema_editor)
+        for trigger in ('ai', 'ad', 'au'):
+            execute(f'DROP TRIGGER IF EXISTS products_product_fts_{trigger}')
+        execute('DROP TABLE IF EXISTS products_product_fts')
+
+
+class PostgresTrigramSearchBackend(SearchBackend):
+    """
+    PostgreSQL pg_trgm backend
+    GIN trigram indexes on UPPER(col) let the ORM's icontains lookups use an
+    index; results are ranked by trigram similarity.
+    """
+    name = 'postgres'
+    columns = ('name', 'sku', 'barcode')
+
+    def ranked(self, query, limit, active_only):
+        from django.contrib.postgres.search import TrigramSimilarity
+        from django.db.models.functions import Greatest
+
+        products = Product.objects.filter(contains_filter(query))
+        if active_only:
+            products = products.filter(is_active=True)
+        products = products.annotate(
+            rank=Greatest(
+                TrigramSimilarity('name', query),
+                TrigramSimilarity('sku', query),
+            )
+        ).order_by('-rank', 'name').values_list('id', flat=True)
+        return list(products if limit is None else products[:limit + 1])
+
+    @classmethod
+    def install(cls, schema_editor=None):
+        execute = executor(schema_editor)
+        execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in cls.columns:
+            execute(
+                f'CREATE INDEX IF NOT EXISTS products_product_{column}_trgm '
+                f'ON products_product USING gin ((UPPER({column}::text)) gin_trgm_ops)'
+            )
+
+    @classmethod
+    def uninstall(cls, schema_editor=None):
+        execute = executor(schema_editor)
+        for column in cls.columns:
+            execute(f'DROP INDEX IF EXISTS products_product_{column}_trgm')
+
+
+class NgramSearchBackend(SearchBackend):
+    """
+    Pure-Python fallback for databases without a usable text index
+    Searches the in-process catalog snapshot, which only holds active
+    products; other searches fall back to the database.
+    """
+    name = 'ngram'
+
+    def __init__(self):
+        from .catalog import catalog
+        catalog.enable_ngrams()
+
+    def search(self, query, limit=10, active_only=True):
+        from .catalog import get_catalog
+
+        if not active_only:
+            return super().search(query, limit, active_only)
+        return [entry.id for entry in get_catalog().search(query, limit)]
+
+    def ranked(self, query, limit, active_only):
+        return self.fallback(query, limit, active_only)
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTSSearchBackend,
+    'postgres': PostgresTrigramSearchBackend,
+    'ngram': NgramSearchBackend,
+}
+
+_backend = None
+
+
+def backend_for_vendor(vendor):
+    if vendor == 'sqlite':
+        return SQLiteFTSSearchBackend
+    if vendor == 'postgresql':
+        return PostgresTrigramSearchBackend
+    return NgramSearchBackend
+
+
+def get_search_backend():
+    """Return the configured backend instance (created once per process)"""
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'auto')
+        if name == 'auto':
+            backend_class = backend_for_vendor(connection.vendor)
+        elif name in BACKENDS:
+            backend_class = BACKENDS[name]
+        else:
+            backend_class = import_string(name)
+        _backend = backend_class()
+    return _backend
+
+
+def search_products(query, limit=10, active_only=True):
+    """Ranked product ids for a free-text query"""
+    return get_search_backend().search(query, limit=limit, active_only=active_only)
+
+
+def filter_products(queryset, query):
+    """Narrow a product queryset to all matches for a query, keeping its ordering"""
+    return get_search_backend().filter(queryset, query)
@@ -0,0 +1,29 @@
+"""
+Keep the in-process POS catalog and cached figures in step with Product and
+Category writes
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from config.caching import PRODUCTS, invalidate_on_commit
+from .catalog import on_catalog_invalidated, on_products_changed
+from .models import Category, Product
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    on_products_changed([instance.id])
+    invalidate_on_commit(PRODUCTS)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    on_catalog_invalidated()
+    invalidate_on_commit(PRODUCTS)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    on_catalog_invalidated()
+    invalidate_on_commit(PRODUCTS)
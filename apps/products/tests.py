@@ -1,3 +1,147 @@
+from unittest import mock
+
+from django.db import connection
+from django.db.models import Sum
 from django.test import TestCase
 
-# Create your tests here.
+from apps.inventory.models import StockMovement
+from apps.payments.models import Transaction
+from apps.sales.models import Sale, SaleItem
+from .catalog import Catalog
+from .models import Product
+from .search import SearchBackend, SQLiteFTSSearchBackend, filter_products
+from .sample_data import Plan, generate
+
+
+class SampleDataTests(TestCase):
+    """The synthetic generator should be deterministic and internally consistent"""
+
+    def generate(self, seed=5):
+        plan = Plan(scale=0.01, seed=seed, days=21, batch_size=50)
+        return plan, generate(plan)
+
+    def snapshot(self):
+        return (
+            list(Product.objects.order_by('sku').values_list('sku', 'selling_price', 'current_stock')),
+            list(Sale.objects.order_by('sale_number').values_list(
+                'sale_number', 'total_amount', 'customer_name', 'payment_method', 'created_at')),
+            list(SaleItem.objects.order_by('sale__sale_number', 'product__sku').values_list(
+                'product__sku', 'quantity', 'subtotal')),
+            Transaction.objects.count(),
+        )
+
+    def test_same_seed_gives_same_data(self):
+        self.generate()
+        first = self.snapshot()
+        Transaction.objects.all().delete()
+        Sale.objects.all().delete()
+        Product.objects.all().delete()
+
+        self.generate()
+        self.assertEqual(self.snapshot(), first)
+
+    def test_rows_are_consistent(self):
+        plan, counts = self.generate()
+        self.assertEqual(counts['sales'], plan.sale_count)
+        self.assertEqual(Sale.objects.count(), plan.sale_count)
+        self.assertEqual(StockMovement.objects.count(), counts['stock_movements'])
+
+        # Sale totals match their lines
+        self.assertEqual(
+            Sale.objects.aggregate(total=Sum('total_amount'))['total'],
+            SaleItem.objects.aggregate(total=Sum('subtotal'))['total'],
+        )
+        # Every product's ledger chains and closes at its current stock
+        for product in Product.objects.all():
+            stock = 0
+            for before, after in StockMovement.objects.filter(product=product).order_by(
+                    'created_at', 'id').values_list('stock_before', 'stock_after'):
+                self.assertEqual(before, stock)
+                stock = after
+            self.assertEqual(stock, product.current_stock)
+
+
+class CatalogTests(TestCase):
+
+    def test_lookups_see_old_snapshot_during_rebuild(self):
+        Product.objects.create(name='Milk 500ml', sku='MLK-1', barcode='600100', cost_price=50, selling_price=65)
+        Product.objects.create(name='Bread', sku='BRD-1', cost_price=40, selling_price=55)
+        catalog = Catalog().refresh(force=True)
+        catalog.enable_ngrams()
+
+        seen = []
+        store = catalog._store
+
+        def store_and_look(index, row):
+            store(index, row)
+            seen.append((catalog.lookup('600100'), catalog.get(row[0])))
+
+        with mock.patch.object(catalog, '_store', side_effect=store_and_look):
+            catalog._rebuild()
+
+        self.assertTrue(all(code and entry for code, entry in seen))
+        self.assertEqual(catalog.lookup('brd-1').name, 'Bread')
+        self.assertEqual([entry.sku for entry in catalog.search('milk')], ['MLK-1'])
+
+
+class SearchFilterTests(TestCase):
+
+    def test_filter_keeps_every_match(self):
+        Product.objects.bulk_create(
+            Product(name=f'Milk {i}', sku=f'MLK-{i}', cost_price=50, selling_price=65, is_active=i % 2 == 0)
+            for i in range(30)
+        )
+        Product.objects.create(name='Bread', sku='BRD-1', cost_price=40, selling_price=55)
+
+        for backend in (SQLiteFTSSearchBackend(), SearchBackend()):
+            with mock.patch('apps.products.search._backend', backend):
+                matches = filter_products(Product.objects.all(), 'milk')
+                self.assertEqual(matches.count(), 30)
+                self.assertEqual(filter_products(Product.objects.all(), 'BRD-1').get().name, 'Bread')
+
+
+class SearchBackendTests(TestCase):
+
+    def setUp(self):
+        for name, sku, barcode, active in [
+            ('Chocolate bar', 'MILK-CHOC', None, True),
+            ('Fresh Milk 500ml', 'FM-1', '600100', True),
+            ('Milk', 'MLK-2', None, True),
+            ('Milky Bar', 'MB-1', '600200', True),
+            ('Bread', 'BRD-1', '6001', True),
+            ('Milk powder', 'MP-1', None, False),
+        ]:
+            Product.objects.create(
+                name=name, sku=sku, barcode=barcode, cost_price=1, selling_price=2, is_active=active
+            )
+        self.backend = SQLiteFTSSearchBackend()
+
+    def names(self, query, **kwargs):
+        return [Product.objects.get(id=i).name for i in self.backend.search(query, **kwargs)]
+
+    def test_ranked_matches(self):
+        names = self.names('milk')
+        self.assertEqual(names[0], 'Milk')
+        self.assertEqual(set(names), {'Milk', 'Milky Bar', 'Chocolate bar', 'Fresh Milk 500ml'})
+        self.assertEqual(self.names('milk', limit=2), names[:2])
+        self.assertIn('Milk powder', self.names('milk', active_only=False))
+
+    def test_exact_code_comes_first(self):
+        # '6001' is Bread's barcode and also part of Fresh Milk's
+        self.assertEqual(self.names('6001'), ['Bread', 'Fresh Milk 500ml'])
+        self.assertEqual(self.names('mb-1'), ['Milky Bar'])
+
+    def test_short_queries_fall_back_to_contains(self):
+        self.assertEqual(self.names('mi'), ['Chocolate bar', 'Fresh Milk 500ml', 'Milk', 'Milky Bar'])
+
+    def test_index_is_rebuilt_when_triggers_are_lost(self):
+        # What a migration that rebuilds products_product leaves behind
+        with connection.cursor() as cursor:
+            for trigger in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER products_product_fts_{trigger}')
+        Product.objects.create(name='Maziwa Lala', sku='ML-1', cost_price=1, selling_price=2)
+
+        with self.assertLogs('apps.products.search', 'WARNING'):
+            self.assertEqual(self.names('maziwa'), ['Maziwa Lala'])
+        Product.objects.filter(sku='ML-1').update(name='Mala')
+        self.assertEqual(self.names('maziwa'), [])
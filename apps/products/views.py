@@ -6,8 +6,10 @@ from django.db.models import Q, Sum, F
 from django.http import JsonResponse
 from django.core.paginator import Paginator
 from .models import Product, Category
+from .search import filter_products
 from .forms import ProductForm, CategoryForm
 from apps.inventory.models import StockMovement
+from config.query_budget import query_budget
 
 # Create your views here.
 
@@ -18,6 +20,7 @@ def index(request):
 
 
 @login_required
+@query_budget(8)
 def product_list(request):
     """Display list of all products"""
     products = Product.objects.select_related('category').all()
@@ -25,11 +28,7 @@ def product_list(request):
     # Search
     search_query = request.GET.get('search', '')
     if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(sku__icontains=search_query) |
-            Q(barcode__icontains=search_query)
-        )
+        products = filter_products(products, search_query)
     
     # Category filter
     category_id = request.GET.get('category')
@@ -59,27 +58,24 @@ def product_list(request):
 
 
 @login_required
+@query_budget(8)
 def product_detail(request, product_id):
     """View product details"""
     product = get_object_or_404(Product, id=product_id)
-    stock_movements = StockMovement.objects.filter(product=product).order_by('-created_at')[:20]
+    movements = StockMovement.objects.filter(product=product)
+    stock_movements = movements.select_related('created_by').order_by('-created_at')[:20]
     
     # Calculate statistics
-    total_sold = StockMovement.objects.filter(
-        product=product,
-        movement_type='OUT'
-    ).aggregate(total=Sum('quantity'))['total'] or 0
-    
-    total_received = StockMovement.objects.filter(
-        product=product,
-        movement_type='IN'
-    ).aggregate(total=Sum('quantity'))['total'] or 0
+    totals = movements.aggregate(
+        total_sold=Sum('quantity', filter=Q(movement_type='OUT')),
+        total_received=Sum('quantity', filter=Q(movement_type='IN')),
+    )
     
     context = {
         'product': product,
         'stock_movements': stock_movements,
-        'total_sold': total_sold,
-        'total_received': total_received,
+        'total_sold': totals['total_sold'] or 0,
+        'total_received': totals['total_received'] or 0,
     }
     return render(request, 'products/product_detail.html', context)
 
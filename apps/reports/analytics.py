@@ -0,0 +1,209 @@
+"""
+Columnar report analytics
+Reports that used to iterate model instances read just the columns they need
+with values_list, a chunk at a time, into NumPy arrays and do their group-bys,
+margins and top-N with vectorised operations.
+
+Money is cast to integer cents in SQL and carried as int64, so sums are exact.
+Columns whose totals could overflow int64 fall back to Python ints (object
+arrays), which are slower but still exact. Results come back as Decimals.
+"""
+from decimal import Decimal
+from itertools import islice
+
+import numpy as np
+from django.db.models import BigIntegerField, F, IntegerField, Value
+from django.db.models.functions import Cast, Coalesce, Round
+
+from apps.products.models import Category, Product
+from .rollups import unit_cost
+
+CHUNK_SIZE = 20000
+
+# Stay well clear of 2**63 so a column can be summed without overflowing
+INT64_HEADROOM = 2 ** 62
+
+
+def cents(expression):
+    """SQL expression for a money column as integer cents (NULL -> 0)"""
+    if isinstance(expression, str):
+        expression = F(expression)
+    return Cast(Round(Coalesce(expression, Value(0)) * 100), BigIntegerField())
+
+
+def from_cents(value):
+    return Decimal(int(value)).scaleb(-2)
+
+
+def load_columns(queryset, fields, labels=(), chunk_size=CHUNK_SIZE):
+    """
+    Read `fields` from the queryset into one array per field
+    Fields named in `labels` are text; they come back as integer codes plus a
+    list mapping each code to its original value.
+    """
+    encoders = {fields.index(field): {} for field in labels}
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    chunks = []
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        if encoders:
+            chunk = [_encode(row, encoders) for row in chunk]
+        chunks.append(np.array(chunk, dtype=np.int64).reshape(-1, len(fields)))
+
+    data = np.concatenate(chunks) if chunks else np.empty((0, len(fields)), dtype=np.int64)
+    columns = {field: data[:, i] for i, field in enumerate(fields)}
+    names = {fields[i]: list(encoder) for i, encoder in encoders.items()}
+    return columns, names
+
+
+def _encode(row, encoders):
+    row = list(row)
+    for i, encoder in encoders.items():
+        row[i] = encoder.setdefault(row[i], len(encoder))
+    return row
+
+
+def exact(values):
+    """The column as-is if its sum fits in int64, otherwise as Python ints"""
+    if len(values) and int(np.abs(values).max()) * len(values) >= INT64_HEADROOM:
+        return values.astype(object)
+    return values
+
+
+def total(values):
+    return int(exact(values).sum()) if len(values) else 0
+
+
+def group_by(keys, *columns):
+    """
+    Sum each column per distinct key
+    Returns (unique keys, row counts, [sums per column]), ordered by key.
+    """
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    if not len(keys):
+        return keys, keys.copy(), [column[:0] for column in columns]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    sums = [np.add.reduceat(exact(column[order]), starts) for column in columns]
+    return keys[starts], counts, sums
+
+
+def top_n(values, n):
+    """Indices of the n largest values (all of them if n is None), largest first"""
+    if n is None or n >= len(values):
+        return np.argsort(-values, kind='stable')
+    candidates = np.argpartition(-values, n)[:n]
+    return candidates[np.argsort(-values[candidates], kind='stable')]
+
+
+def margins(profit, revenue):
+    """Profit as a percentage of revenue, 0 where there was no revenue"""
+    profit = np.asarray(profit, dtype=np.float64)
+    revenue = np.asarray(revenue, dtype=np.float64)
+    return np.divide(profit * 100, revenue, out=np.zeros_like(profit), where=revenue != 0)
+
+
+def inventory_valuation(products=None):
+    """Stock value, stock status counts and a per-category breakdown"""
+    if products is None:
+        products = Product.objects.filter(is_active=True)
+    columns, _ = load_columns(
+        products.annotate(
+            category_key=Coalesce('category_id', Value(0), output_field=IntegerField()),
+            cost_cents=cents('cost_price'),
+            price_cents=cents('selling_price'),
+        ),
+        ['category_key', 'current_stock', 'reorder_level', 'cost_cents', 'price_cents'],
+    )
+    stock = columns['current_stock']
+    reorder = columns['reorder_level']
+    stock_value = stock * columns['cost_cents']
+    selling_value = stock * columns['price_cents']
+
+    categories, counts, (category_stock, category_value) = group_by(
+        columns['category_key'], stock, stock_value
+    )
+    names = dict(Category.objects.filter(id__in=categories.tolist()).values_list('id', 'name'))
+    breakdown = [
+        {
+            'category__name': names.get(int(category)),
+            'product_count': int(count),
+            'total_stock': int(units),
+            'total_value': from_cents(value),
+        }
+        for category, count, units, value in zip(categories, counts, category_stock, category_value)
+    ]
+    breakdown.sort(key=lambda row: row['total_value'], reverse=True)
+
+    total_value = from_cents(total(stock_value))
+    total_selling_value = from_cents(total(selling_value))
+    return {
+        'total_products': len(stock),
+        'total_value': total_value,
+        'total_selling_value': total_selling_value,
+        'potential_profit': total_selling_value - total_value,
+        'in_stock': int(np.count_nonzero(stock > reorder)),
+        'low_stock': int(np.count_nonzero((stock > 0) & (stock <= reorder))),
+        'out_of_stock': int(np.count_nonzero(stock == 0)),
+        'category_breakdown': breakdown,
+    }
+
+
+def top_customers(sales, n=10):
+    """Biggest spenders among named customers, by name and phone"""
+    columns, labels = load_columns(
+        sales.exclude(customer_name='').annotate(total_cents=cents('total_amount')),
+        ['customer_name', 'customer_phone', 'total_cents'],
+        labels=['customer_name', 'customer_phone'],
+    )
+    phones = labels['customer_phone']
+    keys = columns['customer_name'] * max(len(phones), 1) + columns['customer_phone']
+    customers, visits, (spent,) = group_by(keys, columns['total_cents'])
+
+    names = labels['customer_name']
+    rows = []
+    for i in top_n(spent, n):
+        name, phone = divmod(int(customers[i]), max(len(phones), 1))
+        rows.append({
+            'customer_name': names[name],
+            'customer_phone': phones[phone],
+            'total_spent': from_cents(spent[i]),
+            'visit_count': int(visits[i]),
+        })
+    return rows
+
+
+def product_profit(items, n=10):
+    """
+    Most profitable products among the SaleItems, in the shape of
+    profit.profit_by_product()
+    """
+    columns, _ = load_columns(
+        items.annotate(
+            revenue_cents=cents('subtotal'),
+            unit_cost_cents=cents(unit_cost()),
+        ),
+        ['product_id', 'quantity', 'revenue_cents', 'unit_cost_cents'],
+    )
+    cost = columns['unit_cost_cents'] * columns['quantity']
+    products, _, (quantity, revenue, cost) = group_by(
+        columns['product_id'], columns['quantity'], columns['revenue_cents'], cost
+    )
+    profit = revenue - cost
+    margin = margins(profit, revenue)
+
+    best = top_n(profit, n)
+    names = dict(Product.objects.filter(id__in=products[best].tolist()).values_list('id', 'name'))
+    return [
+        (names.get(int(products[i])), {
+            'quantity': int(quantity[i]),
+            'revenue': from_cents(revenue[i]),
+            'cost': from_cents(cost[i]),
+            'profit': from_cents(profit[i]),
+            'margin': float(margin[i]),
+        })
+        for i in best
+    ]
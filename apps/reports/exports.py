@@ -0,0 +1,87 @@
+"""
+Streaming exports
+Rows are read in keyset-paginated chunks and written out as they arrive, so
+memory stays flat and the first bytes go out before the whole result has
+been read, however much history is exported.
+"""
+import csv
+
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from apps.sales.models import Sale, SaleItem
+
+SALES_CSV_HEADER = [
+    'Sale Number', 'Date', 'Customer', 'Phone',
+    'Payment Method', 'Total Amount', 'Items', 'Staff'
+]
+
+
+class Echo:
+    """File-like object whose write() just returns the line, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def keyset_chunks(queryset, chunk_size=2000):
+    """
+    Yield lists of rows newest first, ordered by (created_at, id)
+    Each chunk starts strictly after the last row of the previous one, so
+    every query is an index range scan rather than an ever-growing OFFSET.
+    The queryset must be a values() queryset including created_at and id.
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    after = None
+    while True:
+        page = queryset
+        if after is not None:
+            created_at, pk = after
+            # The redundant created_at bound is what lets the planner range-scan
+            # the created_at index instead of sorting the OR's matches
+            page = page.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk),
+                created_at__lte=created_at,
+            )
+        rows = list(page[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        after = rows[-1]['created_at'], rows[-1]['id']
+
+
+def sales_csv_rows(sales, chunk_size=2000):
+    """
+    CSV rows for the sales, staff fetched with each chunk
+    Item counts are grouped per chunk over its ids: a Count('items') on the
+    chunk query itself would group every remaining sale before the LIMIT.
+    """
+    methods = dict(Sale.PAYMENT_METHODS)
+    rows = sales.values(
+        'id', 'sale_number', 'created_at', 'customer_name', 'customer_phone',
+        'payment_method', 'total_amount', 'created_by__username',
+    )
+
+    yield SALES_CSV_HEADER
+    for chunk in keyset_chunks(rows, chunk_size):
+        item_counts = dict(
+            SaleItem.objects.filter(sale_id__in=[row['id'] for row in chunk])
+            .values('sale_id').annotate(count=Count('id')).values_list('sale_id', 'count')
+        )
+        for row in chunk:
+            yield [
+                row['sale_number'],
+                timezone.localtime(row['created_at']).strftime('%Y-%m-%d %H:%M'),
+                row['customer_name'] or 'Walk-in',
+                row['customer_phone'] or '-',
+                methods.get(row['payment_method'], row['payment_method']),
+                row['total_amount'],
+                item_counts.get(row['id'], 0),
+                row['created_by__username'] or '-',
+            ]
+
+
+def stream_csv(rows):
+    """Encode an iterable of rows as CSV lines, one at a time"""
+    writer = csv.writer(Echo())
+    return (writer.writerow(row) for row in rows)
@@ -0,0 +1,247 @@
+"""
+Background report rendering
+
+A request calls enqueue(), which returns an existing job for the same report
+and data or creates one and hands it to the render_report Celery task. The
+task renders the file to media storage, recording progress on the job as it
+goes; the browser polls the job and downloads the file when it's done.
+"""
+import csv
+import hashlib
+import io
+import json
+import logging
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from apps.inventory.models import Counter
+from apps.products.catalog import CHANGES, REBUILDS
+from apps.products.models import Product
+from apps.sales.models import Sale
+from config.dates import created_between, parse_date
+from .exports import sales_csv_rows
+from .models import ReportJob
+from .summary import inventory_summary
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------
+# Requesting reports
+# ----------------------------------------------------------------------
+
+def _sales_range(params):
+    return parse_date(params.get('start_date')), parse_date(params.get('end_date'))
+
+
+def data_version(kind, params):
+    """Something that changes whenever the data behind a report changes"""
+    if kind == 'inventory_pdf':
+        # The catalog counters move on every product save, stock movement
+        # and category change
+        return sorted(Counter.objects.filter(
+            name__in=[CHANGES, REBUILDS]
+        ).values_list('name', 'value'))
+    if kind == 'sales_csv':
+        start, end = _sales_range(params)
+        return Sale.objects.filter(**created_between(start, end)).aggregate(
+            count=Count('id'), last=Max('id'),
+        )
+    raise ValueError(f'Unknown report kind: {kind}')
+
+
+def fingerprint(kind, params):
+    payload = json.dumps([kind, params, data_version(kind, params)], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def enqueue(kind, params=None, user=None):
+    """
+    Return a job for the report, reusing the user's pending, running or
+    finished job for identical parameters and unchanged data
+    """
+    params = params or {}
+    key = fingerprint(kind, params)
+    # Only the user's own jobs: they can't open anyone else's (visible_to)
+    mine = ReportJob.objects.filter(fingerprint=key, requested_by=user)
+    expire_stale(mine)
+    job = mine.exclude(status='FAILED').first()
+    if job is not None:
+        return job
+
+    from .tasks import render_report
+
+    with transaction.atomic():
+        job = ReportJob.objects.create(kind=kind, params=params, fingerprint=key, requested_by=user)
+        transaction.on_commit(lambda: _dispatch(render_report, job))
+    return job
+
+
+def visible_to(user):
+    """Jobs the user may follow and download: their own, or every job for staff"""
+    if user.is_staff:
+        return ReportJob.objects.all()
+    return ReportJob.objects.filter(requested_by=user)
+
+
+def expire_stale(queryset):
+    """
+    Fail jobs that have been pending or running longer than REPORT_JOB_TIMEOUT,
+    so requests stop waiting on a job whose worker died or never got it
+    Returns: number of jobs failed
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(minutes=settings.REPORT_JOB_TIMEOUT)
+    return queryset.filter(
+        Q(status='PENDING', created_at__lt=cutoff) | Q(status='RUNNING', started_at__lt=cutoff)
+    ).update(status='FAILED', error='Report timed out; request it again', finished_at=now)
+
+
+def _dispatch(task, job):
+    try:
+        task.delay(job.id)
+    except Exception as e:
+        logger.exception('Could not queue report job %s', job.id)
+        ReportJob.objects.filter(id=job.id, status='PENDING').update(
+            status='FAILED', error=f'Could not queue report: {e}', finished_at=timezone.now()
+        )
+
+
+# ----------------------------------------------------------------------
+# Rendering (runs in the Celery worker)
+# ----------------------------------------------------------------------
+
+class Progress:
+    """Writes job progress at most once per few percent"""
+
+    def __init__(self, job, step=5):
+        self.job = job
+        self.step = step
+        self.reported = 0
+
+    def __call__(self, percent):
+        percent = max(0, min(99, int(percent)))
+        if percent >= self.reported + self.step:
+            ReportJob.objects.filter(id=self.job.id).update(progress=percent)
+            self.reported = percent
+
+
+def run(job_id):
+    """Render a pending job. Safe to call twice: only one caller claims it."""
+    claimed = ReportJob.objects.filter(id=job_id, status='PENDING').update(
+        status='RUNNING', started_at=timezone.now()
+    )
+    if not claimed:
+        return None
+
+    job = ReportJob.objects.get(id=job_id)
+    try:
+        filename, handle = RENDERERS[job.kind](job, Progress(job))
+        with handle:
+            job.file.save(filename, File(handle), save=False)
+    except Exception as e:
+        logger.exception('Report job %s failed', job.id)
+        job.status = 'FAILED'
+        job.error = str(e)
+    else:
+        job.status = 'DONE'
+        job.progress = 100
+    job.finished_at = timezone.now()
+    job.save(update_fields=['file', 'status', 'error', 'progress', 'finished_at'])
+    return job
+
+
+def render_inventory_pdf(job, progress):
+    """The full active catalog; no 50 row cap now that it's off the request path"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import LongTable, Paragraph, SimpleDocTemplate, Spacer, TableStyle
+
+    styles = getSampleStyleSheet()
+    today = timezone.localdate()
+    totals = inventory_summary()
+    products = Product.objects.filter(is_active=True).order_by('name').values_list(
+        'name', 'sku', 'category__name', 'current_stock', 'cost_price',
+    )
+    count = totals['active_products'] or 1
+
+    data = [['Product', 'SKU', 'Category', 'Stock', 'Value']]
+    for i, (name, sku, category, stock, cost) in enumerate(products.iterator(chunk_size=2000), 1):
+        data.append([name[:30], sku, category or '-', str(stock), f"KES {stock * cost:,.2f}"])
+        if i % 500 == 0:
+            progress(i / count * 40)
+
+    table = LongTable(data, colWidths=[3*inch, 1*inch, 1.5*inch, 0.8*inch, 1.2*inch], repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ]))
+
+    handle = tempfile.TemporaryFile()
+    doc = SimpleDocTemplate(handle, pagesize=A4)
+
+    def on_build(kind, value):
+        if kind == 'SIZE_EST':
+            on_build.size = value or 1
+        elif kind == 'PROGRESS':
+            progress(40 + value / getattr(on_build, 'size', 1) * 60)
+    doc.setProgressCallBack(on_build)
+
+    doc.build([
+        Paragraph(f"Inventory Report - {today.strftime('%B %d, %Y')}", styles['Title']),
+        Spacer(1, 20),
+        Paragraph(f"<b>Total Inventory Value:</b> KES {totals['inventory_value']:,.2f}", styles['Normal']),
+        Spacer(1, 20),
+        table,
+    ])
+    handle.seek(0)
+    return f'inventory_report_{today}.pdf', handle
+
+
+def render_sales_csv(job, progress):
+    start, end = _sales_range(job.params)
+    sales = Sale.objects.filter(**created_between(start, end))
+    count = sales.count() or 1
+
+    handle = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(handle, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    for i, row in enumerate(sales_csv_rows(sales)):
+        writer.writerow(row)
+        if i and i % 2000 == 0:
+            progress(i / count * 100)
+    text.flush()
+    text.detach()
+    handle.seek(0)
+    return f'sales_report_{timezone.localdate()}.csv', handle
+
+
+RENDERERS = {
+    'inventory_pdf': render_inventory_pdf,
+    'sales_csv': render_sales_csv,
+}
+
+
+def purge(older_than):
+    """Delete jobs created before older_than, with their files"""
+    removed = 0
+    for job in ReportJob.objects.filter(created_at__lt=older_than).iterator():
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        removed += 1
+    return removed
@@ -0,0 +1,191 @@
+"""
+Benchmark the columnar analytics layer against the old ORM-object loops
+
+Generates sales with the requested number of line items inside a transaction
+that is rolled back at the end, so the database is left untouched. Each report
+is computed three ways (model instances in a Python loop, a SQL GROUP BY and
+NumPy) and the NumPy totals are checked against the Decimal loop to the cent.
+
+Usage: python manage.py bench_analytics --lines 1000000 --products 5000
+"""
+import random
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+
+from apps.products.models import Product
+from apps.sales.models import Sale, SaleItem
+from apps.reports import analytics
+
+MONEY = DecimalField(max_digits=16, decimal_places=2)
+CUSTOMERS = ['Wanjiku', 'Otieno', 'Kamau', 'Achieng', 'Mwangi', 'Njeri', 'Kiptoo', 'Auma']
+
+
+def legacy_product_profit(items):
+    """The original profit report loop over SaleItem instances"""
+    totals = defaultdict(lambda: {'quantity': 0, 'revenue': 0, 'cost': 0})
+    for item in items.select_related('product'):
+        row = totals[item.product.name]
+        row['quantity'] += item.quantity
+        row['revenue'] += item.subtotal
+        row['cost'] += item.unit_cost * item.quantity
+    return {name: row['revenue'] - row['cost'] for name, row in totals.items()}
+
+
+def sql_product_profit(items):
+    rows = items.values('product__name').annotate(
+        revenue=Sum('subtotal'),
+        cost=Sum(F('unit_cost') * F('quantity'), output_field=MONEY),
+    )
+    return {row['product__name']: row['revenue'] - row['cost'] for row in rows}
+
+
+def numpy_product_profit(items):
+    return {name: row['profit'] for name, row in analytics.product_profit(items, n=None)}
+
+
+def legacy_top_customers(sales):
+    totals = defaultdict(Decimal)
+    for sale in sales.exclude(customer_name=''):
+        totals[(sale.customer_name, sale.customer_phone)] += sale.total_amount
+    return dict(totals)
+
+
+def sql_top_customers(sales):
+    rows = sales.exclude(customer_name='').values('customer_name', 'customer_phone').annotate(
+        total_spent=Sum('total_amount'), visit_count=Count('id'),
+    )
+    return {(row['customer_name'], row['customer_phone']): row['total_spent'] for row in rows}
+
+
+def numpy_top_customers(sales):
+    return {
+        (row['customer_name'], row['customer_phone']): row['total_spent']
+        for row in analytics.top_customers(sales, n=None)
+    }
+
+
+REPORTS = [
+    ('product profit', 'items', [
+        ('orm loop', legacy_product_profit),
+        ('sql', sql_product_profit),
+        ('numpy', numpy_product_profit),
+    ]),
+    ('top customers', 'sales', [
+        ('orm loop', legacy_top_customers),
+        ('sql', sql_top_customers),
+        ('numpy', numpy_top_customers),
+    ]),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare report aggregation over ORM objects, SQL and NumPy on generated sales'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=1000000, help='Sale line items to generate')
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--lines-per-sale', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-legacy', action='store_true', help="Don't time the ORM object loops")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        with transaction.atomic():
+            sales, items = self._populate(options, rng)
+            scopes = {'sales': sales, 'items': items}
+
+            self.stdout.write(f'{"report":>14} {"engine":>9} {"seconds":>8}')
+            for report, scope, engines in REPORTS:
+                results = {}
+                for engine, compute in engines:
+                    if engine == 'orm loop' and options['skip_legacy']:
+                        continue
+                    started = time.perf_counter()
+                    results[engine] = compute(scopes[scope])
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f'{report:>14} {engine:>9} {elapsed:>8.2f}')
+
+                expected = results.get('orm loop')
+                if expected is None:
+                    continue
+                if results['numpy'] != expected:
+                    transaction.set_rollback(True)
+                    raise CommandError(f'{report}: numpy totals differ from the ORM loop')
+                drift = max(
+                    (abs(value - expected.get(key, 0)) for key, value in results['sql'].items()),
+                    default=0,
+                )
+                if drift:
+                    # SQLite sums decimals as floats
+                    self.stdout.write(self.style.WARNING(f'{report}: sql totals drift by up to {drift}'))
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('NumPy totals match the ORM loop to the cent'))
+
+    def _populate(self, options, rng):
+        started = time.perf_counter()
+        batch_size = options['batch_size']
+        stamp = int(time.time())
+
+        products = [
+            Product(
+                name=f'Bench product {i}',
+                sku=f'BENCH-A-{stamp}-{i:06d}',
+                cost_price=Decimal(rng.randint(100, 50000)) / 100,
+                selling_price=Decimal(rng.randint(100, 80000)) / 100,
+                current_stock=rng.randint(0, 500),
+                is_active=False,
+            )
+            for i in range(options['products'])
+        ]
+        products = Product.objects.bulk_create(products, batch_size=batch_size)
+
+        sale_count = -(-options['lines'] // options['lines_per_sale'])
+        sales = []
+        for i in range(sale_count):
+            # A third of sales are anonymous walk-ins
+            customer = rng.randrange(-options['customers'] // 2, options['customers'])
+            sales.append(Sale(
+                sale_number=f'BENCH-{stamp}-{i:08d}',
+                customer_name=f'{CUSTOMERS[customer % len(CUSTOMERS)]} {customer}' if customer >= 0 else '',
+                customer_phone=f'0712{customer:06d}' if customer >= 0 else '',
+            ))
+        sales = Sale.objects.bulk_create(sales, batch_size=batch_size)
+
+        sale_totals = defaultdict(Decimal)
+        batch = []
+        for line in range(options['lines']):
+            sale = sales[line // options['lines_per_sale']]
+            product = rng.choice(products)
+            quantity = rng.randint(1, 5)
+            subtotal = product.selling_price * quantity
+            sale_totals[sale] += subtotal
+            batch.append(SaleItem(
+                sale=sale, product=product, quantity=quantity,
+                unit_price=product.selling_price, unit_cost=product.cost_price,
+                subtotal=subtotal,
+            ))
+            if len(batch) >= batch_size:
+                SaleItem.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            SaleItem.objects.bulk_create(batch)
+
+        for sale, amount in sale_totals.items():
+            sale.total_amount = amount
+        Sale.objects.bulk_update(sales, ['total_amount'], batch_size=batch_size)
+
+        self.stderr.write(
+            f"Inserted {options['lines']} lines across {sale_count} sales "
+            f'in {time.perf_counter() - started:.1f}s'
+        )
+        bench_sales = Sale.objects.filter(sale_number__startswith=f'BENCH-{stamp}-')
+        return bench_sales, SaleItem.objects.filter(sale__in=bench_sales)
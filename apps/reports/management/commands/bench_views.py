@@ -0,0 +1,147 @@
+"""
+Benchmark the hot views end to end and guard against regressions
+
+Builds a throwaway test database, fills it with the synthetic generator
+(populate_sample_data --scale) and requests each view through the test
+client. Results are compared with a JSON baseline; the command fails if a
+view got slower, heavier or chattier than the baseline allows.
+
+Usage:
+    python manage.py bench_views --update          # record a new baseline
+    python manage.py bench_views --threshold 0.3   # compare against it
+"""
+import platform
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from apps.products.catalog import catalog
+from apps.products.models import Product
+from apps.products.sample_data import Plan, generate
+from apps.reports.rollups import rebuild
+from config import benchmarks
+from config.caching import LOW_STOCK, PRODUCTS, SALES, STOCK, invalidate, local_cache
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'views.json'
+
+# Runs are only comparable when these match
+COMPARABLE = ('scale', 'seed', 'days', 'requests', 'vendor')
+
+
+class Command(BaseCommand):
+    help = 'Measure latency, queries and memory of the hot views against a JSON baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--views', nargs='+', choices=[b.name for b in benchmarks.BENCHMARKS],
+                            help='Only benchmark these views')
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per view')
+        parser.add_argument('--warmup', type=int, default=5, help='Discarded requests per view')
+        parser.add_argument('--scale', type=float, default=0.2, help='Dataset size (see populate_sample_data)')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument('--update', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed growth in p95 latency and peak memory (0.25 = 25%%)')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help='Ignore p95 changes smaller than this')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the test database and its data')
+
+    def handle(self, *args, **options):
+        selected = [
+            benchmark for benchmark in benchmarks.BENCHMARKS
+            if not options['views'] or benchmark.name in options['views']
+        ]
+        meta = {
+            'scale': options['scale'],
+            'seed': options['seed'],
+            'days': options['days'],
+            'requests': options['requests'],
+            'vendor': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        }
+        baseline = self._baseline(options['baseline'], meta) if not options['update'] else None
+
+        # As under the test runner: no debug toolbar or query logging in the timings
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, keepdb=options['keepdb'], serialize=False)
+        try:
+            results = self._run(selected, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.stdout.write(
+            f'{"view":>18} {"status":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+            f'{"queries":>7} {"peak KiB":>9}'
+        )
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:>18} {row['status']:>6} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+                f"{row['p99_ms']:>8.2f} {row['queries']:>7} {row['peak_kib']:>9.1f}"
+            )
+
+        if options['update']:
+            path = Path(options['baseline'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if path.exists():
+                saved = benchmarks.load(path)
+                if all(saved['meta'].get(key) == meta[key] for key in COMPARABLE):
+                    # Keep entries for views that weren't benchmarked this time
+                    results = {**saved['views'], **results}
+            benchmarks.save(path, meta, results)
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {path}'))
+            return
+        if baseline is None:
+            return
+
+        problems = benchmarks.compare(baseline, results, options['threshold'], options['min_delta_ms'])
+        if problems:
+            raise CommandError('Performance regressions:\n  ' + '\n  '.join(problems))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def _baseline(self, path, meta):
+        if not Path(path).exists():
+            self.stdout.write(self.style.WARNING(f'No baseline at {path}; run with --update to record one'))
+            return None
+        saved = benchmarks.load(path)
+        for key in COMPARABLE:
+            if saved['meta'].get(key) != meta[key]:
+                raise CommandError(
+                    f"Baseline was recorded with {key}={saved['meta'].get(key)}, "
+                    f'this run uses {meta[key]}; results are not comparable'
+                )
+        return saved['views']
+
+    def _run(self, selected, options):
+        user, _ = User.objects.get_or_create(
+            username='bench', defaults={'is_staff': True, 'is_superuser': True}
+        )
+        plan = Plan(options['scale'], options['seed'], options['days'], 2000, user.id)
+        if not Product.objects.filter(sku__startswith=plan.prefix).exists():
+            self.stderr.write(f'Generating {plan.product_count} products and {plan.sale_count} sales...')
+            generate(plan)
+            rebuild(plan.start, plan.end)
+
+        # Nothing cached from another database may leak into the numbers
+        local_cache().clear()
+        invalidate(PRODUCTS, SALES, STOCK, LOW_STOCK)
+        catalog.synced_at = None
+
+        client = Client()
+        client.force_login(user)
+        context = benchmarks.context_for(options['seed'])
+        results = {}
+        for benchmark in selected:
+            self.stderr.write(f'Benchmarking {benchmark.name}...')
+            results[benchmark.name] = benchmarks.measure(
+                benchmark, client, context, options['requests'], options['warmup']
+            )
+        return results
@@ -0,0 +1,88 @@
+"""
+Summarise the request profiling log per URL name
+
+Reads PROFILING_LOG_FILE and its rotated backups (see config.profiling) and
+prints latency percentiles with the average database, template and cache
+figures behind them.
+
+Usage: python manage.py profile_summary --since 2025-06-01T08:00 --sort p99
+"""
+import statistics
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from config.benchmarks import percentile
+from config.profiling import read_log
+
+COLUMNS = ['requests', 'p50', 'p95', 'p99', 'db_ms', 'queries', 'template_ms', 'cache_hit_rate']
+
+
+def summarise(records):
+    """{view: {requests, p50, p95, p99, db_ms, queries, template_ms, cache_hit_rate}}"""
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record.get('view') or record.get('path'), []).append(record)
+
+    summary = {}
+    for view, rows in grouped.items():
+        wall = sorted(row['wall_ms'] for row in rows)
+        hits = sum(row.get('cache_hits', 0) for row in rows)
+        lookups = hits + sum(row.get('cache_misses', 0) for row in rows)
+        summary[view] = {
+            'requests': len(rows),
+            'p50': statistics.median(wall),
+            'p95': percentile(wall, 0.95),
+            'p99': percentile(wall, 0.99),
+            'db_ms': statistics.fmean(row['db_ms'] for row in rows),
+            'queries': statistics.fmean(row['queries'] for row in rows),
+            'template_ms': statistics.fmean(row.get('template_ms', 0) for row in rows),
+            'cache_hit_rate': hits / lookups if lookups else None,
+        }
+    return summary
+
+
+class Command(BaseCommand):
+    help = 'Latency percentiles and time breakdown per URL name from the profiling log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=settings.PROFILING_LOG_FILE)
+        parser.add_argument('--since', help='Only requests at or after this ISO time')
+        parser.add_argument('--sort', choices=COLUMNS, default='p95')
+        parser.add_argument('--limit', type=int, default=30)
+
+    def handle(self, *args, **options):
+        since = self._parse(options['since'])
+        records = [
+            record for record in read_log(options['log'])
+            if since is None or datetime.fromisoformat(record['ts']) >= since
+        ]
+        if not records:
+            self.stdout.write(f"No profiled requests in {options['log']}")
+            return
+
+        summary = summarise(records)
+        rows = sorted(summary.items(), key=lambda item: item[1][options['sort']] or 0, reverse=True)
+        self.stdout.write(
+            f'{"view":<36} {"reqs":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+            f'{"db ms":>7} {"queries":>7} {"tmpl ms":>7} {"cache":>6}'
+        )
+        for view, row in rows[:options['limit']]:
+            hit_rate = f"{row['cache_hit_rate']:.0%}" if row['cache_hit_rate'] is not None else '-'
+            self.stdout.write(
+                f"{view[:36]:<36} {row['requests']:>6} {row['p50']:>8.1f} {row['p95']:>8.1f} "
+                f"{row['p99']:>8.1f} {row['db_ms']:>7.1f} {row['queries']:>7.1f} "
+                f"{row['template_ms']:>7.1f} {hit_rate:>6}"
+            )
+        self.stdout.write(f'{len(records)} requests across {len(summary)} views')
+
+    def _parse(self, value):
+        if not value:
+            return None
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'Invalid --since: {value}')
+        return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.9 on 2026-10-17 01:16
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill(apps, schema_editor):
+    """Roll up the sales recorded before the rollups existed"""
+    Sale = apps.get_model('sales', 'Sale')
+    SaleItem = apps.get_model('sales', 'SaleItem')
+    DailySalesRollup = apps.get_model('reports', 'DailySalesRollup')
+    DailyCategoryRollup = apps.get_model('reports', 'DailyCategoryRollup')
+
+    sales = Sale.objects.annotate(day=TruncDate('created_at')).values('day', 'payment_method').annotate(
+        count=Count('id'), total=Sum('total_amount'),
+    ).order_by()
+    DailySalesRollup.objects.bulk_create([
+        DailySalesRollup(
+            day=row['day'], payment_method=row['payment_method'],
+            sale_count=row['count'], total_amount=row['total'],
+        )
+        for row in sales
+    ], batch_size=1000)
+
+    categories = SaleItem.objects.annotate(day=TruncDate('sale__created_at')).values(
+        'day', 'product__category_id',
+    ).annotate(units=Sum('quantity'), total=Sum('subtotal')).order_by()
+    DailyCategoryRollup.objects.bulk_create([
+        DailyCategoryRollup(
+            day=row['day'], category_id=row['product__category_id'] or 0,
+            quantity=row['units'], revenue=row['total'],
+        )
+        for row in categories
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('sales', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCategoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('category_id', models.IntegerField(default=0)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'category_id', 'shard'), name='reports_category_rollup_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_method', models.CharField(max_length=10)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('sale_count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'payment_method', 'shard'), name='reports_sales_rollup_unique')],
+            },
+        ),
+        # Dropping the tables undoes it
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
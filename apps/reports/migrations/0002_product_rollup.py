@@ -0,0 +1,57 @@
+# Generated by Django 5.2.9 on 2026-10-17 01:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill(apps, schema_editor):
+    """Roll up the lines sold before the product rollup existed"""
+    SaleItem = apps.get_model('sales', 'SaleItem')
+    DailyProductRollup = apps.get_model('reports', 'DailyProductRollup')
+
+    money = models.DecimalField(max_digits=14, decimal_places=2)
+    products = SaleItem.objects.annotate(day=TruncDate('sale__created_at')).values(
+        'day', 'product_id',
+    ).annotate(
+        units=Sum('quantity'),
+        total=Sum('subtotal'),
+        total_cost=Sum(Coalesce('unit_cost', 'product__cost_price') * F('quantity'), output_field=money),
+    ).order_by()
+    DailyProductRollup.objects.bulk_create([
+        DailyProductRollup(
+            day=row['day'], product_id=row['product_id'],
+            quantity=row['units'], revenue=row['total'], cost=row['total_cost'] or 0,
+        )
+        for row in products
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_index'),
+        ('reports', '0001_sales_rollups'),
+        ('sales', '0002_sale_item_unit_cost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'product', 'shard'), name='reports_product_rollup_unique')],
+            },
+        ),
+        # Dropping the table undoes it
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
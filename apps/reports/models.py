@@ -1,3 +1,105 @@
 from django.db import models
+from django.contrib.auth.models import User
 
-# Create your models here.
+
+class DailySalesRollup(models.Model):
+    """
+    Sales totals per local day and payment method, kept current by checkout
+    Each day/method is spread over a few shard rows so concurrent tills don't
+    queue on one row lock; readers sum the shards.
+    """
+    day = models.DateField()
+    payment_method = models.CharField(max_length=10)
+    shard = models.PositiveSmallIntegerField(default=0)
+    sale_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'payment_method', 'shard'],
+                name='reports_sales_rollup_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.payment_method}: {self.sale_count} sales, KES {self.total_amount}"
+
+
+class DailyCategoryRollup(models.Model):
+    """Units and revenue per local day and product category (0 = uncategorized)"""
+    day = models.DateField()
+    category_id = models.IntegerField(default=0)
+    shard = models.PositiveSmallIntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'category_id', 'shard'],
+                name='reports_category_rollup_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} category {self.category_id}: {self.quantity} units"
+
+
+class DailyProductRollup(models.Model):
+    """Units, revenue and cost per local day and product"""
+    day = models.DateField()
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE, related_name='+')
+    shard = models.PositiveSmallIntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'product', 'shard'],
+                name='reports_product_rollup_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} product {self.product_id}: {self.quantity} units"
+
+
+class ReportJob(models.Model):
+    """A report rendered in the background to a downloadable file"""
+    KINDS = [
+        ('inventory_pdf', 'Inventory Report (PDF)'),
+        ('sales_csv', 'Sales Export (CSV)'),
+    ]
+    STATUSES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KINDS)
+    params = models.JSONField(default=dict, blank=True)
+    # Hash of kind, params and the data version; a user's identical requests share a job
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default='PENDING')
+    progress = models.PositiveSmallIntegerField(default=0)
+    file = models.FileField(upload_to='reports/%Y/%m/', blank=True)
+    error = models.TextField(blank=True)
+
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.id} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('DONE', 'FAILED')
@@ -0,0 +1,84 @@
+"""
+Profit aggregation
+Totals and per-product figures are summed from the daily product rollups, so
+they read at most one row per product per day in the range; detail rows are
+fetched a page at a time. Nothing here loads more than one page of SaleItems
+into Python. Cost is the unit cost captured at sale time, so history isn't
+repriced when a product's cost changes.
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce
+
+from apps.sales.models import SaleItem
+from .models import DailyProductRollup
+from config.dates import created_between
+from .rollups import sales_by_product, unit_cost, with_product_names
+
+MONEY = DecimalField(max_digits=16, decimal_places=2)
+ZERO = Decimal('0.00')
+
+
+def margin(profit, revenue):
+    return profit / revenue * 100 if revenue else 0
+
+
+def profit_items(start, end):
+    """SaleItems sold on local days start..end, annotated with line cost and profit"""
+    return SaleItem.objects.filter(
+        **created_between(start, end, field='sale__created_at')
+    ).annotate(
+        revenue=F('subtotal'),
+        cost=ExpressionWrapper(unit_cost() * F('quantity'), output_field=MONEY),
+    ).annotate(
+        profit=ExpressionWrapper(F('revenue') - F('cost'), output_field=MONEY),
+    )
+
+
+def profit_totals(start, end):
+    """Total revenue, cost, profit and margin over local days start..end"""
+    totals = DailyProductRollup.objects.filter(day__gte=start, day__lte=end).aggregate(
+        total_revenue=Coalesce(Sum('revenue'), ZERO, output_field=MONEY),
+        total_cost=Coalesce(Sum('cost'), ZERO, output_field=MONEY),
+    )
+    totals['total_profit'] = totals['total_revenue'] - totals['total_cost']
+    totals['profit_margin'] = margin(totals['total_profit'], totals['total_revenue'])
+    return totals
+
+
+def profit_by_product(start, end, limit=10):
+    """Most profitable products as (name, {quantity, revenue, cost, profit, margin})"""
+    rows = with_product_names(sales_by_product(start, end, order_by='-total_profit')[:limit])
+    return [
+        (row['product__name'], {
+            'quantity': row['total_quantity'],
+            'revenue': row['total_revenue'],
+            'cost': row['total_cost'],
+            'profit': row['total_profit'],
+            'margin': margin(row['total_profit'], row['total_revenue']),
+        })
+        for row in rows
+    ]
+
+
+def profit_rows(items):
+    """Detail rows, newest first; slice or paginate before iterating"""
+    return items.order_by('-sale__created_at', '-id').values(
+        'id', 'product__name', 'quantity', 'revenue', 'cost', 'profit',
+    )
+
+
+def with_margin(rows):
+    """Shape a page of profit_rows() for the template"""
+    return [
+        {
+            'product': row['product__name'],
+            'quantity': row['quantity'],
+            'revenue': row['revenue'],
+            'cost': row['cost'],
+            'profit': row['profit'],
+            'margin': margin(row['profit'], row['revenue']),
+        }
+        for row in rows
+    ]
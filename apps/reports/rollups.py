@@ -0,0 +1,250 @@
+"""
+Daily sales rollups
+Checkout adds each sale to the rollup rows inside its own transaction, so the
+rollups always agree with the committed Sale/SaleItem rows:
+  DailySalesRollup     day x payment method: sale count and takings
+  DailyCategoryRollup  day x category: units and revenue
+  DailyProductRollup   day x product: units, revenue and cost
+Days are local (TIME_ZONE) calendar days, so a report over a year reads at
+most 365 rows per key. rebuild() recomputes a range from the raw rows for
+backfills, or after sales are edited or deleted outside checkout.
+"""
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from apps.products.models import Product
+from config.dates import day_bounds
+from apps.sales.models import Sale, SaleItem
+from .models import DailyCategoryRollup, DailyProductRollup, DailySalesRollup
+
+
+def unit_cost():
+    """
+    SaleItem unit cost at sale time; rows sold before it was recorded and not
+    yet backfilled (backfill_sale_item_costs) use the product's cost price
+    """
+    return Coalesce('unit_cost', 'product__cost_price')
+
+
+def shard_count():
+    return max(1, getattr(settings, 'SALES_ROLLUP_SHARDS', 4))
+
+
+def _supports_upsert():
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 24, 0)
+    return False
+
+
+def add_to_rollup(model, key_fields, rows):
+    """
+    Add amounts to rollup rows, creating the ones that don't exist yet
+    rows maps key tuples (in key_fields order, shard last) to {field: amount}.
+    On PostgreSQL and SQLite this is one INSERT ... ON CONFLICT DO UPDATE for
+    all rows; elsewhere it's an UPDATE (and maybe INSERT) per row.
+    """
+    if not rows:
+        return
+    # A stable order keeps concurrent transactions from deadlocking
+    keys = sorted(rows)
+    amount_fields = list(rows[keys[0]])
+
+    if not _supports_upsert():
+        for key in keys:
+            _add_to_row(model, dict(zip(key_fields, key)), rows[key])
+        return
+
+    fields = [model._meta.get_field(name) for name in [*key_fields, *amount_fields]]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = [connection.ops.quote_name(field.column) for field in fields]
+    conflict = columns[:len(key_fields)]
+    placeholders = '(%s)' % ', '.join(['%s'] * len(fields))
+    updates = ', '.join(
+        f'{column} = {table}.{column} + EXCLUDED.{column}'
+        for column in columns[len(key_fields):]
+    )
+    params = []
+    for key in keys:
+        values = [*key, *(rows[key][name] for name in amount_fields)]
+        params.extend(
+            field.get_db_prep_save(value, connection) for field, value in zip(fields, values)
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({", ".join(columns)}) '
+            f'VALUES {", ".join([placeholders] * len(keys))} '
+            f'ON CONFLICT ({", ".join(conflict)}) DO UPDATE SET {updates}',
+            params
+        )
+
+
+def _add_to_row(model, keys, amounts):
+    updates = {field: F(field) + value for field, value in amounts.items()}
+    if model.objects.filter(**keys).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **amounts)
+    except IntegrityError:
+        # Another till created the row first
+        model.objects.filter(**keys).update(**updates)
+
+
+def record_sale(sale, lines):
+    """
+    Add a sale to the rollups
+    lines is an iterable of (product_id, category_id or None, quantity,
+    subtotal, cost). Call inside the transaction that creates the sale.
+    Costs three statements however many lines the sale has.
+    """
+    day = timezone.localdate(sale.created_at)
+    shard = random.randrange(shard_count())
+
+    add_to_rollup(DailySalesRollup, ('day', 'payment_method', 'shard'), {
+        (day, sale.payment_method, shard): {
+            'sale_count': 1, 'total_amount': sale.total_amount,
+        },
+    })
+
+    categories = defaultdict(lambda: {'quantity': 0, 'revenue': Decimal('0.00')})
+    products = defaultdict(lambda: {
+        'quantity': 0, 'revenue': Decimal('0.00'), 'cost': Decimal('0.00'),
+    })
+    for product_id, category_id, quantity, subtotal, cost in lines:
+        category = categories[(day, category_id or 0, shard)]
+        category['quantity'] += quantity
+        category['revenue'] += subtotal
+        product = products[(day, product_id, shard)]
+        product['quantity'] += quantity
+        product['revenue'] += subtotal
+        product['cost'] += cost
+
+    add_to_rollup(DailyCategoryRollup, ('day', 'category_id', 'shard'), categories)
+    add_to_rollup(DailyProductRollup, ('day', 'product_id', 'shard'), products)
+
+
+def rebuild(start, end):
+    """
+    Recompute the rollups for local days start..end from Sale/SaleItem rows
+    Returns the number of rows written to each table.
+    """
+    lower, upper = day_bounds(start, end)
+    money = DecimalField(max_digits=14, decimal_places=2)
+
+    sales = Sale.objects.filter(
+        created_at__gte=lower, created_at__lt=upper
+    ).annotate(day=TruncDate('created_at')).values('day', 'payment_method').annotate(
+        count=Count('id'), total=Sum('total_amount'),
+    ).order_by()
+    items = SaleItem.objects.filter(
+        sale__created_at__gte=lower, sale__created_at__lt=upper
+    ).annotate(day=TruncDate('sale__created_at'))
+    categories = items.values('day', 'product__category_id').annotate(
+        units=Sum('quantity'), total=Sum('subtotal'),
+    ).order_by()
+    products = items.values('day', 'product_id').annotate(
+        units=Sum('quantity'),
+        total=Sum('subtotal'),
+        total_cost=Sum(unit_cost() * F('quantity'), output_field=money),
+    ).order_by()
+
+    with transaction.atomic():
+        for model in (DailySalesRollup, DailyCategoryRollup, DailyProductRollup):
+            model.objects.filter(day__gte=start, day__lte=end).delete()
+        sales_rows = DailySalesRollup.objects.bulk_create([
+            DailySalesRollup(
+                day=row['day'], payment_method=row['payment_method'],
+                sale_count=row['count'], total_amount=row['total'],
+            )
+            for row in sales
+        ], batch_size=1000)
+        category_rows = DailyCategoryRollup.objects.bulk_create([
+            DailyCategoryRollup(
+                day=row['day'], category_id=row['product__category_id'] or 0,
+                quantity=row['units'], revenue=row['total'],
+            )
+            for row in categories
+        ], batch_size=1000)
+        product_rows = DailyProductRollup.objects.bulk_create([
+            DailyProductRollup(
+                day=row['day'], product_id=row['product_id'],
+                quantity=row['units'], revenue=row['total'], cost=row['total_cost'] or 0,
+            )
+            for row in products
+        ], batch_size=1000)
+    return len(sales_rows), len(category_rows), len(product_rows)
+
+
+# ----------------------------------------------------------------------
+# Range reads
+# ----------------------------------------------------------------------
+
+def _range(model, start, end):
+    return model.objects.filter(day__gte=start, day__lte=end)
+
+
+def sales_totals(start, end):
+    """Sale count and takings over local days start..end"""
+    totals = _range(DailySalesRollup, start, end).aggregate(
+        count=Sum('sale_count'), total=Sum('total_amount'),
+    )
+    return totals['count'] or 0, totals['total'] or Decimal('0.00')
+
+
+def sales_by_day(start, end):
+    """{day: (sale_count, total_amount)} for days with sales"""
+    rows = _range(DailySalesRollup, start, end).values('day').annotate(
+        count=Sum('sale_count'), total=Sum('total_amount')
+    ).order_by('day')
+    return {row['day']: (row['count'], row['total']) for row in rows}
+
+
+def sales_by_payment_method(start, end):
+    """{payment_method: (sale_count, total_amount)}"""
+    rows = _range(DailySalesRollup, start, end).values('payment_method').annotate(
+        count=Sum('sale_count'), total=Sum('total_amount')
+    ).order_by()
+    return {row['payment_method']: (row['count'], row['total']) for row in rows}
+
+
+def sales_by_category(start, end):
+    """[(category_id, quantity, revenue)] best sellers first"""
+    rows = _range(DailyCategoryRollup, start, end).values('category_id').annotate(
+        units=Sum('quantity'), total=Sum('revenue')
+    ).order_by('-total')
+    return [(row['category_id'], row['units'], row['total']) for row in rows]
+
+
+def sales_by_product(start, end, order_by='-total_revenue'):
+    """
+    Per-product totals as dicts with product_id, total_quantity, total_revenue,
+    total_cost and total_profit; slice the result to get the top N
+    """
+    money = DecimalField(max_digits=16, decimal_places=2)
+    return _range(DailyProductRollup, start, end).values('product_id').annotate(
+        total_quantity=Sum('quantity'),
+        total_revenue=Sum('revenue'),
+        total_cost=Sum('cost'),
+    ).annotate(
+        total_profit=ExpressionWrapper(F('total_revenue') - F('total_cost'), output_field=money),
+    ).order_by(order_by, 'product_id')
+
+
+def with_product_names(rows):
+    """Materialise sales_by_product() rows, adding product__name to each"""
+    rows = list(rows)
+    names = dict(Product.objects.filter(
+        id__in=[row['product_id'] for row in rows]
+    ).values_list('id', 'name'))
+    for row in rows:
+        row['product__name'] = names.get(row['product_id'])
+    return rows
@@ -0,0 +1,108 @@
+"""
+Dashboard summary
+Sales figures come from the daily rollups (a handful of rows however many
+sales there are); inventory figures from one aggregate over products. The
+result is cached until a sale, product change or stock movement retires it.
+"""
+from datetime import timedelta
+
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.utils import timezone
+
+from apps.products.models import Category, Product
+from config.caching import PRODUCTS, SALES, STOCK, Namespace
+from . import rollups
+
+reports_cache = Namespace('reports')
+
+PAYMENT_METHODS = ('MPESA', 'CASH', 'CARD')
+
+
+def inventory_summary():
+    """Active product count, low stock count and stock value at cost, in one query"""
+    active = Q(is_active=True)
+    totals = Product.objects.aggregate(
+        active_products=Count('id', filter=active),
+        low_stock_count=Count('id', filter=active & Q(current_stock__lte=F('reorder_level'))),
+        inventory_value=Sum(
+            F('current_stock') * F('cost_price'),
+            filter=active,
+            output_field=DecimalField(max_digits=16, decimal_places=2),
+        ),
+    )
+    totals['inventory_value'] = totals['inventory_value'] or 0
+    return totals
+
+
+def top_products(start, end, limit=10):
+    """Best sellers by revenue, with the product details the dashboard shows"""
+    rows = list(rollups.sales_by_product(start, end)[:limit])
+    products = Product.objects.select_related('category').in_bulk(
+        [row['product_id'] for row in rows]
+    )
+    top = []
+    for row in rows:
+        product = products.get(row['product_id'])
+        if product is None:
+            continue
+        top.append({
+            'product__name': product.name,
+            'product__sku': product.sku,
+            'product__category__name': product.category.name if product.category else None,
+            'product__current_stock': product.current_stock,
+            'product__reorder_level': product.reorder_level,
+            'product__is_low_stock': product.is_low_stock,
+            'total_quantity': row['total_quantity'],
+            'total_revenue': row['total_revenue'],
+        })
+    return top
+
+
+def dashboard_summary(today=None):
+    """Everything the dashboard cards and charts need"""
+    today = today or timezone.localdate()
+    return reports_cache.get_or_set(
+        f'dashboard:{today.isoformat()}',
+        lambda: build_dashboard_summary(today),
+        tags=[SALES, PRODUCTS, STOCK],
+    )
+
+
+def build_dashboard_summary(today):
+    week_start = today - timedelta(days=6)
+    month_start = today - timedelta(days=30)
+
+    daily = rollups.sales_by_day(week_start, today)
+    days = [week_start + timedelta(days=i) for i in range(7)]
+    today_count, today_total = daily.get(today, (0, 0))
+
+    methods = rollups.sales_by_payment_method(month_start, today)
+
+    categories = rollups.sales_by_category(month_start, today)[:5]
+    names = dict(Category.objects.filter(
+        id__in=[category_id for category_id, _, _ in categories]
+    ).values_list('id', 'name'))
+
+    inventory = inventory_summary()
+    return {
+        'stats': {
+            'total_products': inventory['active_products'],
+            'active_products': inventory['active_products'],
+            'low_stock_count': inventory['low_stock_count'],
+            'today_sales': float(today_total),
+            'today_transactions': today_count,
+            'inventory_value': float(inventory['inventory_value']),
+        },
+        'sales_labels': [day.strftime('%a %d') for day in days],
+        'sales_data': [float(daily.get(day, (0, 0))[1]) for day in days],
+        'payment_data': [float(methods.get(method, (0, 0))[1]) for method in PAYMENT_METHODS],
+        'top_products': top_products(month_start, today),
+        'category_sales': [
+            {
+                'product__category__name': names.get(category_id),
+                'total_revenue': revenue,
+                'total_items': quantity,
+            }
+            for category_id, quantity, revenue in categories
+        ],
+    }
@@ -10,7 +10,7 @@ from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 
-from apps.sales.models import Sale, SaleItem
+from . import rollups
 
 
 
@@ -20,33 +20,21 @@ def generate_daily_sales_report():
     Generate and email daily sales report
     Runs at 11 PM every day
     """
-    today = timezone.now().date()
-    sales = Sale.objects.filter(created_at__date=today)
+    today = timezone.localdate()
+    total_transactions, total_sales = rollups.sales_totals(today, today)
     
-    if not sales.exists():
+    if not total_transactions:
         return "No sales today"
     
-    # Calculate statistics
-    total_sales = sales.aggregate(total=Sum('total_amount'))['total'] or 0
-    total_transactions = sales.count()
-    
-    cash_sales = sales.filter(payment_method='CASH').aggregate(
-        total=Sum('total_amount')
-    )['total'] or 0
-    
-    mpesa_sales = sales.filter(payment_method='MPESA').aggregate(
-        total=Sum('total_amount')
-    )['total'] or 0
+    # Calculate statistics (from the daily rollups)
+    by_method = rollups.sales_by_payment_method(today, today)
+    cash_sales = by_method.get('CASH', (0, 0))[1]
+    mpesa_sales = by_method.get('MPESA', (0, 0))[1]
     
     # Top selling products
-    top_products = SaleItem.objects.filter(
-        sale__created_at__date=today
-    ).values(
-        'product__name'
-    ).annotate(
-        total_quantity=Sum('quantity'),
-        total_revenue=Sum('subtotal')
-    ).order_by('-total_revenue')[:5]
+    top_products = rollups.with_product_names(
+        rollups.sales_by_product(today, today)[:5]
+    )
     
     # Generate PDF
     buffer = io.BytesIO()
@@ -160,4 +148,27 @@ def generate_weekly_inventory_report():
         )
         return "Weekly inventory report sent"
     except Exception as e:
-        return f"Error: {str(e)}"
\ No newline at end of file
+        return f"Error: {str(e)}"
+
+
+@shared_task
+def render_report(job_id):
+    """Render a queued ReportJob to media storage"""
+    from . import jobs
+    
+    job = jobs.run(job_id)
+    if job is None:
+        return f"Report job {job_id} already taken"
+    return f"Report job {job_id}: {job.status}"
+
+
+@shared_task
+def purge_report_jobs():
+    """
+    Delete report artifacts older than REPORT_JOB_TTL hours
+    Runs daily at 3 AM
+    """
+    from . import jobs
+    
+    cutoff = timezone.now() - timedelta(hours=settings.REPORT_JOB_TTL)
+    return f"Purged {jobs.purge(cutoff)} report jobs"
@@ -1,3 +1,514 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.inventory.models import StockMovement
+from apps.products.models import Category, Product
+from apps.products.sample_data import Plan, generate
+from apps.sales.models import Sale, SaleItem
+from apps.reports import analytics, jobs, profit, rollups
+from apps.reports.models import DailyCategoryRollup, DailyProductRollup, DailySalesRollup, ReportJob
+from apps.sales.checkout import checkout
+from apps.reports.exports import keyset_chunks, sales_csv_rows
+from apps.reports.management.commands.profile_summary import summarise
+from config import benchmarks
+from config.caching import SALES, STOCK, Namespace, invalidate_on_commit, local_cache
+from config.profiling import ProfilingMiddleware
+from config.dates import created_between, date_range
+
+
+def local(*args):
+    return timezone.make_aware(datetime(*args), timezone.get_current_timezone())
+
+
+class DateRangeTests(TestCase):
+
+    def test_bounds_are_half_open_local_days(self):
+        filters = created_between(date(2025, 3, 1), date(2025, 3, 31))
+        self.assertEqual(filters['created_at__gte'], local(2025, 3, 1))
+        self.assertEqual(filters['created_at__lt'], local(2025, 4, 1))
+
+        sales = {}
+        for name, created_at in [
+            ('before', local(2025, 2, 28, 23, 59, 59)),
+            ('first', local(2025, 3, 1)),
+            ('last', local(2025, 3, 31, 23, 59, 59)),
+            ('after', local(2025, 4, 1)),
+        ]:
+            sale = Sale.objects.create(payment_method='CASH')
+            Sale.objects.filter(id=sale.id).update(created_at=created_at)
+            sales[sale.id] = name
+
+        matched = Sale.objects.filter(**filters).values_list('id', flat=True)
+        self.assertEqual(sorted(sales[i] for i in matched), ['first', 'last'])
+
+    def test_open_ended_and_malformed_dates(self):
+        request = RequestFactory().get('/', {'start_date': '2025-13-01', 'end_date': '2025-03-31'})
+        start, end = date_range(request)
+        self.assertIsNone(start)
+        self.assertEqual(end, date(2025, 3, 31))
+        self.assertEqual(list(created_between(start, end)), ['created_at__lt'])
+
+        start, end = date_range(RequestFactory().get('/'), default_days=7)
+        self.assertEqual(end, timezone.localdate())
+        self.assertEqual((end - start).days, 7)
+
+
+class DateRangeIndexTests(TestCase):
+    """The created_at bounds must be answerable from an index, not a table scan"""
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables are cheaper to scan; make the planner show its hand
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f'Expected {index_name} in plan:\n{plan}')
+
+    def index_name(self, model, fields):
+        for index in model._meta.indexes:
+            if index.fields == fields:
+                return index.name
+        self.fail(f'No index on {fields} for {model.__name__}')
+
+    def test_sales_range_uses_created_at_index(self):
+        filters = created_between(date(2025, 1, 1), date(2025, 1, 31))
+        self.assertUsesIndex(
+            Sale.objects.filter(**filters).order_by('-created_at'),
+            self.index_name(Sale, ['-created_at']),
+        )
+
+    def test_movement_range_uses_created_at_index(self):
+        filters = created_between(date(2025, 1, 1), date(2025, 1, 7))
+        self.assertUsesIndex(
+            StockMovement.objects.filter(**filters).order_by('-created_at'),
+            self.index_name(StockMovement, ['-created_at']),
+        )
+
+    def test_product_movement_range_uses_composite_index(self):
+        product = Product.objects.create(
+            name='Milk', sku='MLK-1', cost_price=50, selling_price=65,
+        )
+        filters = created_between(date(2025, 1, 1), date(2025, 1, 7))
+        self.assertUsesIndex(
+            StockMovement.objects.filter(product=product, **filters),
+            self.index_name(StockMovement, ['product', '-created_at']),
+        )
+
+    def test_export_chunks_walk_created_at_index(self):
+        product = Product.objects.create(name='Milk', sku='MLK-1', cost_price=50, selling_price=65)
+        for day in (1, 1, 2, 3, 3):
+            sale = Sale.objects.create(payment_method='CASH')
+            Sale.objects.filter(id=sale.id).update(created_at=local(2025, 1, day))
+            SaleItem.objects.bulk_create(
+                SaleItem(sale=sale, product=product, quantity=1, unit_price=65, subtotal=65) for _ in range(day)
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(sales_csv_rows(Sale.objects.all(), chunk_size=2))
+        self.assertEqual([row[6] for row in rows[1:]], [3, 3, 2, 1, 1])
+
+        # A later chunk is a range read off the index, not a grouped sort of every remaining sale
+        later_chunk = [q['sql'] for q in queries.captured_queries if 'FROM "sales_sale" ' in q['sql']][1]
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {later_chunk}' if connection.vendor == 'sqlite' else f'EXPLAIN {later_chunk}')
+            plan = '\n'.join(str(row) for row in cursor.fetchall())
+        self.assertIn(self.index_name(Sale, ['-created_at']), plan)
+        self.assertNotIn('GROUP BY', later_chunk)
+        if connection.vendor == 'sqlite':
+            # Ties on created_at may be sorted, but not everything left
+            self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan)
+
+
+class RollupTests(TestCase):
+    """Rollups kept by checkout match a rebuild from the raw rows"""
+
+    def setUp(self):
+        user = User.objects.create_user('till')
+        drinks = Category.objects.create(name='Drinks')
+        products = [
+            Product.objects.create(name='Milk', sku='MLK-1', category=drinks, cost_price=50, selling_price=65,
+                                   current_stock=100),
+            Product.objects.create(name='Juice', sku='JCE-1', category=drinks, cost_price='33.33',
+                                   selling_price='49.99', current_stock=100),
+            Product.objects.create(name='Bread', sku='BRD-1', cost_price=40, selling_price=55, current_stock=100),
+        ]
+        for i in range(9):
+            checkout(user, [
+                {'product_id': products[i % 3].id, 'quantity': i % 4 + 1},
+                {'product_id': products[(i + 1) % 3].id, 'quantity': 2},
+            ], payment_method=['CASH', 'MPESA', 'CARD'][i % 3])
+
+    def rollups(self):
+        return [
+            sorted(model.objects.values_list(*keys).annotate(*[Sum(f) for f in fields]).order_by())
+            for model, keys, fields in [
+                (DailySalesRollup, ('day', 'payment_method'), ('sale_count', 'total_amount')),
+                (DailyCategoryRollup, ('day', 'category_id'), ('quantity', 'revenue')),
+                (DailyProductRollup, ('day', 'product_id'), ('quantity', 'revenue', 'cost')),
+            ]
+        ]
+
+    def test_recorded_rollups_match_rebuild(self):
+        recorded = self.rollups()
+        self.assertEqual(len(recorded[2]), 3)
+        call_command('rebuild_sales_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), recorded)
+
+    def test_migration_backfills_existing_sales(self):
+        recorded = self.rollups()
+        DailySalesRollup.objects.all().delete()
+        DailyCategoryRollup.objects.all().delete()
+        DailyProductRollup.objects.all().delete()
+        for name in ('0001_sales_rollups', '0002_product_rollup'):
+            importlib.import_module(f'apps.reports.migrations.{name}').backfill(django_apps, None)
+        self.assertEqual(self.rollups(), recorded)
+
+    def test_profit_totals_match_detail_rows(self):
+        day = timezone.localdate()
+        totals = profit.profit_totals(day, day)
+        rows = list(profit.profit_rows(profit.profit_items(day, day)))
+        self.assertEqual(len(rows), 18)
+        for field in ('revenue', 'cost', 'profit'):
+            self.assertEqual(totals[f'total_{field}'], sum(row[field] for row in rows))
+
+
+class UnitCostTests(TestCase):
+    """Lines sold before unit costs were captured are costed at the product's cost price"""
+
+    def test_missing_unit_cost_falls_back_to_cost_price(self):
+        product = Product.objects.create(name='Milk', sku='MLK-1', cost_price=50, selling_price=65)
+        sale = Sale.objects.create(payment_method='CASH')
+        Sale.objects.filter(id=sale.id).update(created_at=local(2025, 1, 10, 12))
+        SaleItem.objects.create(sale=sale, product=product, quantity=2, unit_price=65, unit_cost=40)
+        legacy = SaleItem.objects.create(sale=sale, product=product, quantity=3, unit_price=65)
+        SaleItem.objects.filter(id=legacy.id).update(unit_cost=None)
+
+        day = date(2025, 1, 10)
+        rollups.rebuild(day, day)
+        totals = profit.profit_totals(day, day)
+        self.assertEqual(totals['total_cost'], 2 * 40 + 3 * 50)
+        self.assertEqual(sorted(item.cost for item in profit.profit_items(day, day)), [80, 150])
+        [(name, row)] = analytics.product_profit(SaleItem.objects.all())
+        self.assertEqual(row['cost'], 230)
+
+
+class ProfitTotalsTests(TestCase):
+    """SQL profit figures agree with the per-item Python loop the report used to run"""
+
+    def setUp(self):
+        user = User.objects.create_user('till')
+        self.products = [
+            Product.objects.create(name='Juice', sku='JCE-1', cost_price='33.33', selling_price='49.99',
+                                   current_stock=100),
+            Product.objects.create(name='Soap', sku='SOP-1', cost_price='0.07', selling_price='0.10',
+                                   current_stock=100),
+            Product.objects.create(name='Rice', sku='RCE-1', cost_price='129.95', selling_price='149.50',
+                                   current_stock=100),
+            Product.objects.create(name='Salt', sku='SLT-1', cost_price='19.99', selling_price='18.00',
+                                   current_stock=100),
+        ]
+        for i in range(7):
+            checkout(user, [
+                {'product_id': self.products[i % 4].id, 'quantity': i + 1},
+                {'product_id': self.products[(i + 2) % 4].id, 'quantity': 3},
+            ])
+
+    def legacy(self):
+        """The report's old loop: float sums over every item and its product's cost price"""
+        total_revenue = total_cost = 0
+        by_product = {}
+        for item in SaleItem.objects.select_related('product'):
+            revenue = float(item.subtotal)
+            cost = float(item.product.cost_price * item.quantity)
+            total_revenue += revenue
+            total_cost += cost
+            row = by_product.setdefault(item.product.name, {'revenue': 0, 'cost': 0, 'quantity': 0})
+            row['revenue'] += revenue
+            row['cost'] += cost
+            row['quantity'] += item.quantity
+        return total_revenue, total_cost, by_product
+
+    def assertMoney(self, value, expected):
+        self.assertEqual(value, Decimal(f'{expected:.2f}'))
+
+    def test_totals_match_python_loop(self):
+        day = timezone.localdate()
+        total_revenue, total_cost, by_product = self.legacy()
+        totals = profit.profit_totals(day, day)
+        self.assertMoney(totals['total_revenue'], total_revenue)
+        self.assertMoney(totals['total_cost'], total_cost)
+        self.assertMoney(totals['total_profit'], total_revenue - total_cost)
+        self.assertAlmostEqual(
+            float(totals['profit_margin']), (total_revenue - total_cost) / total_revenue * 100, places=6,
+        )
+
+        top = profit.profit_by_product(day, day)
+        # Salt sells at a loss, so it ranks last
+        self.assertEqual([name for name, _ in top][-1], 'Salt')
+        for name, row in top:
+            with self.subTest(product=name):
+                expected = by_product[name]
+                self.assertEqual(row['quantity'], expected['quantity'])
+                self.assertMoney(row['revenue'], expected['revenue'])
+                self.assertMoney(row['cost'], expected['cost'])
+                self.assertMoney(row['profit'], expected['revenue'] - expected['cost'])
+
+    def test_later_cost_changes_do_not_reprice_history(self):
+        day = timezone.localdate()
+        before = profit.profit_totals(day, day)
+        Product.objects.filter(id=self.products[0].id).update(cost_price='40.00')
+        self.assertEqual(profit.profit_totals(day, day), before)
+
+
+class AnalyticsTests(TestCase):
+    """The vectorised figures agree with values worked out by hand"""
+
+    def setUp(self):
+        drinks = Category.objects.create(name='Drinks')
+        self.juice, self.milk, self.bread, _ = Product.objects.bulk_create([
+            # At its reorder level counts as low stock
+            Product(name='Juice', sku='JCE-1', category=drinks, cost_price='33.33', selling_price='49.99',
+                    current_stock=10, reorder_level=10),
+            Product(name='Milk', sku='MLK-1', category=drinks, cost_price=50, selling_price=65,
+                    current_stock=0, reorder_level=5),
+            Product(name='Bread', sku='BRD-1', cost_price=40, selling_price=55,
+                    current_stock=20, reorder_level=10),
+            Product(name='Old Bread', sku='OLD-1', cost_price=10, selling_price=15,
+                    current_stock=100, is_active=False),
+        ])
+
+    def test_inventory_valuation(self):
+        valuation = analytics.inventory_valuation()
+        self.assertEqual(valuation['category_breakdown'], [
+            {'category__name': None, 'product_count': 1, 'total_stock': 20, 'total_value': Decimal('800.00')},
+            {'category__name': 'Drinks', 'product_count': 2, 'total_stock': 10, 'total_value': Decimal('333.30')},
+        ])
+        del valuation['category_breakdown']
+        self.assertEqual(valuation, {
+            'total_products': 3,
+            'total_value': Decimal('1133.30'),          # 10 x 33.33 + 20 x 40
+            'total_selling_value': Decimal('1599.90'),  # 10 x 49.99 + 20 x 55
+            'potential_profit': Decimal('466.60'),
+            'in_stock': 1,
+            'low_stock': 1,
+            'out_of_stock': 1,
+        })
+
+    def test_profit_and_customers(self):
+        for customer, phone, lines in [
+            ('Ann', '0711', [(self.juice, 3, '49.99', '33.33')]),
+            ('Ann', '0711', [(self.bread, 2, '55.00', '40.00'), (self.juice, 1, '49.99', '30.00')]),
+            ('Ann', '0722', [(self.milk, 1, '65.00', '50.00')]),
+            ('', '', [(self.bread, 1, '55.00', '40.00')]),
+        ]:
+            sale = Sale.objects.create(payment_method='CASH', customer_name=customer, customer_phone=phone)
+            for product, quantity, price, cost in lines:
+                SaleItem.objects.create(sale=sale, product=product, quantity=quantity,
+                                        unit_price=Decimal(price), unit_cost=Decimal(cost))
+            sale.total_amount = sum(item.subtotal for item in sale.items.all())
+            sale.save()
+
+        self.assertEqual(
+            [(row['customer_name'], row['customer_phone'], row['total_spent'], row['visit_count'])
+             for row in analytics.top_customers(Sale.objects.all(), n=2)],
+            [('Ann', '0711', Decimal('309.96'), 2), ('Ann', '0722', Decimal('65.00'), 1)],
+        )
+
+        top = dict(analytics.product_profit(SaleItem.objects.all()))
+        self.assertEqual(list(top), ['Juice', 'Bread', 'Milk'])
+        # 4 x 49.99 - (3 x 33.33 + 30.00)
+        juice = top['Juice']
+        self.assertEqual(
+            (juice['quantity'], juice['revenue'], juice['cost'], juice['profit']),
+            (4, Decimal('199.96'), Decimal('129.99'), Decimal('69.97')),
+        )
+        self.assertAlmostEqual(juice['margin'], 69.97 / 199.96 * 100)
+        self.assertEqual((top['Bread']['profit'], top['Milk']['profit']), (Decimal('45.00'), Decimal('15.00')))
+
+    def test_empty_catalog(self):
+        Product.objects.all().delete()
+        valuation = analytics.inventory_valuation()
+        self.assertEqual(valuation['category_breakdown'], [])
+        self.assertEqual(valuation['total_products'], 0)
+        self.assertEqual(valuation['total_value'], 0)
+        self.assertEqual(valuation['potential_profit'], 0)
+        self.assertEqual((valuation['in_stock'], valuation['low_stock'], valuation['out_of_stock']), (0, 0, 0))
+        self.assertEqual(analytics.top_customers(Sale.objects.all()), [])
+        self.assertEqual(analytics.product_profit(SaleItem.objects.all()), [])
+
+
+@mock.patch('apps.reports.tasks.render_report.delay')
+class ReportJobTests(TestCase):
+
+    def test_stale_jobs_are_not_reused(self, delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = jobs.enqueue('inventory_pdf')
+        ReportJob.objects.filter(id=first.id).update(status='RUNNING', started_at=timezone.now())
+        self.assertEqual(jobs.enqueue('inventory_pdf').id, first.id)
+
+        # The worker died mid-render
+        long_ago = timezone.now() - timedelta(minutes=settings.REPORT_JOB_TIMEOUT + 1)
+        ReportJob.objects.filter(id=first.id).update(started_at=long_ago)
+        with self.captureOnCommitCallbacks(execute=True):
+            second = jobs.enqueue('inventory_pdf')
+        self.assertNotEqual(second.id, first.id)
+        self.assertEqual(ReportJob.objects.get(id=first.id).status, 'FAILED')
+        self.assertEqual(delay.call_args_list, [mock.call(first.id), mock.call(second.id)])
+
+        # Never picked up by a worker
+        ReportJob.objects.filter(id=second.id).update(created_at=long_ago)
+        self.assertNotIn(jobs.enqueue('inventory_pdf').id, (first.id, second.id))
+
+    def test_only_the_requester_or_staff_can_see_a_job(self, delay):
+        owner, other = User.objects.create_user('owner'), User.objects.create_user('other')
+        staff = User.objects.create_user('manager', is_staff=True)
+        job = jobs.enqueue('inventory_pdf', user=owner)
+        # The same report for someone else is their own job
+        self.assertNotEqual(jobs.enqueue('inventory_pdf', user=other).id, job.id)
+
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            job.file.save('inventory.pdf', ContentFile(b'%PDF'), save=False)
+            job.status = 'DONE'
+            job.save()
+            for user, status in [(owner, 200), (staff, 200), (other, 404)]:
+                self.client.force_login(user)
+                for name in ('report_job', 'report_job_status', 'report_job_download'):
+                    with self.subTest(user=user.username, view=name):
+                        response = self.client.get(reverse(f'reports:{name}', args=[job.id]))
+                        self.assertEqual(response.status_code, status)
+                        if hasattr(response, 'streaming_content'):
+                            response.close()
+
+
+class ViewBenchmarkTests(TestCase):
+    """The bench_views harness and its regression rules"""
+
+    def row(self, **changes):
+        return {'status': 200, 'p50_ms': 8.0, 'p95_ms': 10.0, 'p99_ms': 12.0,
+                'max_ms': 15.0, 'queries': 4, 'peak_kib': 100.0, **changes}
+
+    def test_compare_flags_regressions_only(self):
+        baseline = {'dashboard': self.row()}
+        self.assertEqual(benchmarks.compare(baseline, {'dashboard': self.row(p95_ms=12.4)}), [])
+        # Tiny absolute changes are noise even when large in percent
+        self.assertEqual(
+            benchmarks.compare({'dashboard': self.row(p95_ms=1.0)}, {'dashboard': self.row(p95_ms=2.5)}), []
+        )
+        # Views missing from the baseline are new, not regressions
+        self.assertEqual(benchmarks.compare(baseline, {'stock_list': self.row(queries=50)}), [])
+
+        problems = benchmarks.compare(baseline, {
+            'dashboard': self.row(p95_ms=20.0, queries=5, peak_kib=200.0, status=500),
+        })
+        self.assertEqual(len(problems), 4)
+
+    def test_measure_every_view(self):
+        user = User.objects.create_superuser('bench', password='pw')
+        generate(Plan(scale=0.01, seed=2, days=14, batch_size=100, user_id=user.id))
+        self.client.force_login(user)
+        context = benchmarks.context_for()
+
+        for benchmark in benchmarks.BENCHMARKS:
+            with self.subTest(view=benchmark.name):
+                result = benchmarks.measure(benchmark, self.client, context, requests=3, warmup=1)
+                self.assertEqual(result['status'], 200)
+                self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+                self.assertGreater(result['peak_kib'], 0)
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_TOKEN='')
+class ProfilingTests(TestCase):
+    """Sampled requests log their time breakdown and summarise per view"""
+
+    def view(self, request):
+        list(Product.objects.all())
+        return HttpResponse(Template('{{ n }}').render(Context({'n': 1})))
+
+    def test_records_and_summary(self):
+        middleware = ProfilingMiddleware(self.view)
+        request = RequestFactory().get('/products/', HTTP_X_PROFILE='guess')
+        with self.assertLogs('profiling') as logs:
+            for _ in range(3):
+                middleware(request)
+
+        records = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        self.assertEqual(records[0]['queries'], 1)
+        self.assertGreater(records[0]['template_ms'], 0)
+        # An empty PROFILING_TOKEN never enables cProfile
+        self.assertNotIn('profile', records[0])
+
+        summary = summarise(records)['/products/']
+        self.assertEqual(summary['requests'], 3)
+        self.assertLessEqual(summary['p50'], summary['p99'])
+        self.assertIsNone(summary['cache_hit_rate'])
+
+
+class CachingTests(TestCase):
+    """Tagged entries are retired by committed invalidations only"""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.cache = Namespace('tests')
+        self.computed = 0
+
+    def compute(self):
+        self.computed += 1
+        return self.computed
+
+    def cached(self):
+        return self.cache.get_or_set('total', self.compute, tags=[SALES, STOCK])
+
+    def test_committed_invalidation_drops_entry(self):
+        self.assertEqual(self.cached(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                invalidate_on_commit(SALES)
+                # Readers keep the old value until the write commits
+                self.assertEqual(self.cached(), 1)
+        self.assertEqual(self.cached(), 2)
+        self.assertEqual(self.cached(), 2)
+
+    def test_rolled_back_invalidation_keeps_entry(self):
+        self.assertEqual(self.cached(), 1)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    invalidate_on_commit(SALES)
+                    raise ValueError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.cached(), 1)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'local'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+    })
+    def test_shared_tier_serves_other_workers(self):
+        self.assertEqual(self.cached(), 1)
+        # Another worker: empty local tier, same shared tier
+        local_cache().clear()
+        self.assertEqual(self.cached(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_on_commit(STOCK)
+        self.assertEqual(self.cached(), 2)
@@ -12,5 +12,11 @@ urlpatterns = [
     
     # Exports
     path('export/sales-csv/', views.export_sales_csv, name='export_sales_csv'),
+    path('export/sales-csv/background/', views.export_sales_csv_background, name='export_sales_csv_background'),
     path('export/inventory-pdf/', views.export_inventory_pdf, name='export_inventory_pdf'),
+    
+    # Background report jobs
+    path('jobs/<int:job_id>/', views.report_job, name='report_job'),
+    path('jobs/<int:job_id>/status/', views.report_job_status, name='report_job_status'),
+    path('jobs/<int:job_id>/download/', views.report_job_download, name='report_job_download'),
 ]
\ No newline at end of file
@@ -1,18 +1,27 @@
-from django.shortcuts import render
+from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.paginator import Paginator
 from django.db.models import Sum, Count, F, Q, Avg
 from django.utils import timezone
 from datetime import timedelta, datetime
 import csv
+import os
 
 from apps.products.models import Product, Category
 from apps.sales.models import Sale, SaleItem
 from apps.inventory.models import StockMovement
 from apps.suppliers.models import Supplier
+from . import analytics, jobs, rollups
+from config.dates import created_between, date_range
+from config.query_budget import query_budget
+from .exports import sales_csv_rows, stream_csv
+from .profit import profit_by_product, profit_items, profit_rows, profit_totals, with_margin
 
 
 @login_required
+@query_budget(8)
 def reports_dashboard(request):
     """Reports overview page"""
     
@@ -62,54 +71,34 @@ def reports_dashboard(request):
 
 
 @login_required
+@query_budget(9)
 def sales_report(request):
     """Detailed sales report with filtering"""
     # Get date range from request
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
+    start_date, end_date = date_range(request, default_days=30)
     
-    if not start_date:
-        start_date = (timezone.now() - timedelta(days=30)).date()
-    else:
-        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    sales = Sale.objects.filter(**created_between(start_date, end_date))
     
-    if not end_date:
-        end_date = timezone.now().date()
-    else:
-        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-    
-    # Get sales
-    sales = Sale.objects.filter(
-        created_at__date__gte=start_date,
-        created_at__date__lte=end_date
-    )
-    
-    # Calculate statistics
-    total_sales = sales.aggregate(total=Sum('total_amount'))['total'] or 0
-    total_transactions = sales.count()
+    # Calculate statistics (from the daily rollups)
+    total_transactions, total_sales = rollups.sales_totals(start_date, end_date)
     average_sale = total_sales / total_transactions if total_transactions > 0 else 0
     
     # Payment method breakdown
-    payment_breakdown = sales.values('payment_method').annotate(
-        count=Count('id'),
-        total=Sum('total_amount')
-    )
+    payment_breakdown = [
+        {'payment_method': method, 'count': count, 'total': total}
+        for method, (count, total) in sorted(
+            rollups.sales_by_payment_method(start_date, end_date).items()
+        )
+    ]
     
     # Daily sales
-    daily_sales = sales.extra(
-        select={'date': 'DATE(created_at)'}
-    ).values('date').annotate(
-        total=Sum('total_amount'),
-        count=Count('id')
-    ).order_by('date')
+    daily_sales = [
+        {'date': day, 'total': total, 'count': count}
+        for day, (count, total) in rollups.sales_by_day(start_date, end_date).items()
+    ]
     
     # Top customers
-    top_customers = sales.exclude(
-        customer_name=''
-    ).values('customer_name', 'customer_phone').annotate(
-        total_spent=Sum('total_amount'),
-        visit_count=Count('id')
-    ).order_by('-total_spent')[:10]
+    top_customers = analytics.top_customers(sales)
     
     context = {
         'start_date': start_date,
@@ -126,144 +115,55 @@ def sales_report(request):
 
 
 @login_required
+@query_budget(8)
 def inventory_report(request):
     """Current inventory status report"""
     products = Product.objects.filter(is_active=True).select_related('category')
     
-    # Calculate totals
-    total_products = products.count()
-    total_value = sum(p.stock_value for p in products)
-    total_selling_value = sum(p.current_stock * p.selling_price for p in products)
-    potential_profit = total_selling_value - total_value
-    
-    # Stock status
-    in_stock = products.filter(current_stock__gt=F('reorder_level')).count()
-    low_stock = products.filter(
-        current_stock__gt=0,
-        current_stock__lte=F('reorder_level')
-    ).count()
-    out_of_stock = products.filter(current_stock=0).count()
-    
-    # Category breakdown
-    category_breakdown = products.values(
-        'category__name'
-    ).annotate(
-        product_count=Count('id'),
-        total_stock=Sum('current_stock'),
-        total_value=Sum(F('current_stock') * F('cost_price'))
-    ).order_by('-total_value')
-    
+    # Totals, stock status and category breakdown
     context = {
         'products': products,
-        'total_products': total_products,
-        'total_value': total_value,
-        'total_selling_value': total_selling_value,
-        'potential_profit': potential_profit,
-        'in_stock': in_stock,
-        'low_stock': low_stock,
-        'out_of_stock': out_of_stock,
-        'category_breakdown': category_breakdown,
+        **analytics.inventory_valuation(),
     }
     
     return render(request, 'reports/inventory_report.html', context)
 
 
 @login_required
+@query_budget(10)
 def profit_report(request):
     """Profit analysis report"""
     # Get date range
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    
-    if not start_date:
-        start_date = (timezone.now() - timedelta(days=30)).date()
-    else:
-        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-    
-    if not end_date:
-        end_date = timezone.now().date()
-    else:
-        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-    
-    # Get sales items for profit calculation
-    sale_items = SaleItem.objects.filter(
-        sale__created_at__date__gte=start_date,
-        sale__created_at__date__lte=end_date
-    ).select_related('product', 'sale')
-    
-    # Calculate profit per item
-    profit_data = []
-    total_revenue = 0
-    total_cost = 0
-    
-    for item in sale_items:
-        revenue = float(item.subtotal)
-        cost = float(item.product.cost_price * item.quantity)
-        profit = revenue - cost
-        
-        total_revenue += revenue
-        total_cost += cost
-        
-        profit_data.append({
-            'product': item.product.name,
-            'quantity': item.quantity,
-            'revenue': revenue,
-            'cost': cost,
-            'profit': profit,
-            'margin': (profit / revenue * 100) if revenue > 0 else 0
-        })
+    start_date, end_date = date_range(request, default_days=30)
     
-    total_profit = total_revenue - total_cost
-    profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
+    items = profit_items(start_date, end_date)
     
-    # Top profitable products
-    from collections import defaultdict
-    product_profits = defaultdict(lambda: {'revenue': 0, 'cost': 0, 'profit': 0, 'quantity': 0})
-    
-    for item in sale_items:
-        key = item.product.name
-        product_profits[key]['revenue'] += float(item.subtotal)
-        product_profits[key]['cost'] += float(item.product.cost_price * item.quantity)
-        product_profits[key]['profit'] = product_profits[key]['revenue'] - product_profits[key]['cost']
-        product_profits[key]['quantity'] += item.quantity
-    
-    top_products = sorted(product_profits.items(), key=lambda x: x[1]['profit'], reverse=True)[:10]
+    # Detail rows, one page at a time
+    paginator = Paginator(profit_rows(items), 50)
+    page_obj = paginator.get_page(request.GET.get('page'))
     
     context = {
         'start_date': start_date,
         'end_date': end_date,
-        'total_revenue': total_revenue,
-        'total_cost': total_cost,
-        'total_profit': total_profit,
-        'profit_margin': profit_margin,
-        'profit_data': profit_data[:50],  # Limit to 50 items for display
-        'top_products': top_products,
+        **profit_totals(start_date, end_date),
+        'profit_data': with_margin(page_obj),
+        'page_obj': page_obj,
+        'top_products': profit_by_product(start_date, end_date),
     }
     
     return render(request, 'reports/profit_report.html', context)
 
 
 @login_required
+@query_budget(10)
 def movement_report(request):
     """Stock movement report"""
     # Get date range
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    
-    if not start_date:
-        start_date = (timezone.now() - timedelta(days=7)).date()
-    else:
-        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-    
-    if not end_date:
-        end_date = timezone.now().date()
-    else:
-        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    start_date, end_date = date_range(request, default_days=7)
     
     # Get movements
     movements = StockMovement.objects.filter(
-        created_at__date__gte=start_date,
-        created_at__date__lte=end_date
+        **created_between(start_date, end_date)
     ).select_related('product', 'created_by').order_by('-created_at')
     
     # Statistics
@@ -291,104 +191,61 @@ def movement_report(request):
 
 
 @login_required
+# Reads one query per keyset chunk, so the count grows with the range
+@query_budget(None)
 def export_sales_csv(request):
     """Export sales to CSV"""
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    
-    sales = Sale.objects.all()
-    
-    if start_date:
-        sales = sales.filter(created_at__date__gte=start_date)
-    if end_date:
-        sales = sales.filter(created_at__date__lte=end_date)
-    
-    # Create CSV
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="sales_report_{timezone.now().date()}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow([
-        'Sale Number', 'Date', 'Customer', 'Phone',
-        'Payment Method', 'Total Amount', 'Items', 'Staff'
-    ])
-    
-    for sale in sales:
-        writer.writerow([
-            sale.sale_number,
-            sale.created_at.strftime('%Y-%m-%d %H:%M'),
-            sale.customer_name or 'Walk-in',
-            sale.customer_phone or '-',
-            sale.get_payment_method_display(),
-            sale.total_amount,
-            sale.items.count(),
-            sale.created_by.username if sale.created_by else '-'
-        ])
+    start_date, end_date = date_range(request)
+    sales = Sale.objects.filter(**created_between(start_date, end_date))
     
+    # Stream the CSV as it is read, a chunk of sales at a time
+    response = StreamingHttpResponse(stream_csv(sales_csv_rows(sales)), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="sales_report_{timezone.localdate()}.csv"'
     return response
 
 
+@login_required
+def export_sales_csv_background(request):
+    """Render the sales CSV in the background for very large ranges"""
+    start_date, end_date = date_range(request)
+    job = jobs.enqueue('sales_csv', {
+        'start_date': start_date.isoformat() if start_date else None,
+        'end_date': end_date.isoformat() if end_date else None,
+    }, user=request.user)
+    return redirect('reports:report_job', job_id=job.id)
+
+
 @login_required
 def export_inventory_pdf(request):
-    """Export inventory report to PDF"""
-    from io import BytesIO
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib import colors
-    from reportlab.lib.units import inch
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.styles import getSampleStyleSheet
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="inventory_report_{timezone.now().date()}.pdf"'
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title = Paragraph(f"Inventory Report - {timezone.now().strftime('%B %d, %Y')}", styles['Title'])
-    elements.append(title)
-    elements.append(Spacer(1, 20))
-    
-    # Get products
-    products = Product.objects.filter(is_active=True).select_related('category')
-    
-    # Summary
-    total_value = sum(p.stock_value for p in products)
-    summary = Paragraph(f"<b>Total Inventory Value:</b> KES {total_value:,.2f}", styles['Normal'])
-    elements.append(summary)
-    elements.append(Spacer(1, 20))
-    
-    # Products table
-    data = [['Product', 'SKU', 'Category', 'Stock', 'Value']]
-    
-    for product in products[:50]:  # Limit to 50 products
-        data.append([
-            product.name[:30],
-            product.sku,
-            product.category.name if product.category else '-',
-            str(product.current_stock),
-            f"KES {product.stock_value:,.2f}"
-        ])
-    
-    table = Table(data, colWidths=[3*inch, 1*inch, 1.5*inch, 0.8*inch, 1.2*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 1), (-1, -1), 8),
-    ]))
-    
-    elements.append(table)
-    
-    doc.build(elements)
-    pdf = buffer.getvalue()
-    buffer.close()
-    response.write(pdf)
-    
-    return response
\ No newline at end of file
+    """Queue the inventory PDF; the job page downloads it when it's ready"""
+    job = jobs.enqueue('inventory_pdf', user=request.user)
+    return redirect('reports:report_job', job_id=job.id)
+
+
+@login_required
+def report_job(request, job_id):
+    """Progress page for a background report"""
+    job = get_object_or_404(jobs.visible_to(request.user), id=job_id)
+    return render(request, 'reports/report_job.html', {'job': job})
+
+
+@login_required
+def report_job_status(request, job_id):
+    """Polled by the progress page"""
+    visible = jobs.visible_to(request.user).filter(id=job_id)
+    jobs.expire_stale(visible)
+    job = get_object_or_404(visible)
+    return JsonResponse({
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'download_url': reverse('reports:report_job_download', args=[job.id]) if job.status == 'DONE' else None,
+    })
+
+
+@login_required
+def report_job_download(request, job_id):
+    job = get_object_or_404(jobs.visible_to(request.user), id=job_id, status='DONE')
+    if not job.file:
+        raise Http404('Report file has been removed')
+    return FileResponse(job.file.open('rb'), as_attachment=True, filename=os.path.basename(job.file.name))
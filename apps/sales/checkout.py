@@ -0,0 +1,113 @@
+"""
+Set-based checkout engine for the POS
+Turns a cart into a Sale with a constant number of queries, whatever the
+number of cart lines
+"""
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.db import transaction
+
+from apps.products.models import Product
+from apps.inventory.services import InsufficientStock, apply_stock_changes, lock_products, record_movements
+from apps.reports.rollups import record_sale
+from .models import Sale, SaleItem, sale_numbers
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be turned into a sale"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_cart(items):
+    """
+    Normalise cart lines into an ordered {product_id: quantity} mapping
+    Repeated lines for the same product are merged
+    """
+    cart = OrderedDict()
+    for item_data in items:
+        try:
+            product_id = int(item_data['product_id'])
+            quantity = int(item_data['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise CheckoutError('Invalid cart item')
+        if quantity < 1:
+            raise CheckoutError('Quantity must be at least 1')
+        cart[product_id] = cart.get(product_id, 0) + quantity
+    return cart
+
+
+def checkout(user, items, customer_name='', customer_phone='', payment_method='CASH'):
+    """
+    Create a sale for the given cart lines
+
+    Products are locked and loaded in one query, unknown or inactive products
+    are refused, stock is checked for every line up front and decremented with a single conditional UPDATE, then
+    SaleItems and StockMovements are bulk inserted and the daily sales rollups
+    are bumped. Raises CheckoutError if any line cannot be fulfilled, in which
+    case nothing is written.
+    """
+    cart = parse_cart(items)
+    if not cart:
+        raise CheckoutError('Cart is empty')
+
+    # Allocated before the transaction, so the day's counter row is locked for
+    # the increment alone rather than the whole checkout, which would queue
+    # every till behind it. A checkout that then fails leaves a gap.
+    sale_number = sale_numbers.next()
+
+    with transaction.atomic():
+        products = lock_products(list(cart))
+        if len(products) != len(cart) or not all(product.is_active for product in products.values()):
+            raise CheckoutError('Product not found', status=404)
+        try:
+            changes = apply_stock_changes({pid: -qty for pid, qty in cart.items()}, products=products)
+        except InsufficientStock as e:
+            raise CheckoutError(str(e))
+
+        sale = Sale.objects.create(
+            sale_number=sale_number,
+            customer_name=customer_name,
+            customer_phone=customer_phone,
+            payment_method=payment_method,
+            created_by=user
+        )
+
+        sale_items = []
+        rollup_lines = []
+        total_amount = Decimal('0.00')
+
+        for product_id, quantity in cart.items():
+            product = changes[product_id].product
+            subtotal = quantity * product.selling_price
+            total_amount += subtotal
+            rollup_lines.append((
+                product_id, product.category_id, quantity, subtotal,
+                quantity * product.cost_price,
+            ))
+
+            sale_items.append(SaleItem(
+                sale=sale,
+                product_id=product_id,
+                quantity=quantity,
+                unit_price=product.selling_price,
+                unit_cost=product.cost_price,
+                subtotal=subtotal
+            ))
+
+        SaleItem.objects.bulk_create(sale_items)
+        record_movements(
+            changes, 'OUT',
+            reference=sale.sale_number,
+            notes=f'Sale {sale.sale_number}',
+            user=user
+        )
+
+        sale.total_amount = total_amount
+        sale.save(update_fields=['total_amount'])
+        record_sale(sale, rollup_lines)
+
+    return sale
@@ -0,0 +1,49 @@
+"""
+Fill SaleItem.unit_cost for sales recorded before unit costs were captured
+
+Rows are walked in primary key order, a chunk per transaction, so the command
+can be stopped and rerun at any point. Historical costs weren't kept, so each
+row gets its product's current cost price.
+
+Usage: python manage.py backfill_sale_item_costs --chunk-size 5000
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from apps.products.models import Product
+from apps.sales.models import SaleItem
+
+
+class Command(BaseCommand):
+    help = 'Backfill unit cost on sale items that predate cost snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between chunks to spare a live database')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        cost = Subquery(Product.objects.filter(id=OuterRef('product_id')).values('cost_price')[:1])
+        last_id = 0
+        total = 0
+
+        while True:
+            ids = list(SaleItem.objects.filter(
+                id__gt=last_id, unit_cost__isnull=True
+            ).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                total += SaleItem.objects.filter(
+                    id__in=ids, unit_cost__isnull=True
+                ).update(unit_cost=cost)
+            last_id = ids[-1]
+            self.stdout.write(f'Backfilled {total} sale items (up to id {last_id})')
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {total} sale items backfilled'))
@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 # from decimal import Decimal
 
+from apps.inventory.counters import NumberAllocator
+
 # Create your models here.
 class Sale(models.Model):
     PAYMENT_METHODS = [
@@ -36,23 +38,21 @@ class Sale(models.Model):
     def save(self, *args, **kwargs):
         if not self.sale_number:
             # Generate sale number: SALE-YYYYMMDD-XXXX
-            from django.utils import timezone
-            date_str = timezone.now().strftime('%Y%m%d')
-            last_sale = Sale.objects.filter(sale_number__startswith=f'SALE-{date_str}').order_by('-sale_number').first()
-            if last_sale:
-                last_num = int(last_sale.sale_number.split('-')[-1])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-            self.sale_number = f'SALE-{date_str}-{new_num:04d}'
+            self.sale_number = sale_numbers.next()
         super().save(*args, **kwargs)
 
 
+sale_numbers = NumberAllocator('SALE', model=Sale, field='sale_number')
+
+
 class SaleItem(models.Model):
     sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey('products.Product', on_delete=models.PROTECT)
     quantity = models.IntegerField(validators=[MinValueValidator(1)])
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Product cost price at the time of sale; null only for rows sold before
+    # this was recorded and not yet backfilled (backfill_sale_item_costs)
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
     
     class Meta:
@@ -63,4 +63,6 @@ class SaleItem(models.Model):
     
     def save(self, *args, **kwargs):
         self.subtotal = self.quantity * self.unit_price
+        if self.unit_cost is None and self._state.adding:
+            self.unit_cost = self.product.cost_price
         super().save(*args, **kwargs)
\ No newline at end of file
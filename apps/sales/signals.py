@@ -0,0 +1,14 @@
+"""
+Retire cached sales figures when sales change
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from config.caching import SALES, invalidate_on_commit
+from .models import Sale
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def sale_changed(sender, instance, **kwargs):
+    invalidate_on_commit(SALES)
@@ -1,3 +1,255 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.inventory.models import StockMovement
+from apps.payments.models import Transaction
+from apps.products.models import Product
+from apps.products.sample_data import Plan, generate
+from apps.reports.rollups import rebuild
+from config import benchmarks
+from config.query_budget import QueryBudgetExceeded, QueryBudgetTestMixin, record_queries
+from . import views
+from .checkout import checkout
+from .models import Sale, SaleItem
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    """Hot views stay within their declared query budgets on cold caches"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('clerk', password='pw')
+        plan = Plan(scale=0.01, seed=4, days=14, batch_size=100, user_id=cls.user.id)
+        generate(plan)
+        rebuild(plan.start, plan.end)
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.client.force_login(self.user)
+
+    def test_views_within_budget(self):
+        product = Product.objects.filter(is_active=True).first()
+        sale = Sale.objects.first()
+        pages = [
+            ('home', [], {}),
+            ('sales:sales_list', [], {}),
+            ('sales:new_sale', [], {}),
+            ('sales:sale_detail', [sale.id], {}),
+            ('sales:search_product', [], {'q': product.name.split()[0]}),
+            ('sales:scan_product', [], {'code': product.sku}),
+            ('inventory:stock_list', [], {}),
+            ('inventory:low_stock', [], {}),
+            ('products:product_list', [], {}),
+            ('products:product_detail', [product.id], {}),
+            ('reports:dashboard', [], {}),
+            ('reports:sales_report', [], benchmarks.last_days()),
+            ('reports:inventory_report', [], {}),
+            ('reports:profit_report', [], benchmarks.last_days()),
+            ('reports:movement_report', [], {}),
+        ]
+        for name, args, data in pages:
+            with self.subTest(view=name):
+                # The middleware raises QueryBudgetExceeded on overrun
+                response = self.client.get(reverse(name, args=args), data)
+                self.assertEqual(response.status_code, 200)
+
+    def test_overrun_raises_with_repeated_sql(self):
+        with mock.patch.object(views.sales_list, 'query_budget', 2):
+            with self.assertRaises(QueryBudgetExceeded) as raised:
+                self.client.get(reverse('sales:sales_list'))
+        self.assertIn('sales_list ran', str(raised.exception))
+
+        with self.assertRaises(AssertionError) as failed:
+            with self.assertMaxQueries(3):
+                for sale in Sale.objects.all()[:5]:
+                    sale.items.count()
+        self.assertIn('5x SELECT COUNT(*)', str(failed.exception))
+
+    def test_in_lists_group_together(self):
+        ids = list(Product.objects.values_list('id', flat=True)[:4])
+        with record_queries() as recorder:
+            list(Product.objects.filter(id__in=ids[:2]))
+            list(Product.objects.filter(id__in=ids))
+        self.assertEqual(len(recorder.duplicates()), 1)
+
+
+class CheckoutTests(TestCase):
+    """A cart becomes a sale in a fixed number of queries, or nothing is written"""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('till', password='pw')
+        self.client.force_login(self.user)
+        self.products = Product.objects.bulk_create(
+            Product(name=f'Item {i}', sku=f'ITM-{i}', cost_price=40, selling_price=55, current_stock=10)
+            for i in range(12)
+        )
+
+    def post(self, items):
+        return self.client.post(
+            reverse('sales:new_sale'), json.dumps({'items': items, 'payment_method': 'CASH'}),
+            content_type='application/json',
+        )
+
+    def assertNothingWritten(self):
+        self.assertFalse(Sale.objects.exists())
+        self.assertFalse(SaleItem.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertEqual(set(Product.objects.values_list('current_stock', flat=True)), {10})
+
+    def test_queries_do_not_grow_with_cart_lines(self):
+        # The day's first sale also creates its number counter
+        checkout(self.user, [{'product_id': self.products[0].id, 'quantity': 1}])
+        counts = []
+        for products in (self.products[:1], self.products[1:]):
+            with CaptureQueriesContext(connection) as queries:
+                checkout(self.user, [{'product_id': p.id, 'quantity': 2} for p in products])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(SaleItem.objects.count(), 13)
+
+    def test_oversell_writes_nothing(self):
+        response = self.post([
+            {'product_id': self.products[0].id, 'quantity': 3},
+            {'product_id': self.products[1].id, 'quantity': 11},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Item 1', response.json()['error'])
+        self.assertNothingWritten()
+
+    def test_unknown_or_inactive_product_is_404(self):
+        inactive = self.products[2]
+        Product.objects.filter(id=inactive.id).update(is_active=False)
+        for missing in (inactive.id, 999999):
+            response = self.post([
+                {'product_id': self.products[0].id, 'quantity': 1},
+                {'product_id': missing, 'quantity': 1},
+            ])
+            self.assertEqual(response.status_code, 404)
+        self.assertNothingWritten()
+
+    def test_duplicate_lines_are_merged(self):
+        product = self.products[0]
+        response = self.post([
+            {'product_id': product.id, 'quantity': 2},
+            {'product_id': self.products[1].id, 'quantity': 1},
+            {'product_id': str(product.id), 'quantity': '3'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        sale = Sale.objects.get()
+        self.assertEqual(sale.total_amount, 6 * 55)
+        item = sale.items.get(product=product)
+        self.assertEqual((item.quantity, item.subtotal), (5, 5 * 55))
+        self.assertEqual(sale.items.count(), 2)
+        self.assertEqual(StockMovement.objects.get(product=product).quantity, 5)
+        product.refresh_from_db()
+        self.assertEqual(product.current_stock, 5)
+
+
+class ScanProductTests(TestCase):
+    """Exact barcode/SKU scans, singly or in batches"""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_login(User.objects.create_user('till', password='pw'))
+        Product.objects.create(name='Milk', sku='MLK-1', barcode='600100', cost_price=50, selling_price=65, current_stock=4)
+        Product.objects.create(name='Bread', sku='BRD-1', cost_price=40, selling_price=55)
+        Product.objects.create(name='Old Milk', sku='OLD-1', barcode='600999', cost_price=50, selling_price=65,
+                               is_active=False)
+
+    def scan(self, code):
+        return self.client.get(reverse('sales:scan_product'), {'code': code})
+
+    def batch(self, codes):
+        return self.client.post(reverse('sales:scan_product'), json.dumps({'codes': codes}),
+                                content_type='application/json')
+
+    def test_single_scan(self):
+        response = self.scan('600100')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['product'], {
+            'id': Product.objects.get(sku='MLK-1').id, 'name': 'Milk', 'price': '65.00', 'stock': 4,
+        })
+        self.assertEqual(self.scan(' brd-1 ').json()['product']['name'], 'Bread')
+
+        for code in ('600', 'nope', '', '600999'):
+            with self.subTest(code=code):
+                response = self.scan(code)
+                self.assertEqual(response.status_code, 404)
+                self.assertIsNone(response.json()['product'])
+
+    def test_batch_keeps_order_and_misses(self):
+        response = self.batch(['BRD-1', 'missing', '600999', '600100', 'BRD-1'])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['code'] for r in results], ['BRD-1', 'missing', '600999', '600100', 'BRD-1'])
+        self.assertEqual(
+            [r['product'] and r['product']['name'] for r in results],
+            ['Bread', None, None, 'Milk', 'Bread'],
+        )
+
+    @override_settings(SCAN_BATCH_LIMIT=3)
+    def test_bad_batches_are_rejected(self):
+        self.assertEqual(self.batch(['a', 'b', 'c', 'd']).status_code, 400)
+        self.assertEqual(self.batch('600100').status_code, 400)
+        response = self.client.post(reverse('sales:scan_product'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.batch(['a', 'b', 'c']).status_code, 200)
+
+
+class MpesaCallbackTests(QueryBudgetTestMixin, TestCase):
+    """Callbacks settle a PENDING transaction once; redeliveries don't write"""
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('till', password='pw')
+        self.sale = Sale.objects.create(
+            total_amount=100, payment_method='MPESA', created_by=user,
+        )
+        self.payment = Transaction.objects.create(
+            transaction_type='STK_PUSH', amount=100, phone_number='254708374149',
+            checkout_request_id='ws_CO_1', sale=self.sale,
+        )
+        # Safaricom posts without a CSRF token
+        self.client = Client(enforce_csrf_checks=True)
+
+    def post(self, body):
+        return self.client.post(reverse('payments:mpesa_callback'), body, content_type='application/json')
+
+    def test_first_delivery_settles_and_repeats_are_noops(self):
+        with record_queries() as first:
+            response = self.post(benchmarks.stk_callback('ws_CO_1'))
+        self.assertEqual(response.json()['ResultCode'], 0)
+        self.payment.refresh_from_db()
+        self.sale.refresh_from_db()
+        self.assertEqual(self.payment.status, 'SUCCESS')
+        self.assertEqual(self.payment.mpesa_receipt_number, 'NLJ7RT61SV')
+        self.assertEqual(self.sale.mpesa_transaction_id, 'NLJ7RT61SV')
+
+        with record_queries() as repeat:
+            response = self.post(benchmarks.stk_callback('ws_CO_1'))
+        self.assertEqual(response.json()['ResultCode'], 0)
+        self.assertEqual(repeat.count, 1)
+        self.assertLessEqual(first.count, 5)
+
+    def test_failure_and_unknown_ids(self):
+        failed = {'Body': {'stkCallback': {
+            'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 1032, 'ResultDesc': 'Request cancelled by user',
+        }}}
+        self.assertEqual(self.post(failed).json()['ResultCode'], 0)
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.result_desc), ('FAILED', 'Request cancelled by user'))
+        # A late success can't overturn a settled transaction
+        self.post(benchmarks.stk_callback('ws_CO_1'))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'FAILED')
+
+        self.assertEqual(self.post(benchmarks.stk_callback('ws_CO_missing')).json()['ResultCode'], 1)
@@ -11,6 +11,8 @@ urlpatterns = [
 
     # API endpoints for POS
     path('api/search/', views.search_product, name='search_product'),
+    path('api/scan/', views.scan_product, name='scan_product'),
+    path('api/catalog-version/', views.catalog_version, name='catalog_version'),
     path('api/check-status/<str:checkout_request_id>/', views.check_payment_status, name='check_payment_status'),
     
     # Reports
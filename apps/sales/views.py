@@ -7,10 +7,15 @@ from django.db import transaction
 from django.utils import timezone
 from decimal import Decimal
 import json
-from django.db.models import Q, Sum
+from django.db.models import Count, Q, Sum
 from .models import Sale, SaleItem
+from .checkout import checkout, CheckoutError
 from apps.products.models import Category, Product
+from apps.products.catalog import get_catalog
 from apps.inventory.models import StockMovement
+from apps.reports import rollups
+from config.dates import created_between, date_range
+from config.query_budget import query_budget
 from apps.payments.models import Transaction
 from apps.payments.daraja import DarajaAPI
 from django.conf import settings
@@ -20,115 +25,69 @@ from django.http import HttpResponse
 
 
 @login_required
+@query_budget(8)
 def sales_list(request):
     """Display list of all sales"""
-    sales = Sale.objects.all().select_related('created_by')
+    sales = Sale.objects.all()
     
     # Filter by date range if provided
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    
-    if start_date:
-        sales = sales.filter(created_at__date__gte=start_date)
-    if end_date:
-        sales = sales.filter(created_at__date__lte=end_date)
+    start_date, end_date = date_range(request)
+    sales = sales.filter(**created_between(start_date, end_date))
+    totals = sales.aggregate(total=Sum('total_amount'), count=Count('id'))
     
     context = {
-        'sales': sales,
-        'total_sales': sum(sale.total_amount for sale in sales),
+        'sales': sales.select_related('created_by').annotate(item_count=Count('items')),
+        'total_sales': totals['total'] or 0,
+        'sale_count': totals['count'],
     }
     return render(request, 'sales/sales_list.html', context)
 
 
 @login_required
+@query_budget(25)
 def new_sale(request):
     """Create new sale - POS interface"""
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             
-            with transaction.atomic():
-                # Create sale
-                sale = Sale.objects.create(
-                    customer_name=data.get('customer_name', ''),
-                    customer_phone=data.get('customer_phone', ''),
-                    payment_method=data.get('payment_method', 'CASH'),
-                    created_by=request.user
-                )
-                
-                total_amount = Decimal('0.00')
-                items = data.get('items', [])
-                
-                # Process each item
-                for item_data in items:
-                    product = Product.objects.get(id=item_data['product_id'])
-                    quantity = int(item_data['quantity'])
-                    
-                    # Check stock availability
-                    if product.current_stock < quantity:
-                        return JsonResponse({
-                            'success': False,
-                            'error': f'Insufficient stock for {product.name}'
-                        }, status=400)
-                    
-                    # Create sale item
-                    sale_item = SaleItem.objects.create(
-                        sale=sale,
-                        product=product,
-                        quantity=quantity,
-                        unit_price=product.selling_price
-                    )
-                    
-                    total_amount += sale_item.subtotal
-                    
-                    # Update stock
-                    product.current_stock -= quantity
-                    product.save()
-                    
-                    # Record stock movement
-                    StockMovement.objects.create(
-                        product=product,
-                        movement_type='OUT',
-                        quantity=quantity,
-                        reference=sale.sale_number,
-                        notes=f'Sale {sale.sale_number}',
-                        stock_before=product.current_stock + quantity,
-                        stock_after=product.current_stock,
-                        created_by=request.user
-                    )
-                
-                # Update sale total
-                sale.total_amount = total_amount
-                sale.save()
-                
-                # Handle M-Pesa payment
-                if sale.payment_method == 'MPESA':
-                    return initiate_mpesa_payment(sale)
-                
-                return JsonResponse({
-                    'success': True,
-                    'sale_id': sale.id,
-                    'sale_number': sale.sale_number,
-                    'total_amount': str(sale.total_amount)
-                })
+            sale = checkout(
+                request.user,
+                data.get('items', []),
+                customer_name=data.get('customer_name', ''),
+                customer_phone=data.get('customer_phone', ''),
+                payment_method=data.get('payment_method', 'CASH')
+            )
+            
+            # Handle M-Pesa payment
+            if sale.payment_method == 'MPESA':
+                return initiate_mpesa_payment(sale)
+            
+            return JsonResponse({
+                'success': True,
+                'sale_id': sale.id,
+                'sale_number': sale.sale_number,
+                'total_amount': str(sale.total_amount)
+            })
                 
-        except Product.DoesNotExist:
+        except CheckoutError as e:
             return JsonResponse({
                 'success': False,
-                'error': 'Product not found'
-            }, status=404)
+                'error': str(e)
+            }, status=e.status)
         except Exception as e:
             return JsonResponse({
                 'success': False,
                 'error': str(e)
             }, status=500)
     
-    # GET request - render POS interface
-    products = Product.objects.filter(is_active=True, current_stock__gt=0)
-    categories = Category.objects.filter(products__in=products).distinct()
+    # GET request - render POS interface from the in-memory catalog
+    catalog = get_catalog()
+    products = catalog.in_stock()
     context = {
         'products': products,
-        'categories': categories
+        'categories': catalog.categories(products),
+        'catalog_version': catalog.version,
     }
     return render(request, 'sales/new_sale.html', context)
 
@@ -179,55 +138,58 @@ def initiate_mpesa_payment(sale):
 
 
 @csrf_exempt
+@query_budget(5)
 def mpesa_callback(request):
-    """Handle M-Pesa callback for STK Push"""
+    """
+    Handle M-Pesa callback for STK Push
+    Safaricom can deliver a callback more than once. Only the first moves the
+    transaction out of PENDING, with one conditional UPDATE and the sale's
+    receipt in the same database transaction; redeliveries are acknowledged
+    after a single indexed read.
+    """
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             
             # Extract callback data
             stk_callback = data.get('Body', {}).get('stkCallback', {})
-            merchant_request_id = stk_callback.get('MerchantRequestID')
             checkout_request_id = stk_callback.get('CheckoutRequestID')
             result_code = stk_callback.get('ResultCode')
-            result_desc = stk_callback.get('ResultDesc')
-            
-            # Find transaction
-            mpesa_transaction = Transaction.objects.get(
-                checkout_request_id=checkout_request_id
-            )
+            result_desc = stk_callback.get('ResultDesc') or ''
             
+            mpesa_receipt = ''
             if result_code == 0:  # Success
                 # Extract metadata
                 callback_metadata = stk_callback.get('CallbackMetadata', {})
-                items = callback_metadata.get('Item', [])
-                
-                mpesa_receipt = None
-                for item in items:
+                for item in callback_metadata.get('Item', []):
                     if item.get('Name') == 'MpesaReceiptNumber':
-                        mpesa_receipt = item.get('Value')
+                        mpesa_receipt = str(item.get('Value') or '')
                         break
-                
-                # Update transaction
-                mpesa_transaction.status = 'SUCCESS'
-                mpesa_transaction.mpesa_receipt_number = mpesa_receipt
-                mpesa_transaction.result_desc = result_desc
-                mpesa_transaction.save()
-                
-                # Update sale
-                if mpesa_transaction.sale:
-                    mpesa_transaction.sale.mpesa_transaction_id = mpesa_receipt
-                    mpesa_transaction.sale.save()
-                
-            else:  # Failed
-                mpesa_transaction.status = 'FAILED'
-                mpesa_transaction.result_desc = result_desc
-                mpesa_transaction.save()
             
+            found = Transaction.objects.filter(
+                checkout_request_id=checkout_request_id
+            ).values('status', 'sale_id').first()
+            if found is None:
+                return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Transaction not found'})
+            
+            if found['status'] == 'PENDING':
+                with transaction.atomic():
+                    # The status filter makes concurrent redeliveries race safely
+                    settled = Transaction.objects.filter(
+                        checkout_request_id=checkout_request_id, status='PENDING'
+                    ).update(
+                        status='SUCCESS' if result_code == 0 else 'FAILED',
+                        mpesa_receipt_number=mpesa_receipt,
+                        result_desc=result_desc,
+                        next_check_at=None,
+                        updated_at=timezone.now(),
+                    )
+                    if settled and mpesa_receipt and found['sale_id']:
+                        Sale.objects.filter(id=found['sale_id']).update(mpesa_transaction_id=mpesa_receipt)
+            
+            # Redeliveries of a callback already applied are acknowledged the same way
             return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
             
-        except Transaction.DoesNotExist:
-            return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Transaction not found'})
         except Exception as e:
             return JsonResponse({'ResultCode': 1, 'ResultDesc': str(e)})
     
@@ -235,9 +197,10 @@ def mpesa_callback(request):
 
 
 @login_required
+@query_budget(6)
 def sale_detail(request, sale_id):
     """View sale details and print receipt"""
-    sale = get_object_or_404(Sale, id=sale_id)
+    sale = get_object_or_404(Sale.objects.select_related('created_by'), id=sale_id)
     items = sale.items.select_related('product')
     
     context = {
@@ -277,48 +240,75 @@ def check_payment_status(request, checkout_request_id):
 
 
 @login_required
+@query_budget(6)
 def search_product(request):
     """Search product by name, SKU, or barcode"""
     query = request.GET.get('q', '')
+    catalog = get_catalog()
     
     if query:
-        products = Product.objects.filter(
-            is_active=True
-        ).filter(
-            models.Q(name__icontains=query) |
-            models.Q(sku__icontains=query) |
-            models.Q(barcode__icontains=query)
-        )[:10]
-        
-        results = [{
-            'id': p.id,
-            'name': p.name,
-            'sku': p.sku,
-            'barcode': p.barcode,
-            'selling_price': str(p.selling_price),
-            'current_stock': p.current_stock,
-            'image': p.image.url if p.image else None
-        } for p in products]
+        # Typeahead runs per keystroke, so it stays on the in-memory catalog;
+        # the database search backends serve the product list and admin
+        results = [entry.as_dict() for entry in catalog.search(query, limit=10)]
+        return JsonResponse({'products': results, 'version': catalog.version})
+    
+    return JsonResponse({'products': [], 'version': catalog.version})
+
+
+@login_required
+@query_budget(4)
+def scan_product(request):
+    """
+    Resolve scanned barcodes/SKUs by exact match
+    GET ?code=... for a single scan, POST {"codes": [...]} for a batch upload
+    from a handheld. Lookups are served from the in-memory catalog.
+    """
+    catalog = get_catalog()
+    
+    if request.method == 'POST':
+        try:
+            codes = json.loads(request.body).get('codes', [])
+        except (ValueError, AttributeError):
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        if not isinstance(codes, list) or len(codes) > settings.SCAN_BATCH_LIMIT:
+            return JsonResponse({
+                'error': f'codes must be a list of at most {settings.SCAN_BATCH_LIMIT} items'
+            }, status=400)
         
-        return JsonResponse({'products': results})
+        codes = [str(code) for code in codes]
+        found = catalog.lookup_many(codes)
+        return JsonResponse({
+            'results': [
+                {'code': code, 'product': found[code].as_scan() if found[code] else None}
+                for code in codes
+            ],
+            'version': catalog.version,
+        })
     
-    return JsonResponse({'products': []})
+    code = request.GET.get('code', '')
+    entry = catalog.lookup_many([code])[code] if code.strip() else None
+    if entry is None:
+        return JsonResponse({'code': code, 'product': None, 'version': catalog.version}, status=404)
+    return JsonResponse({'code': code, 'product': entry.as_scan(), 'version': catalog.version})
+
+
+@login_required
+@query_budget(3)
+def catalog_version(request):
+    """Cheap staleness check for tills holding a copy of the catalog"""
+    return JsonResponse({'version': get_catalog().version})
 
 
 @login_required
 def daily_sales_report(request):
     """Generate daily sales report"""
-    today = timezone.now().date()
-    sales = Sale.objects.filter(created_at__date=today)
+    today = timezone.localdate()
+    sales = Sale.objects.filter(**created_between(today, today))
     
-    total_sales = sum(sale.total_amount for sale in sales)
-    total_transactions = sales.count()
-    cash_sales = sales.filter(payment_method='CASH').aggregate(
-        total=models.Sum('total_amount')
-    )['total'] or 0
-    mpesa_sales = sales.filter(payment_method='MPESA').aggregate(
-        total=models.Sum('total_amount')
-    )['total'] or 0
+    total_transactions, total_sales = rollups.sales_totals(today, today)
+    by_method = rollups.sales_by_payment_method(today, today)
+    cash_sales = by_method.get('CASH', (0, 0))[1]
+    mpesa_sales = by_method.get('MPESA', (0, 0))[1]
     
     context = {
         'date': today,
@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 # from decimal import Decimal
 
+from apps.inventory.counters import NumberAllocator
+
 # Create your models here.
 class Supplier(models.Model):
     name = models.CharField(max_length=200)
@@ -58,18 +60,14 @@ class PurchaseOrder(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.po_number:
-            from django.utils import timezone
-            date_str = timezone.now().strftime('%Y%m%d')
-            last_po = PurchaseOrder.objects.filter(po_number__startswith=f'PO-{date_str}').order_by('-po_number').first()
-            if last_po:
-                last_num = int(last_po.po_number.split('-')[-1])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-            self.po_number = f'PO-{date_str}-{new_num:04d}'
+            # Generate PO number: PO-YYYYMMDD-XXXX
+            self.po_number = po_numbers.next()
         super().save(*args, **kwargs)
 
 
+po_numbers = NumberAllocator('PO', model=PurchaseOrder, field='po_number')
+
+
 class PurchaseOrderItem(models.Model):
     purchase_order = models.ForeignKey(PurchaseOrder, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey('products.Product', on_delete=models.PROTECT)
@@ -2,13 +2,14 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db import transaction
+from django.utils import timezone
 
 from .models import Supplier, PurchaseOrder, PurchaseOrderItem
 from .forms import SupplierForm, PurchaseOrderForm
 from apps.payments.daraja import DarajaAPI
 from apps.payments.models import Transaction
 from apps.products.models import Product
-from apps.inventory.models import StockMovement
+from apps.inventory.services import add_stock, record_movements
 from django.conf import settings
 from decimal import Decimal
 
@@ -140,24 +141,24 @@ def receive_purchase_order(request, po_id):
     
     if request.method == 'POST':
         with transaction.atomic():
-            # Update stock for each item
-            for item in po.items.all():
-                product = item.product
-                stock_before = product.current_stock
-                product.current_stock += item.quantity
-                product.save()
-                
-                # Record stock movement
-                StockMovement.objects.create(
-                    product=product,
-                    movement_type='IN',
-                    quantity=item.quantity,
-                    reference=po.po_number,
-                    notes=f'Received from {po.supplier.name}',
-                    stock_before=stock_before,
-                    stock_after=product.current_stock,
-                    created_by=request.user
-                )
+            po = PurchaseOrder.objects.select_for_update().get(id=po_id)
+            if po.status == 'RECEIVED':
+                messages.warning(request, f'Purchase Order {po.po_number} has already been received.')
+                return redirect('suppliers:purchase_order_detail', po_id=po_id)
+            
+            # Update stock for all items in one locked, set-based write
+            quantities = {}
+            for product_id, quantity in po.items.values_list('product_id', 'quantity'):
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            changes = add_stock(quantities)
+            
+            # Record stock movements
+            record_movements(
+                changes, 'IN',
+                reference=po.po_number,
+                notes=f'Received from {po.supplier.name}',
+                user=request.user
+            )
             
             # Update PO status
             po.status = 'RECEIVED'
@@ -0,0 +1,207 @@
+"""
+End-to-end view benchmarks
+Each hot view is requested through the Django test client and measured for
+latency percentiles, query count and peak Python memory. Results are saved
+as a JSON baseline and later runs fail when a view regresses past it.
+
+Latency is measured on warm caches (the first requests are discarded), the
+way tills see it. Benchmarks that change data (checkout) reset it before
+each request, outside the timings. Memory is measured on a separate request under tracemalloc
+so tracing overhead doesn't distort the timings.
+"""
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+
+def last_days(days=30):
+    today = timezone.localdate()
+    return {'start_date': str(today - timedelta(days=days - 1)), 'end_date': str(today)}
+
+
+def stk_callback(checkout_request_id):
+    """Body of a successful STK push callback from Daraja"""
+    return json.dumps({'Body': {'stkCallback': {
+        'MerchantRequestID': '29115-34620561-1',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': 0,
+        'ResultDesc': 'The service request is processed successfully.',
+        'CallbackMetadata': {'Item': [
+            {'Name': 'Amount', 'Value': 1.0},
+            {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'},
+            {'Name': 'PhoneNumber', 'Value': 254708374149},
+        ]},
+    }}})
+
+
+def checkout_cart(context):
+    """A cash sale of one to three of the benchmark's cart products"""
+    rng = context['rng']
+    products = rng.sample(sorted(context['cart_stock']), min(len(context['cart_stock']), rng.randint(1, 3)))
+    return json.dumps({
+        'items': [{'product_id': product_id, 'quantity': 1} for product_id in products],
+        'payment_method': 'CASH',
+    })
+
+
+def reset_cart_stock(context):
+    """Put the cart products' stock back so every checkout can succeed"""
+    from apps.products.models import Product
+
+    for product_id, stock in context['cart_stock'].items():
+        Product.objects.filter(id=product_id).update(current_stock=stock)
+
+
+class ViewBenchmark:
+    """
+    One view and how to request it; request(context) returns client kwargs
+    and prepare(context), if given, runs untimed before every request
+    """
+
+    def __init__(self, name, url, method='get', request=None, prepare=None):
+        self.name = name
+        self.url = url
+        self.method = method
+        self.request = request or (lambda context: {})
+        self.prepare = prepare or (lambda context: None)
+
+    def call(self, client, context):
+        response = getattr(client, self.method)(reverse(self.url), **self.request(context))
+        if response.streaming:
+            # A streamed export does its work while being read
+            for _ in response.streaming_content:
+                pass
+        return response
+
+
+BENCHMARKS = [
+    ViewBenchmark('new_sale', 'sales:new_sale'),
+    ViewBenchmark('checkout', 'sales:new_sale', method='post', prepare=reset_cart_stock, request=lambda context: {
+        'data': checkout_cart(context),
+        'content_type': 'application/json',
+    }),
+    ViewBenchmark('search_product', 'sales:search_product', request=lambda context: {
+        'data': {'q': context['rng'].choice(context['queries'])},
+    }),
+    ViewBenchmark('dashboard', 'dashboard'),
+    ViewBenchmark('stock_list', 'inventory:stock_list'),
+    ViewBenchmark('profit_report', 'reports:profit_report', request=lambda context: {
+        'data': last_days(),
+    }),
+    ViewBenchmark('export_sales_csv', 'reports:export_sales_csv', request=lambda context: {
+        'data': last_days(),
+    }),
+    ViewBenchmark('mpesa_callback', 'payments:mpesa_callback', method='post', request=lambda context: {
+        'data': stk_callback(context['rng'].choice(context['checkout_ids'])),
+        'content_type': 'application/json',
+    }),
+]
+
+
+def percentile(timings, fraction):
+    """Nearest-rank percentile of sorted timings"""
+    return timings[max(0, min(len(timings) - 1, round(fraction * len(timings)) - 1))]
+
+
+def measure(benchmark, client, context, requests=50, warmup=5):
+    """Latency percentiles (ms), queries per request and peak memory (KiB)"""
+    for _ in range(warmup):
+        benchmark.prepare(context)
+        benchmark.call(client, context)
+
+    timings = []
+    queries = []
+    status = None
+    for _ in range(requests):
+        benchmark.prepare(context)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = benchmark.call(client, context)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+        status = response.status_code
+
+    benchmark.prepare(context)
+    tracemalloc.start()
+    try:
+        benchmark.call(client, context)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'status': status,
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'p99_ms': round(percentile(timings, 0.99), 2),
+        'max_ms': round(timings[-1], 2),
+        'queries': max(queries),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def compare(baseline, current, threshold=0.25, min_delta_ms=2.0):
+    """
+    Regressions of current against baseline, as readable messages
+    Latency (p95) and memory may grow by `threshold`; latency changes under
+    min_delta_ms are noise and ignored. Query counts are deterministic, so
+    any increase is a regression.
+    """
+    problems = []
+    for name, now in current.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if now['status'] != before['status']:
+            problems.append(f"{name}: status {before['status']} -> {now['status']}")
+        if now['queries'] > before['queries']:
+            problems.append(f"{name}: {before['queries']} -> {now['queries']} queries")
+        if (now['p95_ms'] > before['p95_ms'] * (1 + threshold)
+                and now['p95_ms'] - before['p95_ms'] >= min_delta_ms):
+            problems.append(f"{name}: p95 {before['p95_ms']}ms -> {now['p95_ms']}ms")
+        if now['peak_kib'] > before['peak_kib'] * (1 + threshold):
+            problems.append(f"{name}: peak memory {before['peak_kib']}KiB -> {now['peak_kib']}KiB")
+    return problems
+
+
+def context_for(seed=0):
+    """Search terms, callback ids and checkout products drawn from the data being benchmarked"""
+    from apps.payments.models import Transaction
+    from apps.products.models import Product
+
+    names = Product.objects.filter(is_active=True).values_list('name', flat=True)[:500]
+    words = sorted({word.lower() for name in names for word in name.split() if len(word) >= 3})
+    skus = list(Product.objects.filter(is_active=True).values_list('sku', flat=True)[:100])
+    cart_stock = dict(
+        Product.objects.filter(is_active=True, current_stock__gt=0)
+        .order_by('id').values_list('id', 'current_stock')[:20]
+    )
+    return {
+        'rng': random.Random(seed),
+        'queries': words + skus or ['bread'],
+        'checkout_ids': list(
+            Transaction.objects.exclude(checkout_request_id='')
+            .values_list('checkout_request_id', flat=True)[:100]
+        ) or ['ws_CO_000000000000000000'],
+        'cart_stock': cart_stock,
+    }
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def save(path, meta, results):
+    with open(path, 'w') as handle:
+        json.dump({'meta': meta, 'views': results}, handle, indent=2, sort_keys=True)
+        handle.write('\n')
@@ -0,0 +1,121 @@
+"""
+Two-tier cache with per-app namespaces and tag invalidation
+
+Tiers:
+  local   the 'default' cache, in process memory
+  shared  the 'shared' cache when one is configured (Redis, Memcached, the
+          database ...), otherwise the local tier doubles as the shared one
+
+Cached values are stored under keys that embed the current version of every
+tag they depend on. invalidate('sales') bumps that tag's version in the
+shared tier, so every worker stops reading entries built from older data and
+they simply age out. Without a shared tier an invalidation only reaches the
+process that made it; other workers catch up when their entries expire.
+
+    reports_cache = Namespace('reports')
+    summary = reports_cache.get_or_set('dashboard', build, tags=[SALES, STOCK])
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+
+from .profiling import count
+
+
+# Tags invalidated by the write paths
+PRODUCTS = 'products'   # product or category rows saved or deleted
+SALES = 'sales'         # sales created, edited or deleted
+STOCK = 'stock'         # stock levels moved (every movement goes through the stock service)
+LOW_STOCK = 'low_stock' # a product's stock crossed its reorder level
+
+_MISSING = object()
+
+
+def local_cache():
+    return caches['default']
+
+
+def shared_cache():
+    if 'shared' in settings.CACHES:
+        return caches['shared']
+    return caches['default']
+
+
+def _tag_key(tag):
+    return f'tag:{tag}'
+
+
+def tag_versions(tags):
+    """Current version of each tag, in order (one round trip when all exist)"""
+    if not tags:
+        return []
+    cache = shared_cache()
+    keys = [_tag_key(tag) for tag in tags]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        if key not in found:
+            # Start from the clock so a tag that was evicted never comes back
+            # with a version some stale entry was stored under
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+        versions.append(found[key])
+    return versions
+
+
+def invalidate(*tags):
+    """Retire every cached value that depends on any of the tags"""
+    cache = shared_cache()
+    for tag in tags:
+        try:
+            cache.incr(_tag_key(tag))
+        except ValueError:
+            cache.set(_tag_key(tag), time.time_ns(), timeout=None)
+
+
+def invalidate_on_commit(*tags):
+    """Invalidate once the current transaction commits (immediately outside one)"""
+    transaction.on_commit(lambda: invalidate(*tags))
+
+
+class Namespace:
+    """Cache keys for one app, prefixed with its name"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def make_key(self, key, versions=()):
+        return ':'.join([self.name, str(key), *(str(version) for version in versions)])
+
+    def get_or_set(self, key, compute, timeout=DEFAULT_TIMEOUT, tags=()):
+        """
+        Return the cached value for key, calling compute() on a miss
+        Reads try the local tier, then the shared tier; a miss fills both.
+        """
+        full_key = self.make_key(key, tag_versions(tags))
+        local = local_cache()
+        value = local.get(full_key, _MISSING)
+        if value is not _MISSING:
+            count('cache_hit')
+            return value
+
+        shared = shared_cache()
+        if shared is not local:
+            value = shared.get(full_key, _MISSING)
+        if value is _MISSING:
+            count('cache_miss')
+            value = compute()
+            if shared is not local:
+                shared.set(full_key, value, timeout)
+        else:
+            count('cache_hit')
+        local.set(full_key, value, timeout)
+        return value
+
+    def delete(self, key, tags=()):
+        full_key = self.make_key(key, tag_versions(tags))
+        local_cache().delete(full_key)
+        shared_cache().delete(full_key)
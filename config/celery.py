@@ -29,6 +29,11 @@ app.conf.beat_schedule = {
         'task': 'apps.reports.tasks.generate_daily_sales_report',
         'schedule': crontab(hour=23, minute=0),
     },
+    # Remove old rendered report files at 3 AM
+    'purge-report-jobs': {
+        'task': 'apps.reports.tasks.purge_report_jobs',
+        'schedule': crontab(hour=3, minute=0),
+    },
     # Check pending M-Pesa transactions every 5 minutes
     'check-pending-transactions': {
         'task': 'apps.payments.tasks.check_pending_transactions',
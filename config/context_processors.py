@@ -1,15 +1,34 @@
 from apps.products.models import Product
-from django.db.models import Sum, Count, F, Q, Avg
+from django.db.models import F
+
+from config.caching import LOW_STOCK, PRODUCTS, Namespace
+
+inventory_cache = Namespace('inventory')
+
+# Safety net for writes that bypass the stock service (raw SQL, shell updates)
+LOW_STOCK_COUNT_TIMEOUT = 60
+
+
+def low_stock_count():
+    """
+    Number of active products at or below their reorder level
+    Cached until a product changes or stock crosses a reorder level.
+    """
+    return inventory_cache.get_or_set(
+        'low_stock_count',
+        lambda: Product.objects.filter(
+            is_active=True,
+            current_stock__lte=F('reorder_level')
+        ).count(),
+        timeout=LOW_STOCK_COUNT_TIMEOUT,
+        tags=[PRODUCTS, LOW_STOCK],
+    )
+
 
 def inventory_context(request):
     """Add inventory alerts to all template contexts"""
     if request.user.is_authenticated:
-        low_stock_count = Product.objects.filter(
-            is_active=True,
-            current_stock__lte=F('reorder_level')
-        ).count()
-        
         return {
-            'low_stock_count': low_stock_count
+            'low_stock_count': low_stock_count()
         }
-    return {}
\ No newline at end of file
+    return {}
@@ -0,0 +1,59 @@
+"""
+Date range helpers for list and report views
+
+Views take calendar dates from the query string but filter on created_at.
+Filtering with created_at__date wraps the column in a function, which stops
+the database using the created_at indexes. These helpers turn local
+(TIME_ZONE) dates into aware, half-open datetime bounds instead:
+start 00:00 <= created_at < (end + 1 day) 00:00.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def parse_date(value, default=None):
+    """Parse YYYY-MM-DD, returning default for blank or malformed input"""
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return default
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+def day_bounds(start, end):
+    """Aware datetimes covering local days start..end inclusive, half-open"""
+    return start_of_day(start), start_of_day(end + timedelta(days=1))
+
+
+def date_range(request, default_days=None):
+    """
+    (start, end) dates from the start_date/end_date query parameters
+    With default_days, a missing start defaults to that many days ago and a
+    missing end to today; otherwise missing ends are None (unbounded).
+    """
+    today = timezone.localdate()
+    start = parse_date(request.GET.get('start_date'))
+    end = parse_date(request.GET.get('end_date'))
+    if default_days is not None:
+        start = start or today - timedelta(days=default_days)
+        end = end or today
+    return start, end
+
+
+def created_between(start, end, field='created_at'):
+    """
+    Filter kwargs for rows created on local days start..end
+    Either end may be None to leave that side open.
+    """
+    filters = {}
+    if start is not None:
+        filters[f'{field}__gte'] = start_of_day(start)
+    if end is not None:
+        filters[f'{field}__lt'] = start_of_day(end + timedelta(days=1))
+    return filters
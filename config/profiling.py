@@ -0,0 +1,158 @@
+"""
+Opt-in request profiling
+
+ProfilingMiddleware records, for a sample of requests, wall time, database
+time and query count, template render time and cache hits/misses, and
+writes one JSON line per request to the 'profiling' logger (a rotating file,
+see LOGGING). Summarise the log with `manage.py profile_summary`.
+
+A request can also be run under cProfile, either at PROFILING_CPROFILE_RATE
+or on demand by sending `X-Profile: <PROFILING_TOKEN>`; the .prof dumps go
+to PROFILING_DIR and open with snakeviz or `python -m pstats`.
+
+Settings: PROFILING_ENABLED, PROFILING_SAMPLE_RATE, PROFILING_CPROFILE_RATE,
+PROFILING_TOKEN, PROFILING_DIR.
+"""
+import cProfile
+import contextvars
+import json
+import logging
+import random
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.base import Template
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger('profiling')
+
+_current = contextvars.ContextVar('profiling_stats', default=None)
+
+
+class RequestStats:
+    """Timings and counters for one request"""
+
+    def __init__(self):
+        self.db_ms = 0.0
+        self.queries = 0
+        self.template_ms = 0.0
+        self.template_depth = 0
+        self.counters = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - started) * 1000
+            self.queries += 1
+
+
+def count(name, n=1):
+    """Bump a counter on the request being profiled, if any (e.g. cache hits)"""
+    stats = _current.get()
+    if stats is not None:
+        stats.counters[name] = stats.counters.get(name, 0) + n
+
+
+_template_render = Template.render
+
+
+def _timed_render(self, context):
+    stats = _current.get()
+    if stats is None:
+        return _template_render(self, context)
+    # Included templates render inside their parent; only time the outermost
+    stats.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _template_render(self, context)
+    finally:
+        stats.template_depth -= 1
+        if not stats.template_depth:
+            stats.template_ms += (time.perf_counter() - started) * 1000
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        Template.render = _timed_render
+
+    def __call__(self, request):
+        profile = self._wants_cprofile(request)
+        if not profile and random.random() >= settings.PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        profiler = cProfile.Profile() if profile else None
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats):
+                if profiler:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler:
+                        profiler.disable()
+        finally:
+            _current.reset(token)
+        wall_ms = (time.perf_counter() - started) * 1000
+
+        match = request.resolver_match
+        record = {
+            'ts': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'wall_ms': round(wall_ms, 2),
+            'db_ms': round(stats.db_ms, 2),
+            'queries': stats.queries,
+            'template_ms': round(stats.template_ms, 2),
+            'cache_hits': stats.counters.get('cache_hit', 0),
+            'cache_misses': stats.counters.get('cache_miss', 0),
+        }
+        if profiler:
+            record['profile'] = self._dump(profiler, record)
+        logger.info(json.dumps(record))
+        return response
+
+    def _wants_cprofile(self, request):
+        header = request.headers.get('X-Profile')
+        if header and settings.PROFILING_TOKEN and constant_time_compare(header, settings.PROFILING_TOKEN):
+            return True
+        return random.random() < settings.PROFILING_CPROFILE_RATE
+
+    def _dump(self, profiler, record):
+        directory = Path(settings.PROFILING_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = (record['view'] or 'unresolved').replace(':', '.')
+        path = directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{record['wall_ms']:.0f}ms.prof"
+        profiler.dump_stats(path)
+        return str(path)
+
+
+def read_log(path):
+    """Records from a profiling log and its rotated backups, oldest file first"""
+    path = Path(path)
+    # RotatingFileHandler keeps profile.log.1 (newest) .. profile.log.N (oldest)
+    backups = [file for file in path.parent.glob(path.name + '.*') if file.suffix[1:].isdigit()]
+    backups.sort(key=lambda file: -int(file.suffix[1:]))
+    for file in [*backups, path]:
+        if not file.exists():
+            continue
+        with open(file) as handle:
+            for line in handle:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
@@ -0,0 +1,144 @@
+"""
+Per-view query budgets
+
+Views declare the most queries a request may run, session and user lookups
+included:
+
+    @login_required
+    @query_budget(6)
+    def dashboard(request): ...
+
+QueryBudgetMiddleware counts every query of the request (and of a streamed
+response body) with a database execute wrapper. What happens on overrun is
+set by QUERY_BUDGET_ACTION:
+  raise  raise QueryBudgetExceeded, so tests fail
+  warn   log a warning with the repeated statements, for production
+  off    don't count at all
+Views without a budget fall back to QUERY_BUDGET_DEFAULT. With DEBUG on,
+responses carry X-Query-Count and X-Query-Budget headers.
+"""
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Collapse IN lists and VALUES rows so the same statement groups together
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    """Declare the maximum number of queries a view may run per request"""
+    def decorator(view):
+        # Outer decorators built with functools.wraps (login_required etc.)
+        # copy the attribute onto their wrappers
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def normalize(sql):
+    return _IN_LIST.sub('(...)', sql)
+
+
+class QueryRecorder:
+    """Execute wrapper that counts statements and remembers their SQL"""
+
+    def __init__(self):
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements[normalize(sql)] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return sum(self.statements.values())
+
+    def duplicates(self, limit=5):
+        """The most repeated statements as (times, sql), the usual sign of an N+1"""
+        return [(times, sql) for sql, times in self.statements.most_common(limit) if times > 1]
+
+    def report(self, name, budget):
+        lines = [f'{name} ran {self.count} queries (budget {budget})']
+        for times, sql in self.duplicates():
+            lines.append(f'  {times}x {sql[:300]}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def record_queries():
+    recorder = QueryRecorder()
+    with connection.execute_wrapper(recorder):
+        yield recorder
+
+
+def check(recorder, name, budget, action=None):
+    action = action or settings.QUERY_BUDGET_ACTION
+    if budget is None or recorder.count <= budget:
+        return
+    if action == 'raise':
+        raise QueryBudgetExceeded(recorder.report(name, budget))
+    logger.warning(recorder.report(name, budget))
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        action = settings.QUERY_BUDGET_ACTION
+        if action == 'off':
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        budget = getattr(request, 'query_budget', settings.QUERY_BUDGET_DEFAULT)
+        name = getattr(request, 'query_budget_view', request.path)
+        if response.streaming:
+            response.streaming_content = self._stream(response.streaming_content, recorder, name, budget, action)
+            return response
+
+        check(recorder, name, budget, action)
+        if settings.DEBUG:
+            response['X-Query-Count'] = recorder.count
+            response['X-Query-Budget'] = budget if budget is not None else ''
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', settings.QUERY_BUDGET_DEFAULT)
+        request.query_budget_view = f'{view_func.__module__}.{getattr(view_func, "__qualname__", "view")}'
+
+    def _stream(self, content, recorder, name, budget, action):
+        """Keep counting while a streamed body is read, then check the total"""
+        with connection.execute_wrapper(recorder):
+            yield from content
+        check(recorder, name, budget, action)
+
+
+class QueryBudgetTestMixin:
+    """TestCase helpers: fail on budget overruns and assert query ceilings"""
+
+    def setUp(self):
+        super().setUp()
+        override = self.settings(QUERY_BUDGET_ACTION='raise')
+        override.enable()
+        self.addCleanup(override.disable)
+
+    @contextmanager
+    def assertMaxQueries(self, limit, name='block'):
+        """Like assertNumQueries, but an upper bound, with repeated SQL in the failure"""
+        with record_queries() as recorder:
+            yield recorder
+        if recorder.count > limit:
+            self.fail(recorder.report(name, limit))
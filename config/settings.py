@@ -47,6 +47,8 @@ if DEBUG:
     INSTALLED_APPS += ['django_extensions', 'debug_toolbar']
 
 MIDDLEWARE = [
+    'config.profiling.ProfilingMiddleware',  # Removes itself unless PROFILING_ENABLED
+    'config.query_budget.QueryBudgetMiddleware',  # Early, so it sees every query
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Static files
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -92,6 +94,27 @@ DATABASES = {
     )
 }
 
+# Caches
+# 'default' is per-process memory. Point SHARED_CACHE_BACKEND/LOCATION at a
+# cache every worker can see (e.g. django.core.cache.backends.redis.RedisCache
+# and redis://localhost:6379/1) to share entries and invalidations.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'inventorypro',
+        'TIMEOUT': config('CACHE_TIMEOUT', default=300, cast=int),
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+SHARED_CACHE_BACKEND = config('SHARED_CACHE_BACKEND', default='')
+if SHARED_CACHE_BACKEND:
+    CACHES['shared'] = {
+        'BACKEND': SHARED_CACHE_BACKEND,
+        'LOCATION': config('SHARED_CACHE_LOCATION', default=''),
+        'TIMEOUT': config('CACHE_TIMEOUT', default=300, cast=int),
+        'KEY_PREFIX': 'inventorypro',
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -160,6 +183,29 @@ MPESA_SHORTCODE = config('MPESA_SHORTCODE', default='174379')
 MPESA_PASSKEY = config('MPESA_PASSKEY', default='')
 MPESA_INITIATOR_NAME = config('MPESA_INITIATOR_NAME', default='testapi')
 MPESA_SECURITY_CREDENTIAL = config('MPESA_SECURITY_CREDENTIAL', default='')
+# Overrides the sandbox/production URL, e.g. http://127.0.0.1:8765 for the
+# local stub (manage.py daraja_stub)
+MPESA_BASE_URL = config('MPESA_BASE_URL', default='')
+
+# Daraja HTTP client: seconds to connect and to wait for a response, retries
+# for idempotent calls (token, status queries), and pooled connections kept
+# per process
+MPESA_CONNECT_TIMEOUT = config('MPESA_CONNECT_TIMEOUT', default=3.05, cast=float)
+MPESA_READ_TIMEOUT = config('MPESA_READ_TIMEOUT', default=15, cast=float)
+MPESA_MAX_RETRIES = config('MPESA_MAX_RETRIES', default=2, cast=int)
+MPESA_POOL_SIZE = config('MPESA_POOL_SIZE', default=10, cast=int)
+
+# AsyncDarajaAPI: most requests one client keeps in flight, and its request
+# rate per second (0 = unlimited); keep the rate under the app's Daraja quota
+MPESA_ASYNC_MAX_IN_FLIGHT = config('MPESA_ASYNC_MAX_IN_FLIGHT', default=100, cast=int)
+MPESA_RATE_LIMIT = config('MPESA_RATE_LIMIT', default=50, cast=float)
+
+# Pending-payment reconciler (payments.tasks.check_pending_transactions):
+# transactions per chunk, status queries in flight, and seconds a run may
+# take before leaving the rest to the next run (it runs every 5 minutes)
+MPESA_RECONCILE_CHUNK_SIZE = config('MPESA_RECONCILE_CHUNK_SIZE', default=200, cast=int)
+MPESA_RECONCILE_CONCURRENCY = config('MPESA_RECONCILE_CONCURRENCY', default=20, cast=int)
+MPESA_RECONCILE_MAX_SECONDS = config('MPESA_RECONCILE_MAX_SECONDS', default=240, cast=int)
 
 # Callback URLs for M-Pesa (update with your domain)
 MPESA_CALLBACK_URL = config('MPESA_CALLBACK_URL', default='http://localhost:8000/api/payments/callback/')
@@ -179,6 +225,52 @@ DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@inventoryapp.
 LOW_STOCK_ALERT_ENABLED = config('LOW_STOCK_ALERT_ENABLED', default=True, cast=bool)
 LOW_STOCK_ALERT_EMAIL = config('LOW_STOCK_ALERT_EMAIL', default='admin@inventoryapp.com')
 
+# Document numbering (SALE-YYYYMMDD-NNNN / PO-YYYYMMDD-NNNN)
+# Sale numbers are taken before the checkout transaction, so failed checkouts
+# leave gaps; larger blocks let busy workers reserve several numbers per
+# counter increment, at the cost of more gaps
+DOCUMENT_NUMBER_BLOCK_SIZE = config('DOCUMENT_NUMBER_BLOCK_SIZE', default=1, cast=int)
+
+# POS catalog snapshot (apps.products.catalog)
+# Seconds between version checks per worker, and max age before a full rebuild
+CATALOG_CHECK_INTERVAL = config('CATALOG_CHECK_INTERVAL', default=2.0, cast=float)
+CATALOG_MAX_AGE = config('CATALOG_MAX_AGE', default=600, cast=int)
+
+# Maximum number of codes in one batched barcode scan request
+SCAN_BATCH_LIMIT = config('SCAN_BATCH_LIMIT', default=500, cast=int)
+
+# Product search (apps.products.search)
+# 'auto' picks SQLite FTS5 or PostgreSQL pg_trgm from the database vendor;
+# 'sqlite', 'postgres', 'ngram' or a dotted path select one explicitly
+PRODUCT_SEARCH_BACKEND = config('PRODUCT_SEARCH_BACKEND', default='auto')
+
+# Rows per day/key in the sales rollups; more shards means less lock contention
+# between tills on PostgreSQL, at the cost of slightly bigger range reads
+SALES_ROLLUP_SHARDS = config('SALES_ROLLUP_SHARDS', default=4, cast=int)
+
+# Hours a rendered report file is kept (and reused for identical requests)
+REPORT_JOB_TTL = config('REPORT_JOB_TTL', default=24, cast=int)
+# Minutes a report job may stay pending or running before it is presumed lost
+# (e.g. its worker died) and identical requests get a fresh job
+REPORT_JOB_TIMEOUT = config('REPORT_JOB_TIMEOUT', default=30, cast=int)
+
+# Per-view query budgets (config.query_budget)
+# 'raise' fails the request (tests), 'warn' logs overruns, 'off' disables
+# counting; views without @query_budget get the default (empty for none)
+QUERY_BUDGET_ACTION = config('QUERY_BUDGET_ACTION', default='warn')
+QUERY_BUDGET_DEFAULT = config('QUERY_BUDGET_DEFAULT', default=50, cast=lambda v: int(v) if v else None)
+
+# Request profiling (config.profiling), off unless enabled
+# Sampled requests are logged as JSON lines to PROFILING_LOG_FILE; requests
+# sent with X-Profile: <PROFILING_TOKEN>, and a PROFILING_CPROFILE_RATE share
+# of all requests, are also run under cProfile with dumps in PROFILING_DIR
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.05, cast=float)
+PROFILING_CPROFILE_RATE = config('PROFILING_CPROFILE_RATE', default=0.0, cast=float)
+PROFILING_TOKEN = config('PROFILING_TOKEN', default='')
+PROFILING_DIR = config('PROFILING_DIR', default=str(BASE_DIR / 'logs' / 'profiles'))
+PROFILING_LOG_FILE = config('PROFILING_LOG_FILE', default=str(BASE_DIR / 'logs' / 'profile.log'))
+
 # Logging Configuration
 LOGGING = {
     'version': 1,
@@ -188,6 +280,10 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {message}',
             'style': '{',
         },
+        'message': {
+            'format': '{message}',
+            'style': '{',
+        },
     },
     'handlers': {
         'console': {
@@ -200,6 +296,14 @@ LOGGING = {
             'filename': BASE_DIR / 'logs' / 'django.log',
             'formatter': 'verbose',
         },
+        'profiling': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': PROFILING_LOG_FILE,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+            'formatter': 'message',
+        },
     },
     'loggers': {
         'django': {
@@ -211,6 +315,16 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'config': {
+            'handlers': ['console', 'file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'profiling': {
+            'handlers': ['profiling'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 